@@ -0,0 +1,575 @@
+# analytics.py
+import csv
+import json
+import multiprocessing
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from itertools import repeat
+import cache
+import config
+import metrics
+from offsets import split_line
+from books import books_table
+from students import students_table
+from borrow import borrow_table
+from store import RowsByKey, id_number
+
+try:
+    import numpy as np
+except ImportError:  # optional: the same numbers come out of plain loops
+    np = None
+
+# ----- circulation analytics -----
+# Loans per month and per year, per author and per semester, turnover
+# (loans per book in the catalog), mean loan length and the books nobody
+# borrowed, over the whole history or one year of it:
+#
+#     result = analytics.analyze(year=2024)
+#     result["by-month"]   -> [{"month": "2024-01", "loans": ..., ...}, ...]
+#     analytics.export(result, "2024.json")
+#
+# The history is read as columns: parallel arrays of dense ID codes and
+# day ordinals, one set per partition. Each partition is boiled down to
+# counts that simply add up (loans, returns and loan days per month,
+# loans per book and per student), so partitions can be summarized
+# anywhere and merged in any order; authors, semesters and titles are
+# joined in at the end from the (small) books and students tables.
+#
+# borrow.csv is cut into line-aligned byte ranges of up to PARTITION_BYTES;
+# it is in borrow order, so each range is a run of consecutive months and
+# years. From PARALLEL_MIN_BYTES on, the ranges are read by a pool of
+# worker processes (spawned, never forked from the GUI's or the server's
+# threads). Journal entries not yet compacted are patched in as the
+# ranges are read. With the SQLite backend, the rows are summarized in
+# this process.
+#
+# With NumPy installed, IDs are parsed to integers and counted with
+# bincount, and the period filter is a mask; without it the same numbers
+# come from dict lookups and loops, a few times slower.
+
+PARALLEL_MIN_BYTES = 32 * 1024 * 1024
+PARTS_PER_WORKER = 4
+PARTITION_BYTES = 32 * 1024 * 1024  # at most, so memory stays bounded at any size
+
+TABLES = {
+    "summary": ["metric", "value"],
+    "by-month": ["month", "loans", "returned", "open", "mean_days"],
+    "by-year": ["year", "loans", "returned", "mean_days", "turnover"],
+    "by-author": ["author", "titles", "loans", "turnover"],
+    "by-semester": ["semester", "students", "loans", "loans_per_student"],
+    "never-borrowed": ["book_id", "title", "author", "year"],
+}
+
+# ----- columns -----
+class Columns:
+    """
+    One partition of the history as parallel int arrays (array("q"), or
+    NumPy arrays). book and student are codes: indexes into book_ids and
+    student_ids, or the ID numbers themselves where those are None.
+    """
+    def __init__(self):
+        self.book = array("q")
+        self.student = array("q")
+        self.month = array("q")     # year * 12 + month - 1 of borrow_date
+        self.borrowed = array("q")  # day ordinals; 0 if borrow_date isn't a date
+        self.returned = array("q")  # 0 while the loan is open
+        self.book_ids = []
+        self.student_ids = []
+        self.book_codes = {}        # book_id -> code, while filling
+        self.student_codes = {}
+        self.known = {}             # date text -> (ordinal, month index) or None
+
+    def add(self, book_id, student_id, borrow_date, return_date):
+        """One loan (a row from memory)."""
+        self.book.append(code_of(book_id, self.book_codes, self.book_ids))
+        self.student.append(code_of(student_id, self.student_codes, self.student_ids))
+        day, month = day_and_month(borrow_date, self.known) or (0, 0)
+        self.month.append(month)
+        self.borrowed.append(day)
+        self.returned.append((day_and_month(return_date, self.known) or (0, 0))[0] if return_date else 0)
+
+    def extend(self, books, students, borrow_dates, return_dates):
+        """
+        Whole columns of fields at once. Only the distinct values are
+        looked at in Python; the per-row work is map() over dicts, in C.
+        """
+        for v in dict.fromkeys(books):
+            code_of(v, self.book_codes, self.book_ids)
+        for v in dict.fromkeys(students):
+            code_of(v, self.student_codes, self.student_ids)
+        self.book.extend(map(self.book_codes.__getitem__, books))
+        self.student.extend(map(self.student_codes.__getitem__, students))
+        days, months, ends = self.date_codes(borrow_dates, return_dates)
+        self.month.extend(map(months.__getitem__, borrow_dates))
+        self.borrowed.extend(map(days.__getitem__, borrow_dates))
+        self.returned.extend(map(ends.__getitem__, return_dates))
+        return self
+
+    def date_codes(self, borrow_dates, return_dates):
+        """{text: ordinal}, {text: month index} and {text: return ordinal} for the distinct dates."""
+        days, months, ends = {}, {}, {}
+        for v in dict.fromkeys(borrow_dates):
+            days[v], months[v] = day_and_month(v, self.known) or (0, 0)
+        for v in dict.fromkeys(return_dates):
+            ends[v] = (day_and_month(v, self.known) or (0, 0))[0]
+        return days, months, ends
+
+def code_of(value, codes, ids):
+    code = codes.get(value)
+    if code is None:
+        code = codes[value] = len(ids)
+        ids.append(value)
+    return code
+
+def numpy_columns(books, students, borrow_dates, return_dates):
+    """Columns with NumPy arrays: IDs are parsed and coded in C, dates through their distinct values."""
+    cols = Columns()
+    cols.book, cols.book_ids = id_codes(books)
+    cols.student, cols.student_ids = id_codes(students)
+    days, months, ends = cols.date_codes(borrow_dates, return_dates)
+    n = len(borrow_dates)
+    cols.month = np.fromiter(map(months.__getitem__, borrow_dates), dtype=np.int64, count=n)
+    cols.borrowed = np.fromiter(map(days.__getitem__, borrow_dates), dtype=np.int64, count=n)
+    cols.returned = np.fromiter(map(ends.__getitem__, return_dates), dtype=np.int64, count=n)
+    return cols
+
+def id_codes(values):
+    """(codes, ids) for a column of IDs: the numbers themselves if they are all
+    small enough to count by (ids None), else indexes into the distinct IDs."""
+    if not values:
+        return np.zeros(0, dtype=np.int64), []
+    raw = np.array(values)
+    try:
+        nums = raw.astype(np.int64)
+    except ValueError:
+        uniq, codes = np.unique(raw, return_inverse=True)
+        return codes.astype(np.int64), uniq.tolist()
+    if nums.min() < 0 or nums.max() > 4 * len(nums) + 65536:
+        uniq, codes = np.unique(nums, return_inverse=True)
+        return codes.astype(np.int64), uniq.tolist()
+    return nums, None
+
+def as_array(values):
+    return values if isinstance(values, np.ndarray) else np.frombuffer(values, dtype=np.int64)
+
+def day_and_month(value, known):
+    """(ordinal, month index) of a "YYYY-MM-DD" (str or bytes), None if it isn't one."""
+    found = known.get(value)
+    if found is None and value not in known:
+        try:
+            text = value.decode("ascii") if isinstance(value, bytes) else value
+            d = date.fromisoformat(text.strip())
+            found = (d.toordinal(), d.year * 12 + d.month - 1)
+        except (ValueError, UnicodeDecodeError):
+            found = None
+        known[value] = found
+    return found
+
+def year_range(year=None, start=None, end=None):
+    """[lo, hi) borrow_date ordinals for a year or a start/end (inclusive) date range."""
+    lo = hi = None
+    if year:
+        lo, hi = date(int(year), 1, 1).toordinal(), date(int(year), 12, 31).toordinal() + 1
+    if start:
+        lo = date.fromisoformat(str(start)).toordinal()
+    if end:
+        hi = date.fromisoformat(str(end)).toordinal() + 1
+    return lo, hi
+
+def effect_values(parts, pos, kind, val):
+    """A CSV line's fields (bytes) after a journal effect on its row; None if deleted."""
+    if kind == "del":
+        return None
+    if kind == "row":
+        parts = [b""] * len(pos)
+    else:
+        parts = list(parts)
+    for name, v in val.items():
+        p = pos.get(name)
+        if p is not None:
+            while len(parts) <= p:
+                parts.append(b"")
+            parts[p] = str(v if v is not None else "").encode("utf-8")
+    return parts
+
+def read_partition(path, start, end, pos, effects, newline=b"\n"):
+    """
+    Columns for the lines of path starting in [start, end), with the
+    journal's effects ({borrow_id: (kind, fields)}) applied; also returns
+    the borrow_ids the effects were found for. newline: how lines end
+    (csv.writer writes "\r\n"), so no field needs stripping.
+    """
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    width = len(pos)
+    lines = data.split(newline)
+    if lines and not lines[-1]:
+        lines.pop()
+    if b'"' not in data and set(map(bytes.count, lines, repeat(b","))) <= {width - 1}:
+        # every line has every field: split them all in one go and take
+        # each column as a slice
+        flat = b",".join(lines).split(b",")
+        columns = [flat[i::width] for i in range(width)]
+    else:
+        # blank lines, quoted fields or short rows: one line at a time
+        rows = []
+        for line in lines:
+            parts = line.split(b",") if b'"' not in line else [v.encode("utf-8") for v in split_line(line)]
+            if len(parts) >= width:
+                rows.append(parts)
+        columns = [[r[i] for r in rows] for i in range(width)]
+
+    seen = set()
+    if effects:
+        keys = columns[pos["borrow_id"]]
+        wanted = {k.encode("utf-8"): k for k in effects}
+        hit = wanted.keys() & set(keys)
+        if hit:
+            if len(hit) < 64:
+                found = [(keys.index(k), k) for k in hit]  # a C scan per key
+            else:
+                found = [(i, k) for i, k in enumerate(keys) if k in hit]
+            for i, k in found:
+                key = wanted[k]
+                seen.add(key)
+                parts = effect_values([c[i] for c in columns], pos, *effects[key])
+                if parts is None:
+                    columns[pos["borrow_date"]][i] = b""  # deleted: no date, not counted
+                else:
+                    for c, v in zip(columns, parts):
+                        c[i] = v
+    fields = (columns[pos["book_id"]], columns[pos["student_id"]],
+              columns[pos["borrow_date"]], columns[pos["return_date"]])
+    return (numpy_columns(*fields) if np is not None else Columns().extend(*fields)), seen
+
+def columns_from_rows(rows):
+    """Columns for borrow rows (mappings), e.g. a table already in memory."""
+    cols = Columns()
+    for r in rows:
+        cols.add(str(r["book_id"]), str(r["student_id"]), r["borrow_date"], r["return_date"])
+    return cols
+
+# ----- partial counts -----
+# {"loans": n, "months": {month index: [loans, returned, loan days]},
+#  "books": {book_id: loans}, "students": {student_id: loans}}
+# where NumPy counted plain ID numbers, "books" and "students" are arrays
+# of loans by ID number instead, which merge by adding; merge() turns
+# them into dicts at the end.
+
+def id_names(ids, codes):
+    """The IDs (as strings) for codes."""
+    if ids is None:
+        return [str(c) for c in codes]
+    return [ids[c].strip().decode("utf-8") if isinstance(ids[c], bytes) else str(ids[c]) for c in codes]
+
+def count_by(ids, counts):
+    out = {}
+    for k, n in zip(ids, counts):
+        if n:
+            out[k] = out.get(k, 0) + n  # "12" and "12\r" are one book
+    return out
+
+def summarize(cols, lo=None, hi=None):
+    """The partial counts of one partition, for loans borrowed in [lo, hi)."""
+    out = {"loans": 0, "months": {}, "books": {}, "students": {}}
+    if not len(cols.month):
+        return out
+    if np is not None:
+        borrowed = as_array(cols.borrowed)
+        keep = borrowed > 0
+        if lo is not None:
+            keep &= borrowed >= lo
+        if hi is not None:
+            keep &= borrowed < hi
+        borrowed = borrowed[keep]
+        out["loans"] = len(borrowed)
+        if not out["loans"]:
+            return out
+        month = as_array(cols.month)[keep]
+        returned = as_array(cols.returned)[keep]
+        first = int(month.min())
+        m = month - first
+        back = returned > 0
+        loans = np.bincount(m)
+        rets = np.bincount(m[back], minlength=len(loans))
+        days = np.bincount(m[back], weights=(returned - borrowed)[back], minlength=len(loans))
+        for i in np.flatnonzero(loans).tolist():
+            out["months"][first + i] = [int(loans[i]), int(rets[i]), int(days[i])]
+        for field, codes, names in (("books", cols.book, cols.book_ids), ("students", cols.student, cols.student_ids)):
+            per = np.bincount(as_array(codes)[keep])
+            if names is None:
+                out[field] = per
+            else:
+                used = np.flatnonzero(per)
+                out[field] = count_by(id_names(names, used.tolist()), per[used].tolist())
+        return out
+    lo = lo if lo is not None else 1
+    hi = hi if hi is not None else date.max.toordinal() + 1
+    months = out["months"]
+    per_book = [0] * len(cols.book_ids)
+    per_student = [0] * len(cols.student_ids)
+    for b, mi, bk, st, r in zip(cols.borrowed, cols.month, cols.book, cols.student, cols.returned):
+        if not lo <= b < hi:
+            continue  # outside the period, or no borrow date
+        c = months.get(mi)
+        if c is None:
+            c = months[mi] = [0, 0, 0]
+        c[0] += 1
+        if r:
+            c[1] += 1
+            c[2] += r - b
+        per_book[bk] += 1
+        per_student[st] += 1
+    out["loans"] = sum(per_book)
+    out["books"] = count_by(id_names(cols.book_ids, range(len(per_book))), per_book)
+    out["students"] = count_by(id_names(cols.student_ids, range(len(per_student))), per_student)
+    return out
+
+def merge(partials):
+    out = {"loans": 0, "months": {}, "books": {}, "students": {}}
+    by_number = {"books": None, "students": None}
+    for p in partials:
+        out["loans"] += p["loans"]
+        for mi, (n, r, d) in p["months"].items():
+            c = out["months"].setdefault(mi, [0, 0, 0])
+            c[0] += n
+            c[1] += r
+            c[2] += d
+        for field in ("books", "students"):
+            part = p[field]
+            if isinstance(part, dict):
+                counts = out[field]
+                for k, n in part.items():
+                    counts[k] = counts.get(k, 0) + n
+                continue
+            total = by_number[field]
+            if total is None:
+                by_number[field] = part
+            else:
+                if len(total) < len(part):
+                    total, part = part, total
+                total[:len(part)] += part
+                by_number[field] = total
+    for field, total in by_number.items():
+        if total is not None:
+            used = np.flatnonzero(total)
+            found = zip(map(str, used.tolist()), total[used].tolist())
+            counts = out[field]
+            if not counts:
+                out[field] = dict(found)
+            for k, n in found:  # only left over when some partitions had other IDs
+                counts[k] = counts.get(k, 0) + n
+    return out
+
+def partition_counts(path, start, end, pos, effects, lo, hi, newline):
+    """Worker entry point: the partial counts of one byte range of borrow.csv."""
+    cols, seen = read_partition(path, start, end, pos, effects, newline)
+    return summarize(cols, lo, hi), seen
+
+# ----- reading the history -----
+def partitions(path, parts):
+    """Header fields, the header's line ending and about parts line-aligned
+    (start, end) byte ranges after the header."""
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        header = f.readline()
+        first = f.tell()
+        bounds = [first]
+        for i in range(1, parts):
+            at = first + (size - first) * i // parts
+            if at <= bounds[-1]:
+                continue
+            f.seek(at)
+            f.readline()  # on to the start of the next line
+            if bounds[-1] < f.tell() < size:
+                bounds.append(f.tell())
+    bounds.append(size)
+    return split_line(header), header[-2:], list(zip(bounds, bounds[1:]))
+
+def workers():
+    return config.ANALYTICS_WORKERS or os.cpu_count() or 1
+
+def history_counts(lo=None, hi=None, progress=None):
+    """Merged partial counts for loans borrowed in [lo, hi) (ordinals; None: open-ended)."""
+    table = borrow_table
+    # even when the table is loaded, borrow.csv plus its journal is the
+    # quicker read: columns in C rather than a dict per loan
+    if config.BACKEND == "sqlite":
+        with metrics.timed("analytics.read", "borrow") as span:
+            counts = summarize(columns_from_rows(table.scan()), lo, hi)
+            span.rows = counts["loans"]
+        return counts
+    table.ensure_file()
+    effects = table.journal_effects()
+    size = os.path.getsize(table.path)
+    n = workers() if size >= PARALLEL_MIN_BYTES else 1
+    parts = max(n * PARTS_PER_WORKER if n > 1 else 1, -(-size // PARTITION_BYTES))
+    header, header_end, ranges = partitions(table.path, parts)
+    pos = {name: i for i, name in enumerate(header)}
+    if any(f not in pos for f in ("borrow_id", "book_id", "student_id", "borrow_date", "return_date")):
+        return summarize(columns_from_rows(table.scan()), lo, hi)
+    newline = b"\r\n" if header_end == b"\r\n" else b"\n"
+    jobs = [(table.path, start, end, pos, effects, lo, hi, newline) for start, end in ranges]
+    partials, seen = [], set()
+    with metrics.timed("analytics.read", "borrow") as span:
+        if n > 1 and len(jobs) > 1:
+            with ProcessPoolExecutor(max_workers=n, mp_context=multiprocessing.get_context("spawn")) as pool:
+                futures = [pool.submit(partition_counts, *job) for job in jobs]
+                for i, fut in enumerate(futures, 1):
+                    p, keys = fut.result()
+                    partials.append(p)
+                    seen |= keys
+                    if progress:
+                        progress(i, len(jobs))
+        else:
+            for i, job in enumerate(jobs, 1):
+                p, keys = partition_counts(*job)
+                partials.append(p)
+                seen |= keys
+                if progress:
+                    progress(i, len(jobs))
+        # rows the journal added after the CSV was written
+        added = [table.make(val) for k, (kind, val) in effects.items() if kind == "row" and k not in seen]
+        if added:
+            partials.append(summarize(columns_from_rows(added), lo, hi))
+        counts = merge(partials)
+        span.rows, span.bytes_read = counts["loans"], size
+    return counts
+
+# ----- the tables -----
+def month_name(mi):
+    return f"{mi // 12}-{mi % 12 + 1:02d}"
+
+def rekey(mapping, counts):
+    """mapping's stored rows, and counts keyed the way they are: a join can
+    then walk the rows without normalizing the ID of every one."""
+    rows, norm = (mapping.rows, mapping.norm) if isinstance(mapping, RowsByKey) else (mapping, str)
+    out = {}
+    for k, n in counts.items():
+        k = norm(k)
+        out[k] = out.get(k, 0) + n
+    return rows, out
+
+def mean(days, n):
+    return round(days / n, 2) if n else ""
+
+def rate(n, d):
+    return round(n / d, 3) if d else ""
+
+class History:
+    """The borrow table as a cache dependency. Its version() would load the
+    table, which the analytics never use; the file stamp is the same token."""
+    def version(self):
+        if config.BACKEND == "sqlite":
+            return borrow_table.version()
+        return borrow_table.file_stamp()
+
+history = History()
+
+@metrics.instrument("analytics.analyze")
+def analyze(year=None, start=None, end=None, progress=None):
+    """
+    Circulation analytics for loans borrowed in year (or between start and
+    end, inclusive; default: the whole history): a dict of TABLES name ->
+    list of row dicts, kept until a table changes. progress(done, total) is
+    called as partitions finish.
+    """
+    return cache.remember("analytics.analyze", (year, start, end), (history, books_table, students_table),
+                          lambda: tables(year, start, end, progress))
+
+def tables(year, start, end, progress):
+    lo, hi = year_range(year, start, end)
+    counts = history_counts(lo, hi, progress)
+    books = books_table.mapping()
+    students = students_table.mapping()
+    loans = counts["loans"]
+    returned = sum(c[1] for c in counts["months"].values())
+    days = sum(c[2] for c in counts["months"].values())
+
+    by_month = [{"month": month_name(mi), "loans": n, "returned": r, "open": n - r, "mean_days": mean(d, r)}
+                for mi, (n, r, d) in sorted(counts["months"].items())]
+    years = {}
+    for mi, (n, r, d) in counts["months"].items():
+        c = years.setdefault(mi // 12, [0, 0, 0])
+        c[0] += n
+        c[1] += r
+        c[2] += d
+    by_year = [{"year": y, "loans": n, "returned": r, "mean_days": mean(d, r), "turnover": rate(n, len(books))}
+               for y, (n, r, d) in sorted(years.items())]
+
+    book_rows, book_loans = rekey(books, counts["books"])
+    authors = {}  # author -> [titles, loans]
+    never = []
+    for k, b in book_rows.items():
+        n = book_loans.get(k, 0)
+        author = b.get("author") or "Unknown"
+        a = authors.get(author)
+        if a is None:
+            a = authors[author] = [0, 0]
+        a[0] += 1
+        a[1] += n
+        if not n:
+            never.append({"book_id": b["book_id"], "title": b.get("title", ""), "author": b.get("author", ""),
+                          "year": b.get("year", "")})
+    never.sort(key=lambda d: id_number(d["book_id"]))
+    deleted = sum(n for k, n in book_loans.items() if k not in book_rows)
+    if deleted:
+        authors.setdefault("Unknown", [0, 0])[1] += deleted  # loans of deleted books
+    by_author = [{"author": a, "titles": t, "loans": n, "turnover": rate(n, t)}
+                 for a, (t, n) in authors.items() if n]
+    by_author.sort(key=lambda d: (-d["loans"], d["author"]))
+
+    student_rows, student_loans = rekey(students, counts["students"])
+    semesters = {}  # semester -> [students, loans]
+    for k, s in student_rows.items():
+        c = semesters.setdefault(s.get("semester") or "Unknown", [0, 0])
+        c[0] += 1
+        c[1] += student_loans.get(k, 0)
+    unknown = sum(n for k, n in student_loans.items() if k not in student_rows)
+    if unknown:
+        semesters.setdefault("Unknown", [0, 0])[1] += unknown
+    by_semester = [{"semester": sem, "students": c, "loans": n, "loans_per_student": rate(n, c)}
+                   for sem, (c, n) in sorted(semesters.items(), key=lambda kv: (kv[0] == "Unknown", id_number(kv[0]), kv[0]))]
+
+    summary = [
+        ("period", f"{year}" if year else f'{start or "start"} to {end or "today"}' if start or end else "all"),
+        ("loans", loans),
+        ("returned", returned),
+        ("open", loans - returned),
+        ("mean_loan_days", mean(days, returned)),
+        ("books", len(books)),
+        ("books_borrowed", sum(1 for k, n in book_loans.items() if n and k in book_rows)),
+        ("never_borrowed", len(never)),
+        ("turnover", rate(loans, len(books))),
+        ("students", len(students)),
+        ("active_students", sum(1 for n in student_loans.values() if n)),
+    ]
+    return {
+        "summary": [{"metric": k, "value": v} for k, v in summary],
+        "by-month": by_month,
+        "by-year": by_year,
+        "by-author": by_author,
+        "by-semester": by_semester,
+        "never-borrowed": never,
+    }
+
+# ----- export -----
+def export(result, path, table=None):
+    """
+    Write analytics to path: JSON (*.json) holds every table, or only
+    table if given; anything else is CSV of one table (default summary).
+    """
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", newline="", encoding="utf-8") as f:
+        if path.endswith(".json"):
+            json.dump(result[table] if table else result, f, indent=2, ensure_ascii=False)
+        else:
+            table = table or "summary"
+            writer = csv.writer(f)
+            writer.writerow(TABLES[table])
+            for r in result[table]:
+                writer.writerow([r.get(name, "") for name in TABLES[table]])
+    os.replace(tmp, path)
@@ -0,0 +1,420 @@
+# benchmark.py
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from fnmatch import fnmatch
+
+# ---------- Benchmark suite ----------
+# Times the library calls behind every screen at several library sizes and
+# writes the numbers as JSON, so two versions can be compared:
+#
+#   python benchmark.py -o before.json                 (1k, 100k and 1M rows)
+#   python benchmark.py --sizes 1k,100k -k "borrow.*" --compare before.json
+#
+# Each size gets a synthetic library from datagen.py (generated once, kept
+# under --cache) and a fresh copy of it, opened by a child process through
+# LIBRARY_DATA_DIR, so every size starts cold and writes never leak into
+# the next run. A size of N means N books, N / 10 students and about N
+# loans.
+#
+# Benchmarks are plain functions registered with @benchmark(group); they
+# get a Context of sample IDs and search terms and return op(i), the call
+# to time (or (op, max_calls)). For each one the first call is reported on
+# its own (it pays for lazy index builds), then the call is repeated until
+# --budget seconds are spent, and the median, p95 and best time are kept.
+# The query result cache (cache.py) is off unless --query-cache is given,
+# so repeated calls time the queries themselves.
+#
+# gui.py needs a display, so the "gui" group repeats what its data fetches
+# (fetch_books, fetch_students, refresh_borrow_tree) call.
+
+DEFAULT_SIZES = "1k,100k,1M"
+
+# ---------- registry ----------
+BENCHMARKS = []
+
+def benchmark(group):
+    def register(fn):
+        BENCHMARKS.append((f'{group}.{fn.__name__.replace("bench_", "")}', fn))
+        return fn
+    return register
+
+class Context:
+    """Samples drawn once from the loaded library, shared by all benchmarks."""
+    def __init__(self, rng, books, students, borrow):
+        book_rows = books.load_books()
+        student_rows = students.load_students()
+        self.book_ids = [b["book_id"] for b in rng.sample(book_rows, min(1000, len(book_rows)))]
+        self.student_ids = [s["student_id"] for s in rng.sample(student_rows, min(1000, len(student_rows)))]
+        words = [w for b in rng.sample(book_rows, min(200, len(book_rows))) for w in b["title"].split()]
+        self.words = words or ["book"]
+        names = [s["name"].split()[-1] for s in rng.sample(student_rows, min(200, len(student_rows)))]
+        self.names = names or ["ann"]
+        free = [b["book_id"] for b in borrow.available_books()]
+        rng.shuffle(free)
+        self.free_books = free
+        self.lent = []  # (student_id, book_id) borrowed by bench_borrow_book
+        history = borrow.list_all_borrowed()
+        self.dates = sorted(r["borrow_date"] for r in rng.sample(history, min(100, len(history))))
+
+def pick(items, i):
+    return items[i % len(items)]
+
+# ---------- books ----------
+@benchmark("books")
+def bench_find_book(ctx):
+    from books import find_book
+    return lambda i: find_book(pick(ctx.book_ids, i))
+
+@benchmark("books")
+def bench_search_word(ctx):
+    from books import search_books
+    return lambda i: search_books(pick(ctx.words, i))
+
+@benchmark("books")
+def bench_search_prefix(ctx):
+    from books import search_books
+    return lambda i: search_books(pick(ctx.words, i)[:3])
+
+@benchmark("books")
+def bench_search_substring(ctx):
+    from books import search_books
+    return lambda i: search_books(pick(ctx.words, i)[1:5])
+
+@benchmark("books")
+def bench_iter_books(ctx):
+    from books import iter_books
+    return lambda i: sum(1 for _ in iter_books())
+
+@benchmark("books")
+def bench_add_book(ctx):
+    from books import add_book
+    return lambda i: add_book(f"Benchmark Title {i}", "Bench Author", "2020", "")
+
+# ---------- students ----------
+@benchmark("students")
+def bench_find_student(ctx):
+    from students import find_student
+    return lambda i: find_student(pick(ctx.student_ids, i))
+
+@benchmark("students")
+def bench_search_students(ctx):
+    from students import search_students
+    return lambda i: search_students(pick(ctx.names, i))
+
+@benchmark("students")
+def bench_add_student(ctx):
+    from students import add_student
+    return lambda i: add_student(f"Bench Student {i}", "1", "")
+
+# ---------- borrow / return ----------
+@benchmark("borrow")
+def bench_is_borrowed(ctx):
+    from borrow import is_book_currently_borrowed
+    return lambda i: is_book_currently_borrowed(pick(ctx.book_ids, i))
+
+@benchmark("borrow")
+def bench_loans_of_student(ctx):
+    from borrow import books_borrowed_by_student
+    return lambda i: books_borrowed_by_student(pick(ctx.student_ids, i))
+
+@benchmark("borrow")
+def bench_borrow_book(ctx):
+    from borrow import borrow_book
+    def op(i):
+        sid, bid = pick(ctx.student_ids, i), ctx.free_books[i]
+        ok, msg = borrow_book(sid, bid)
+        if ok:
+            ctx.lent.append((sid, bid))
+    return op, len(ctx.free_books)
+
+@benchmark("borrow")
+def bench_return_book(ctx):
+    from borrow import return_book
+    return (lambda i: return_book(student_id=ctx.lent[i][0], book_id=ctx.lent[i][1])), len(ctx.lent)
+
+# ---------- reports ----------
+@benchmark("reports")
+def bench_currently_borrowed(ctx):
+    from borrow import list_borrowed_details, iter_borrowed
+    return lambda i: list_borrowed_details(iter_borrowed(status="open"))
+
+@benchmark("reports")
+def bench_available_books(ctx):
+    from borrow import available_books
+    return lambda i: available_books()
+
+@benchmark("reports")
+def bench_top_borrowed(ctx):
+    from borrow import top_borrowed_books
+    return lambda i: top_borrowed_books(20)
+
+@benchmark("reports")
+def bench_open_loans(ctx):
+    from borrow import students_with_open_loans
+    return lambda i: students_with_open_loans()
+
+@benchmark("reports")
+def bench_overdue(ctx):
+    from borrow import overdue_loans
+    return lambda i: overdue_loans()
+
+@benchmark("reports")
+def bench_history_range(ctx):
+    from borrow import count_borrowed
+    return lambda i: count_borrowed(start=pick(ctx.dates, i), end=pick(ctx.dates, i + 7))
+
+@benchmark("reports")
+def bench_students_borrows(ctx):
+    from borrow import students_with_borrows
+    return lambda i: students_with_borrows()
+
+@benchmark("reports")
+def bench_fines(ctx):
+    from borrow import fines_by_student
+    return lambda i: fines_by_student()
+
+# ---------- GUI refreshes ----------
+@benchmark("gui")
+def bench_refresh_books(ctx):
+    from books import load_books
+    from borrow import currently_borrowed_ids
+    return lambda i: (load_books(), currently_borrowed_ids())
+
+@benchmark("gui")
+def bench_search_books_action(ctx):
+    from books import search_books
+    from borrow import currently_borrowed_ids
+    return lambda i: (search_books(pick(ctx.words, i)), currently_borrowed_ids())
+
+@benchmark("gui")
+def bench_search_as_you_type(ctx):
+    # one call types a two-word query a key at a time, each search narrowing
+    # the previous results like LiveSearch does (up to its REFINE_MAX rows)
+    from books import search_books
+    def op(i):
+        q, rows = pick(ctx.words, i) + " " + pick(ctx.words, i + 7)[:4], None
+        for n in range(1, len(q) + 1):
+            rows = search_books(q[:n], rows if rows is not None and len(rows) <= 500 else None)
+    return op
+
+@benchmark("gui")
+def bench_refresh_students(ctx):
+    from students import load_students
+    return lambda i: load_students()
+
+@benchmark("gui")
+def bench_refresh_borrows(ctx):
+    from borrow import list_borrowed_details
+    return lambda i: list_borrowed_details()
+
+# ---------- timing ----------
+def percentile(sorted_times, p):
+    return sorted_times[min(len(sorted_times) - 1, int(len(sorted_times) * p))]
+
+def measure(op, budget, max_calls=None, min_calls=3):
+    """Time op(0) on its own, then op(1), op(2)... until budget seconds are spent."""
+    if max_calls == 0:
+        return None
+    t = time.perf_counter()
+    op(0)
+    first = time.perf_counter() - t
+    times, spent, i = [], 0.0, 1
+    if first > budget:
+        min_calls = 1
+    while max_calls is None or i < max_calls:
+        if spent >= budget and len(times) >= min_calls:
+            break
+        t = time.perf_counter()
+        op(i)
+        dt = time.perf_counter() - t
+        times.append(dt)
+        spent += dt
+        i += 1
+    result = {"first_ms": round(first * 1000, 4), "calls": len(times)}
+    if times:
+        times.sort()
+        result.update({
+            "median_ms": round(percentile(times, 0.5) * 1000, 4),
+            "p95_ms": round(percentile(times, 0.95) * 1000, 4),
+            "min_ms": round(times[0] * 1000, 4),
+            "ops_per_s": round(len(times) / spent, 1) if spent else None,
+        })
+    else:
+        result.update({"median_ms": result["first_ms"], "p95_ms": result["first_ms"],
+                       "min_ms": result["first_ms"], "ops_per_s": None})
+    return result
+
+def max_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+# ---------- child: one size, already pointed at its data by LIBRARY_DATA_DIR ----------
+def run_child(pattern, budget, seed):
+    results = []
+
+    def record(name, stats):
+        if stats is not None:
+            results.append(dict(name=name, **stats))
+
+    def once(name, fn):
+        t = time.perf_counter()
+        fn()
+        ms = round((time.perf_counter() - t) * 1000, 4)
+        record(name, {"first_ms": ms, "calls": 1, "median_ms": ms, "p95_ms": ms, "min_ms": ms, "ops_per_s": None})
+
+    import config
+    modules = {}
+
+    def import_modules():
+        import books, students, borrow
+        modules.update(books=books, students=students, borrow=borrow)
+
+    once("startup.import", import_modules)
+    books, students, borrow = modules["books"], modules["students"], modules["borrow"]
+    if config.BACKEND == "sqlite" and not books.books_table.all():
+        from sqlite_store import import_csv
+        once("startup.import_sqlite", lambda: [import_csv(t) for t in
+                                               (books.books_table, students.students_table, borrow.borrow_table)])
+    once("startup.first_load", lambda: (books.load_books(), students.load_students(), borrow.load_borrowed()))
+
+    ctx = Context(random.Random(seed), books, students, borrow)
+    for name, fn in BENCHMARKS:
+        if not fnmatch(name, pattern):
+            continue
+        made = fn(ctx)
+        op, max_calls = made if isinstance(made, tuple) else (made, None)
+        record(name, measure(op, budget, max_calls))
+    return {"results": results, "max_rss_mb": max_rss_mb()}
+
+# ---------- parent ----------
+def dataset(cache, size, seed, years):
+    """Folder with the generated library for size, made on first use."""
+    from datagen import END, generate
+    path = os.path.join(cache, f"{size}-seed{seed}-y{years}-{END.isoformat()}")
+    manifest = os.path.join(path, "datagen.json")
+    if os.path.exists(manifest):
+        with open(manifest, encoding="utf-8") as f:
+            return path, json.load(f)
+    return path, generate(path, books=size, years=years, seed=seed, end=END, force=True)
+
+def run_size(label, args):
+    from datagen import parse_size
+    size = parse_size(label)
+    t = time.perf_counter()
+    source, manifest = dataset(args.cache, size, args.seed, args.years)
+    say(f"[{label}] data ready in {time.perf_counter() - t:.1f}s: {manifest['counts']}")
+    work = tempfile.mkdtemp(prefix=f"library-bench-{label}-")
+    try:
+        for name in ("books.csv", "students.csv", "borrow.csv"):
+            shutil.copy(os.path.join(source, name), work)
+        env = dict(os.environ, LIBRARY_DATA_DIR=work, LIBRARY_BACKEND=args.backend, LIBRARY_SYNC=args.sync,
+                   LIBRARY_QUERY_CACHE=str(args.query_cache))
+        cmd = [sys.executable, os.path.abspath(__file__), "--child", "-k", args.k,
+               "--budget", str(args.budget), "--seed", str(args.seed)]
+        proc = subprocess.run(cmd, env=env, stdout=subprocess.PIPE, cwd=os.path.dirname(os.path.abspath(__file__)))
+        if proc.returncode:
+            raise RuntimeError(f"benchmark run for {label} failed (exit {proc.returncode})")
+        out = json.loads(proc.stdout)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    for r in out["results"]:
+        r["size"] = label
+        say(f'[{label}] {r["name"]:<32} first {r["first_ms"]:>10.3f} ms   median {r["median_ms"]:>10.3f} ms'
+            f'   p95 {r["p95_ms"]:>10.3f} ms   ({r["calls"]} calls)')
+    return {"size": label, "rows": manifest["counts"], "max_rss_mb": out["max_rss_mb"]}, out["results"]
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(results, baseline_path, threshold):
+    """Print benchmarks whose median got slower than threshold x baseline; returns how many."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["size"], r["name"]): r for r in json.load(f)["results"]}
+    slower = 0
+    for r in results:
+        old = baseline.get((r["size"], r["name"]))
+        if not old or not old["median_ms"]:
+            continue
+        ratio = r["median_ms"] / old["median_ms"]
+        if ratio > threshold:
+            slower += 1
+            say(f'SLOWER [{r["size"]}] {r["name"]}: {old["median_ms"]:.3f} -> {r["median_ms"]:.3f} ms ({ratio:.2f}x)')
+        elif ratio < 1 / threshold:
+            say(f'faster [{r["size"]}] {r["name"]}: {old["median_ms"]:.3f} -> {r["median_ms"]:.3f} ms ({ratio:.2f}x)')
+    return slower
+
+def say(msg):
+    print(msg, file=sys.stderr, flush=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="benchmark.py", description="Time the library at several sizes")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"comma separated (default {DEFAULT_SIZES})")
+    parser.add_argument("-k", default="*", help="only benchmarks matching this pattern, e.g. 'reports.*'")
+    parser.add_argument("--budget", type=float, default=1.0, help="seconds to spend repeating each call")
+    parser.add_argument("--backend", choices=["csv", "sqlite"], default=os.environ.get("LIBRARY_BACKEND", "csv"))
+    parser.add_argument("--sync", choices=["full", "group", "off"], default="off",
+                        help="durability while measuring (default off, so disk flushes don't hide the code's cost)")
+    parser.add_argument("--query-cache", type=int, default=0,
+                        help="query results to cache (default 0: every call runs the query)")
+    parser.add_argument("--years", type=int, default=3, help="years of generated loan history")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--cache", default=os.path.join(tempfile.gettempdir(), "library-bench-data"),
+                        help="where generated libraries are kept between runs")
+    parser.add_argument("-o", "--output", help="write the JSON results here (default: stdout)")
+    parser.add_argument("--compare", help="earlier JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown ratio reported by --compare")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--list", action="store_true", help="list the benchmarks and exit")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, _ in BENCHMARKS:
+            print(name)
+        return 0
+    if args.child:
+        json.dump(run_child(args.k, args.budget, args.seed), sys.stdout)
+        return 0
+
+    runs, results = [], []
+    for label in [s.strip() for s in args.sizes.split(",") if s.strip()]:
+        run, rows = run_size(label, args)
+        runs.append(run)
+        results.extend(rows)
+    report = {
+        "meta": {
+            "revision": git_revision(), "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(), "platform": platform.platform(),
+            "backend": args.backend, "sync": args.sync, "query_cache": args.query_cache,
+            "budget_s": args.budget, "seed": args.seed,
+        },
+        "runs": runs,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        return 1 if compare(results, args.compare, args.threshold) else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,13 @@
 # books.py
-import csv
 import os
 import sys
+import cache
+import config
+import metrics
 from datetime import datetime
+from store import as_text, open_table
+from records import Book
+from search import TextIndex
 
 # ----- path helpers (works in dev and when packaged with PyInstaller) -----
 def base_dir():
@@ -12,98 +17,102 @@ def base_dir():
         base = os.path.dirname(os.path.abspath(__file__))
     return base
 
-DATA_DIR = os.path.join(base_dir(), "data")
+DATA_DIR = config.DATA_DIR or os.path.join(base_dir(), "data")
 BOOKS_CSV = os.path.join(DATA_DIR, "books.csv")
 
+FIELDNAMES = ["book_id", "title", "author", "year", "isbn"]
+books_table = open_table(BOOKS_CSV, FIELDNAMES, "book_id", Book)
+books_table.attach_index("text", TextIndex({"title": 3, "author": 2, "isbn": 1}))
+
 # ----- initialization -----
 def ensure_books_file():
-    os.makedirs(DATA_DIR, exist_ok=True)
-    if not os.path.exists(BOOKS_CSV):
-        with open(BOOKS_CSV, "w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow(["book_id", "title", "author", "year", "isbn"])
+    books_table.ensure_file()
 
 # ----- low-level IO -----
+@metrics.instrument("books.load_books", rows=True)
 def load_books():
-    ensure_books_file()
-    rows = []
-    with open(BOOKS_CSV, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for r in reader:
-            rows.append(r)
-    return rows
+    return books_table.all()
 
 def save_books(rows):
-    ensure_books_file()
-    with open(BOOKS_CSV, "w", newline="", encoding="utf-8") as f:
-        fieldnames = ["book_id", "title", "author", "year", "isbn"]
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        for r in rows:
-            writer.writerow(r)
+    books_table.replace(rows)
 
 # ----- helpers -----
 def next_book_id():
-    rows = load_books()
-    max_id = 0
-    for r in rows:
-        try:
-            v = int(r.get("book_id", 0))
-            if v > max_id: max_id = v
-        except:
-            continue
-    return str(max_id + 1)
+    return books_table.next_ids()[0]
 
 # ----- CRUD operations -----
+@metrics.instrument("books.add_book")
 def add_book(title, author="", year="", isbn=""):
     bid = next_book_id()
-    rows = load_books()
-    rows.append({
+    books_table.insert({
         "book_id": bid,
         "title": title,
         "author": author,
         "year": year,
         "isbn": isbn
     })
-    save_books(rows)
     return bid
 
+@metrics.instrument("books.add_books_bulk")
+def add_books_bulk(items):
+    """
+    Add many books with one write. items is any iterable of dicts with
+    title/author/year/isbn (or tuples in that order), e.g. streamed from
+    store.read_records(). Returns (new ids, [(item number, error)]).
+    """
+    rows, errors = [], []
+    for n, item in enumerate(items, 1):
+        if not isinstance(item, dict):
+            item = dict(zip(["title", "author", "year", "isbn"], item))
+        title = as_text(item.get("title"))
+        if not title:
+            errors.append((n, "Title required"))
+            continue
+        rows.append({
+            "title": title,
+            "author": as_text(item.get("author")),
+            "year": as_text(item.get("year")),
+            "isbn": as_text(item.get("isbn"))
+        })
+    ids = books_table.next_ids(len(rows)) if rows else []
+    for bid, row in zip(ids, rows):
+        row["book_id"] = bid
+    books_table.insert_many(rows)
+    return ids, errors
+
+@metrics.instrument("books.update_book")
 def update_book(book_id, title=None, author=None, year=None, isbn=None):
-    rows = load_books()
-    updated = False
-    for r in rows:
-        if r["book_id"] == str(book_id):
-            if title is not None: r["title"] = title
-            if author is not None: r["author"] = author
-            if year is not None: r["year"] = year
-            if isbn is not None: r["isbn"] = isbn
-            updated = True
-            break
-    if updated:
-        save_books(rows)
-    return updated
+    changes = {}
+    if title is not None: changes["title"] = title
+    if author is not None: changes["author"] = author
+    if year is not None: changes["year"] = year
+    if isbn is not None: changes["isbn"] = isbn
+    return books_table.update(book_id, changes)
 
+@metrics.instrument("books.delete_book")
 def delete_book(book_id):
-    rows = load_books()
-    new_rows = [r for r in rows if r["book_id"] != str(book_id)]
-    if len(new_rows) != len(rows):
-        save_books(new_rows)
-        return True
-    return False
+    return books_table.delete(book_id)
 
+@metrics.instrument("books.find_book")
 def find_book(book_id):
-    rows = load_books()
-    for r in rows:
-        if r["book_id"] == str(book_id):
-            return r
-    return None
+    return books_table.get(book_id)
+
+def iter_books(predicate=None):
+    """Stream books (optionally only those where predicate(row) is true)."""
+    return books_table.scan(predicate=predicate)
 
-def search_books(query):
-    q = (query or "").strip().lower()
+@metrics.instrument("books.search_books", rows=True)
+@cache.cached("books.search_books", books_table)
+def search_books(query, within=None):
+    """Books matching every word of query (as a prefix) best first, then any
+    other book whose title/author/isbn contains query; an exact ID leads.
+    within: the results of a query this one extends, to narrow down instead
+    of searching the whole catalog (search-as-you-type)."""
+    q = (query or "").strip()
     if not q:
         return load_books()
-    out = []
-    for r in load_books():
-        if q in r.get("title","").lower() or q in r.get("author","").lower() or q in r.get("isbn","").lower() or q == r.get("book_id",""):
-            out.append(r)
+    out = books_table.search("text", q, within)
+    exact = find_book(q)
+    if exact is not None:
+        out = [exact] + [r for r in out if r["book_id"] != exact["book_id"]]
     return out
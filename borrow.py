@@ -1,8 +1,14 @@
 # borrow.py
-import csv
 import os
 import sys
+import cache
+import config
+import metrics
 from datetime import datetime
+from store import open_table
+from records import Loan
+from views import Circulation, Listener
+from due import DueIndex, LoanPolicy, compute_fines, iso, to_ordinal
 
 # ----- path helpers -----
 def base_dir():
@@ -12,60 +18,59 @@ def base_dir():
         base = os.path.dirname(os.path.abspath(__file__))
     return base
 
-DATA_DIR = os.path.join(base_dir(), "data")
+DATA_DIR = config.DATA_DIR or os.path.join(base_dir(), "data")
 BORROW_CSV = os.path.join(DATA_DIR, "borrow.csv")
+POLICY_JSON = os.path.join(DATA_DIR, "loan_policy.json")
+
+FIELDNAMES = ["borrow_id", "student_id", "book_id", "borrow_date", "return_date"]
+# borrow_id helps tracking; return_date empty when not returned
+borrow_table = open_table(BORROW_CSV, FIELDNAMES, "borrow_id", Loan)
+borrow_table.add_index("by_student", "student_id")
+borrow_table.add_index("by_book", "book_id")
+borrow_table.add_index("active_by_book", "book_id", where=("return_date", ""))
+borrow_table.add_index("by_return_date", "return_date")
+# single-loan lookups and returns in a process that hasn't loaded the
+# history (cli.py) read borrow.csv through borrow.csv.idx instead
+borrow_table.use_offsets("student_id", "book_id")
 
 # We'll import the other modules for checks (books / students)
-from books import find_book, load_books
-from students import find_student, load_students
+from books import find_book, load_books, books_table
+from students import find_student, load_students, students_table
+
+# live counters for availability / circulation (see views.py)
+circulation = Circulation(books_table, borrow_table)
+
+# open loans sorted by due date (see due.py); the due date depends on the
+# student's semester, so a new semester re-places that student's loans
+due_index = DueIndex(LoanPolicy.load(POLICY_JSON),
+                     lambda: borrow_table.lookup("by_return_date", ""),
+                     students_table.mapping,
+                     lambda sid: [r for r in borrow_table.lookup("by_student", sid) if not r["return_date"]])
+borrow_table.attach_index("due", due_index)
+students_table.attach_index("due", Listener(due_index.invalidate, due_index.student_changed))
 
 # ----- initialization -----
 def ensure_borrow_file():
-    os.makedirs(DATA_DIR, exist_ok=True)
-    if not os.path.exists(BORROW_CSV):
-        with open(BORROW_CSV, "w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            # borrow_id helps tracking; return_date empty when not returned
-            writer.writerow(["borrow_id", "student_id", "book_id", "borrow_date", "return_date"])
+    borrow_table.ensure_file()
 
 # ----- IO -----
+@metrics.instrument("borrow.load_borrowed", rows=True)
 def load_borrowed():
-    ensure_borrow_file()
-    rows = []
-    with open(BORROW_CSV, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for r in reader:
-            rows.append(r)
-    return rows
+    return borrow_table.all()
 
 def save_borrowed(rows):
-    ensure_borrow_file()
-    with open(BORROW_CSV, "w", newline="", encoding="utf-8") as f:
-        fieldnames = ["borrow_id", "student_id", "book_id", "borrow_date", "return_date"]
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        for r in rows:
-            writer.writerow(r)
+    borrow_table.replace(rows)
 
 # ----- helpers -----
 def next_borrow_id():
-    rows = load_borrowed()
-    max_id = 0
-    for r in rows:
-        try:
-            v = int(r.get("borrow_id", 0))
-            if v > max_id: max_id = v
-        except:
-            continue
-    return str(max_id + 1)
+    return borrow_table.next_ids()[0]
 
+@metrics.instrument("borrow.is_book_currently_borrowed")
 def is_book_currently_borrowed(book_id):
-    for r in load_borrowed():
-        if r["book_id"] == str(book_id) and not r.get("return_date"):
-            return True
-    return False
+    return bool(borrow_table.lookup("active_by_book", book_id))
 
 # ----- borrow / return operations -----
+@metrics.instrument("borrow.borrow_book")
 def borrow_book(student_id, book_id):
     ensure_borrow_file()
     # basic validations
@@ -73,66 +78,287 @@ def borrow_book(student_id, book_id):
         return False, "Student not found."
     if not find_book(book_id):
         return False, "Book not found."
-    if is_book_currently_borrowed(book_id):
-        return False, "Book already borrowed."
+    # check and insert under one lock, so two desks can't lend the same copy
+    with borrow_table.transaction():
+        if is_book_currently_borrowed(book_id):
+            return False, "Book already borrowed."
 
-    bid = next_borrow_id()
-    now = datetime.now().strftime("%Y-%m-%d")
-    rows = load_borrowed()
-    rows.append({
-        "borrow_id": bid,
-        "student_id": str(student_id),
-        "book_id": str(book_id),
-        "borrow_date": now,
-        "return_date": ""
-    })
-    save_borrowed(rows)
+        bid = next_borrow_id()
+        now = datetime.now().strftime("%Y-%m-%d")
+        borrow_table.insert({
+            "borrow_id": bid,
+            "student_id": str(student_id),
+            "book_id": str(book_id),
+            "borrow_date": now,
+            "return_date": ""
+        })
     return True, "Borrow recorded."
 
+@metrics.instrument("borrow.return_book")
 def return_book(borrow_id=None, student_id=None, book_id=None):
     """
     You can return by borrow_id OR by student_id+book_id.
     """
-    rows = load_borrowed()
-    changed = False
     now = datetime.now().strftime("%Y-%m-%d")
+    keys = []
+    if borrow_id:
+        r = borrow_table.fetch(borrow_id)
+        if r and not r.get("return_date"):
+            keys.append(r["borrow_id"])
+    if student_id and book_id:
+        for r in borrow_table.fetch_by("book_id", book_id):
+            if not r.get("return_date") and r["student_id"] == str(student_id):
+                keys.append(r["borrow_id"])
 
-    for r in rows:
-        match = False
-        if borrow_id and r["borrow_id"] == str(borrow_id):
-            match = True
-        elif student_id and book_id and r["student_id"] == str(student_id) and r["book_id"] == str(book_id):
-            match = True
-
-        if match:
-            if not r.get("return_date"):
-                r["return_date"] = now
-                changed = True
-
-    if changed:
-        save_borrowed(rows)
+    # patch() checks the loan is still open under the lock, so a return
+    # made meanwhile by another desk isn't recorded twice
+    returned = [k for k in dict.fromkeys(keys)
+                if borrow_table.patch(k, {"return_date": now}, expect={"return_date": ""})]
+    if returned:
         return True, "Return recorded."
     return False, "No matching active borrow record found."
 
+# ----- bulk borrow / return -----
+@metrics.instrument("borrow.borrow_books_bulk")
+def borrow_books_bulk(items):
+    """
+    Record many borrows with one write. items: dicts with student_id and
+    book_id, or (student_id, book_id) pairs. Each is checked like
+    borrow_book, including against borrows earlier in the same batch.
+    Returns (new borrow ids, [(item number, error)]).
+    """
+    items = list(items)  # read the input before taking the lock
+    students = students_table.mapping()
+    books = books_table.mapping()
+    with borrow_table.transaction():
+        out_now = {r["book_id"] for r in list_currently_borrowed()}
+        now = datetime.now().strftime("%Y-%m-%d")
+        rows, errors = [], []
+        for n, item in enumerate(items, 1):
+            if isinstance(item, dict):
+                sid, bid = item.get("student_id"), item.get("book_id")
+            else:
+                sid, bid = item
+            sid, bid = str(sid or "").strip(), str(bid or "").strip()
+            if sid not in students:
+                errors.append((n, "Student not found."))
+            elif bid not in books:
+                errors.append((n, "Book not found."))
+            elif bid in out_now:
+                errors.append((n, "Book already borrowed."))
+            else:
+                out_now.add(bid)
+                rows.append({
+                    "student_id": sid,
+                    "book_id": bid,
+                    "borrow_date": now,
+                    "return_date": ""
+                })
+        ids = borrow_table.next_ids(len(rows)) if rows else []
+        for bid, row in zip(ids, rows):
+            row["borrow_id"] = bid
+        borrow_table.insert_many(rows)
+    return ids, errors
+
+@metrics.instrument("borrow.return_books_bulk")
+def return_books_bulk(items):
+    """
+    Record many returns with one write. items: dicts with borrow_id or
+    student_id+book_id (same rules as return_book), or
+    (student_id, book_id) pairs. Returns (returned borrow ids,
+    [(item number, error)]).
+    """
+    items = list(items)
+    now = datetime.now().strftime("%Y-%m-%d")
+    changes, errors = {}, []
+    with borrow_table.transaction():
+        for n, item in enumerate(items, 1):
+            if not isinstance(item, dict):
+                item = dict(zip(["student_id", "book_id"], item))
+            borrow_id = str(item.get("borrow_id") or "").strip()
+            student_id = str(item.get("student_id") or "").strip()
+            book_id = str(item.get("book_id") or "").strip()
+            found = []
+            if borrow_id:
+                r = borrow_table.get(borrow_id)
+                if r and not r.get("return_date"):
+                    found.append(r["borrow_id"])
+            if student_id and book_id:
+                found += [r["borrow_id"] for r in borrow_table.lookup("active_by_book", book_id)
+                          if r["student_id"] == student_id]
+            found = [k for k in found if k not in changes]
+            if not found:
+                errors.append((n, "No matching active borrow record found."))
+            for k in found:
+                changes[k] = {"return_date": now}
+        return borrow_table.update_many(changes), errors
+
 # ----- queries -----
+def iter_borrowed(predicate=None, start=None, end=None, status=None, student_id=None, book_id=None):
+    """
+    Stream borrow records without building a list. start/end bound
+    borrow_date (inclusive, "YYYY-MM-DD" or date), status is "open" or
+    "returned". These filters are pushed down to the storage backend;
+    predicate(row) is applied to whatever passes them.
+    """
+    filters = []
+    if status == "open":
+        filters.append(("return_date", "=", ""))
+    elif status == "returned":
+        filters.append(("return_date", "!=", ""))
+    if start:
+        filters.append(("borrow_date", ">=", str(start)))
+    if end:
+        filters.append(("borrow_date", "<=", str(end)))
+    if student_id is not None:
+        filters.append(("student_id", "=", str(student_id)))
+    if book_id is not None:
+        filters.append(("book_id", "=", str(book_id)))
+    return borrow_table.scan(filters, predicate)
+
+def count_borrowed(**filters):
+    """Number of borrow records matching iter_borrowed's filters."""
+    return sum(1 for _ in iter_borrowed(**filters))
+
+@metrics.instrument("borrow.list_currently_borrowed", rows=True)
+@cache.cached("borrow.list_currently_borrowed", borrow_table)
 def list_currently_borrowed():
     """Return borrow rows where return_date is empty"""
-    return [r for r in load_borrowed() if not r.get("return_date")]
+    return borrow_table.lookup("by_return_date", "")
+
+@metrics.instrument("borrow.currently_borrowed_ids", rows=True)
+def currently_borrowed_ids():
+    """Set of book IDs that are out right now."""
+    return circulation.borrowed_ids()
+
+@metrics.instrument("borrow.available_books", rows=True)
+@cache.cached("borrow.available_books", books_table, borrow_table)
+def available_books():
+    """Book rows with no open loan."""
+    return circulation.available_books()
+
+def items_out():
+    """Number of open loans."""
+    return circulation.count_items_out()
 
+@metrics.instrument("borrow.top_borrowed_books", rows=True)
+@cache.cached("borrow.top_borrowed_books", books_table, borrow_table)
+def top_borrowed_books(n=10):
+    """[(book row or None, book_id, times borrowed)] for the n most borrowed books."""
+    books = books_table.mapping()
+    return [(books.get(bid), bid, count) for bid, count in circulation.top_borrowed(n)]
+
+@metrics.instrument("borrow.students_with_open_loans", rows=True)
+@cache.cached("borrow.students_with_open_loans", students_table, borrow_table)
+def students_with_open_loans():
+    """[(student row or None, student_id, open loans)], most loans first."""
+    students = students_table.mapping()
+    counts = sorted(circulation.open_loans_by_student().items(), key=lambda kv: -kv[1])
+    return [(students.get(sid), sid, count) for sid, count in counts]
+
+# ----- due dates and fines -----
+def today():
+    return datetime.now().strftime("%Y-%m-%d")
+
+def reload_loan_policy():
+    """Re-read data/loan_policy.json (after it was edited)."""
+    due_index.set_policy(LoanPolicy.load(POLICY_JSON))
+    cache.clear()  # due dates and fines in cached reports went by the old one
+
+def loan_due_date(row):
+    """Due date ("YYYY-MM-DD") of a loan under the current policy, "" if unknown."""
+    due = due_index.due_of(row, students_table.mapping())
+    return iso(due) if due is not None else ""
+
+def with_due(pairs, as_of):
+    t = to_ordinal(as_of)
+    for due, r in pairs:
+        d = dict(r)
+        d["due_date"] = iso(due)
+        d["days_overdue"] = t - due
+        yield d
+
+@metrics.instrument("borrow.overdue_loans", rows=True)
+@cache.cached("borrow.overdue_loans", borrow_table, students_table, cache.calendar)
+def overdue_loans(as_of=None):
+    """Open loans due before as_of (default today), most overdue first, with
+    due_date and days_overdue added."""
+    as_of = as_of or today()
+    return list(with_due(due_index.overdue(as_of), as_of))
+
+@metrics.instrument("borrow.loans_due_within", rows=True)
+@cache.cached("borrow.loans_due_within", borrow_table, students_table, cache.calendar)
+def loans_due_within(days=7, start=None):
+    """Open loans due between start (default today) and days later, soonest first."""
+    start = start or today()
+    return list(with_due(due_index.due_within(days, start), start))
+
+def count_overdue(as_of=None):
+    return due_index.count_overdue(as_of or today())
+
+def iter_fines(as_of=None, **filters):
+    """
+    Late fines over the borrow history (iter_borrowed's filters apply):
+    returned loans up to their return date, open ones up to as_of
+    (default today). Streams one dict per loan that owes something.
+    """
+    return compute_fines(iter_borrowed(**filters), students_table.mapping(),
+                         due_index.policy, as_of or today())
+
+@metrics.instrument("borrow.fines_by_student", rows=True)
+@cache.cached("borrow.fines_by_student", borrow_table, students_table, cache.calendar)
+def fines_by_student(as_of=None):
+    """[(student row or None, student_id, total fine, loans fined)], largest first."""
+    totals = {}
+    for f in iter_fines(as_of):
+        t = totals.setdefault(f["student_id"], [0.0, 0])
+        t[0] += f["fine"]
+        t[1] += 1
+    students = students_table.mapping()
+    out = [(students.get(sid), sid, round(total, 2), n) for sid, (total, n) in totals.items()]
+    out.sort(key=lambda t: -t[2])
+    return out
+
+@metrics.instrument("borrow.list_all_borrowed", rows=True)
 def list_all_borrowed():
     """All borrow records (history)"""
-    return load_borrowed()
+    return borrow_table.all()
 
+@metrics.instrument("borrow.books_borrowed_by_student", rows=True)
 def books_borrowed_by_student(student_id):
-    out = []
-    for r in load_borrowed():
-        if r["student_id"] == str(student_id):
-            out.append(r)
-    return out
+    return borrow_table.fetch_by("student_id", student_id)
 
+@metrics.instrument("borrow.who_borrowed_book", rows=True)
 def who_borrowed_book(book_id):
-    out = []
-    for r in load_borrowed():
-        if r["book_id"] == str(book_id):
-            out.append(r)
-    return out
+    return borrow_table.fetch_by("book_id", book_id)
+
+# ----- joined views (for listings and reports) -----
+def iter_borrowed_details(rows=None):
+    """
+    Borrow rows (default: streamed full history) with student_name and
+    book_title filled in, looked up against each table once instead of
+    per row.
+    """
+    if rows is None:
+        rows = iter_borrowed()
+    students = students_table.mapping()
+    books = books_table.mapping()
+    for r in rows:
+        s = students.get(r["student_id"])
+        b = books.get(r["book_id"])
+        d = dict(r)
+        d["student_name"] = s.get("name", "") if s else ""
+        d["book_title"] = b.get("title", "") if b else ""
+        yield d
+
+@metrics.instrument("borrow.list_borrowed_details", rows=True)
+def list_borrowed_details(rows=None):
+    return list(iter_borrowed_details(rows))
+
+@metrics.instrument("borrow.students_with_borrows", rows=True)
+def students_with_borrows():
+    """[(student row, detailed borrows)] for every student with any borrow."""
+    by_student = {}
+    for d in iter_borrowed_details():
+        by_student.setdefault(d["student_id"], []).append(d)
+    return [(s, by_student[s["student_id"]]) for s in load_students() if s["student_id"] in by_student]
@@ -0,0 +1,158 @@
+# cache.py
+import threading
+from collections import OrderedDict
+from datetime import date
+from functools import wraps
+import config
+
+# ----- query result cache -----
+# Results of read queries (searches, availability, the reports), kept until
+# a table they read changes. Each entry remembers the version() of every
+# table it depends on when it was computed; a call whose tables still have
+# those versions gets the stored result, anything else computes afresh.
+# Nothing has to be told about writes: any insert/update/delete, borrow or
+# return, in this process or another desk's, moves the table's version.
+#
+#     @cache.cached("borrow.available_books", books_table, borrow_table)
+#     def available_books(): ...
+#
+# Entries are keyed by the query's name and arguments; calls with an
+# argument that can't be hashed (a list of rows, say) are not cached.
+# QUERY_CACHE entries are kept, least recently used dropped first; 0 turns
+# the cache off. Results are shared between callers, like the tables' own
+# rows: treat them as read-only.
+#
+# Versions are read before the query runs, so a write that lands while it
+# runs leaves an entry that is already out of date, never a wrong hit. Two
+# threads missing on the same query at once both compute it.
+
+class Calendar:
+    """A dependency whose version is today's date, for results that default to today."""
+    def version(self):
+        return date.today().isoformat()
+
+calendar = Calendar()
+
+class Counts:
+    __slots__ = ("hits", "misses", "uncached")
+
+    def __init__(self):
+        self.hits = self.misses = self.uncached = 0
+
+class QueryCache:
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()  # (name, args) -> (versions, result)
+        self.counts = {}              # name -> Counts
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def count(self, name):
+        c = self.counts.get(name)
+        if c is None:
+            c = self.counts[name] = Counts()
+        return c
+
+    def get(self, key, versions):
+        """(True, result) if key was stored at these versions, else (False, None)."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == versions:
+                self.entries.move_to_end(key)
+                self.count(key[0]).hits += 1
+                return True, entry[1]
+            self.count(key[0]).misses += 1
+            return False, None
+
+    def put(self, key, versions, result):
+        if not self.size:
+            return
+        with self.lock:
+            self.entries[key] = (versions, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def skip(self, name):
+        """Note a call that couldn't be cached."""
+        with self.lock:
+            self.count(name).uncached += 1
+
+    def clear(self):
+        """Drop every entry (for changes no table version shows, e.g. a new loan policy)."""
+        with self.lock:
+            self.entries.clear()
+
+    def reset(self):
+        with self.lock:
+            self.counts.clear()
+            self.evictions = 0
+
+    def stats(self):
+        """{"entries", "size", "evictions", "hits", "misses", "queries": [{name, hits, ...}]}."""
+        with self.lock:
+            queries = [{"name": name, "hits": c.hits, "misses": c.misses, "uncached": c.uncached,
+                        "entries": sum(1 for k in self.entries if k[0] == name)}
+                       for name, c in sorted(self.counts.items())]
+            out = {"entries": len(self.entries), "size": self.size, "evictions": self.evictions}
+        out["hits"] = sum(q["hits"] for q in queries)
+        out["misses"] = sum(q["misses"] for q in queries)
+        out["queries"] = queries
+        return out
+
+queries = QueryCache(config.QUERY_CACHE)
+
+def versions(deps):
+    return tuple(d.version() for d in deps)
+
+def remember(name, args, deps, compute, keep=None):
+    """compute()'s result, kept as name(*args) until one of deps changes
+    version (and only if keep(result) is true, when given)."""
+    key = (name, args)
+    try:
+        hash(key)
+    except TypeError:
+        queries.skip(name)
+        return compute()
+    seen = versions(deps)
+    found, result = queries.get(key, seen)
+    if found:
+        return result
+    result = compute()
+    if keep is None or keep(result):
+        queries.put(key, seen, result)
+    return result
+
+def cached(name, *deps):
+    """Decorator: keep fn's results until one of deps (tables, calendar) changes version."""
+    def wrap(fn):
+        if not queries.size:
+            return fn
+
+        @wraps(fn)
+        def cached_call(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items()))) if kwargs else args
+            return remember(name, key, deps, lambda: fn(*args, **kwargs))
+        return cached_call
+    return wrap
+
+def clear():
+    queries.clear()
+
+def stats():
+    return queries.stats()
+
+def to_prometheus():
+    """The cache counters in the Prometheus text exposition format."""
+    s = stats()
+    out = ["# HELP library_query_cache_hits_total Query results served from the cache.",
+           "# TYPE library_query_cache_hits_total counter"]
+    out += [f'library_query_cache_hits_total{{query="{q["name"]}"}} {q["hits"]}' for q in s["queries"]]
+    out += ["# HELP library_query_cache_misses_total Queries computed because no current result was cached.",
+            "# TYPE library_query_cache_misses_total counter"]
+    out += [f'library_query_cache_misses_total{{query="{q["name"]}"}} {q["misses"]}' for q in s["queries"]]
+    out += ["# HELP library_query_cache_entries Results held in the cache.",
+            "# TYPE library_query_cache_entries gauge",
+            f'library_query_cache_entries {s["entries"]}']
+    return "\n".join(out) + "\n"
@@ -0,0 +1,264 @@
+# cli.py
+import argparse
+import csv
+import json
+import sys
+from datetime import date
+
+# ---------- Command-line interface ----------
+# Everything the GUI does, for scripts and cron jobs: no tkinter import, no
+# display needed. Listings are streamed row by row as CSV (default), a
+# JSON array or JSON lines, to stdout or --output.
+#
+#   python cli.py export books --format json -o books.json
+#   python cli.py import books new_books.csv
+#   python cli.py search students "ann"
+#   python cli.py borrow 3 17
+#   python cli.py return --borrow-id 42        (or: return 3 17)
+#   python cli.py report borrowed|available|students|top|open-loans|summary
+#   python cli.py report overdue --as-of 2024-06-01     (also: due-soon --days 3, fines)
+#   python cli.py analytics by-month --year 2024        (or: --format json for every table)
+#
+# The library modules are imported inside each command, so `--help` and
+# argument errors come back instantly.
+
+BOOK_FIELDS = ["book_id", "title", "author", "year", "isbn"]
+STUDENT_FIELDS = ["student_id", "name", "semester", "phone"]
+BORROW_FIELDS = ["borrow_id", "student_id", "book_id", "borrow_date", "return_date"]
+DETAIL_FIELDS = ["borrow_id", "student_id", "student_name", "book_id", "book_title",
+                 "borrow_date", "return_date"]
+FINE_FIELDS = ["borrow_id", "student_id", "book_id", "borrow_date", "due_date", "return_date",
+               "days_late", "fine"]
+
+# ---------- output ----------
+def open_output(path):
+    if not path or path == "-":
+        return sys.stdout, False
+    return open(path, "w", newline="", encoding="utf-8"), True
+
+def write_rows(rows, fields, fmt, path=None):
+    """Stream rows (mappings) as csv, json or jsonl; returns the row count."""
+    out, close = open_output(path)
+    n = 0
+    try:
+        if fmt == "csv":
+            writer = csv.writer(out, lineterminator="\n")
+            writer.writerow(fields)
+            for r in rows:
+                writer.writerow([r.get(f, "") for f in fields])
+                n += 1
+        elif fmt == "jsonl":
+            for r in rows:
+                out.write(json.dumps({f: r.get(f, "") for f in fields}, ensure_ascii=False) + "\n")
+                n += 1
+        else:
+            out.write("[")
+            for r in rows:
+                out.write(("," if n else "") + "\n" + json.dumps({f: r.get(f, "") for f in fields}, ensure_ascii=False))
+                n += 1
+            out.write("\n]\n" if n else "]\n")
+    finally:
+        if close:
+            out.close()
+        else:
+            out.flush()
+    return n
+
+def say(msg):
+    print(msg, file=sys.stderr)
+
+# ---------- commands ----------
+def cmd_export(args):
+    if args.table == "books":
+        from books import iter_books
+        rows, fields = iter_books(), BOOK_FIELDS
+    elif args.table == "students":
+        from students import iter_students
+        rows, fields = iter_students(), STUDENT_FIELDS
+    else:
+        from borrow import iter_borrowed, iter_borrowed_details
+        rows = iter_borrowed(status=args.status, start=args.start, end=args.end)
+        fields = BORROW_FIELDS
+        if args.details:
+            rows, fields = iter_borrowed_details(rows), DETAIL_FIELDS
+    n = write_rows(rows, fields, args.format, args.output)
+    say(f"{n} {args.table} exported")
+    return 0
+
+def cmd_import(args):
+    from store import read_records
+    items = read_records(args.file)
+    if args.table == "books":
+        from books import add_books_bulk
+        ids, errors = add_books_bulk(items)
+    elif args.table == "students":
+        from students import add_students_bulk
+        ids, errors = add_students_bulk(items)
+    else:
+        from borrow import borrow_books_bulk
+        ids, errors = borrow_books_bulk(items)
+    for n, msg in errors:
+        say(f"{args.file}: record {n}: {msg}")
+    say(f"{len(ids)} {args.table} imported, {len(errors)} rejected")
+    return 1 if errors else 0
+
+def cmd_search(args):
+    if args.table == "books":
+        from books import search_books
+        rows, fields = search_books(args.query), BOOK_FIELDS
+    else:
+        from students import search_students
+        rows, fields = search_students(args.query), STUDENT_FIELDS
+    if args.limit:
+        rows = rows[:args.limit]
+    write_rows(rows, fields, args.format, args.output)
+    return 0
+
+def cmd_borrow(args):
+    from borrow import borrow_book
+    ok, msg = borrow_book(args.student_id, args.book_id)
+    say(msg)
+    return 0 if ok else 1
+
+def cmd_return(args):
+    from borrow import return_book
+    if not args.borrow_id and not (args.student_id and args.book_id):
+        say("give --borrow-id or both STUDENT_ID and BOOK_ID")
+        return 2
+    ok, msg = return_book(args.borrow_id, args.student_id, args.book_id)
+    say(msg)
+    return 0 if ok else 1
+
+def report_rows(name, args):
+    """(rows, fields) for a report, streamed where the source allows."""
+    import borrow
+    if name == "borrowed":
+        return borrow.iter_borrowed_details(borrow.iter_borrowed(status="open")), DETAIL_FIELDS
+    if name == "available":
+        from store import id_number
+        return sorted(borrow.available_books(), key=lambda b: id_number(b["book_id"])), BOOK_FIELDS
+    if name == "students":
+        rows = (dict(br, name=s["name"]) for s, borrows in borrow.students_with_borrows() for br in borrows)
+        return rows, ["student_id", "name"] + DETAIL_FIELDS[3:]
+    if name == "top":
+        return ({"book_id": bid, "title": b.get("title", "") if b else "", "loans": n}
+                for b, bid, n in borrow.top_borrowed_books(args.n)), ["book_id", "title", "loans"]
+    if name == "overdue":
+        return borrow.overdue_loans(args.as_of), BORROW_FIELDS + ["due_date", "days_overdue"]
+    if name == "due-soon":
+        return borrow.loans_due_within(args.days, args.as_of), BORROW_FIELDS + ["due_date"]
+    if name == "fines":
+        if args.details:
+            return borrow.iter_fines(args.as_of), FINE_FIELDS
+        return ({"student_id": sid, "name": s.get("name", "") if s else "", "fine": total, "loans": n}
+                for s, sid, total, n in borrow.fines_by_student(args.as_of)), ["student_id", "name", "fine", "loans"]
+    if name == "open-loans":
+        return ({"student_id": sid, "name": s.get("name", "") if s else "", "open_loans": n}
+                for s, sid, n in borrow.students_with_open_loans()), ["student_id", "name", "open_loans"]
+    from books import books_table
+    from students import students_table
+    return [{"books": len(books_table.all()), "students": len(students_table.all()),
+             "items_out": borrow.items_out()}], ["books", "students", "items_out"]
+
+def cmd_report(args):
+    rows, fields = report_rows(args.name, args)
+    write_rows(rows, fields, args.format, args.output)
+    return 0
+
+def cmd_analytics(args):
+    import analytics
+    result = analytics.analyze(args.year, args.start, args.end)
+    if args.table == "all":
+        if args.format != "json":
+            say("all tables only come as --format json")
+            return 2
+        out, close = open_output(args.output)
+        try:
+            json.dump(result, out, indent=2, ensure_ascii=False)
+            out.write("\n")
+        finally:
+            if close:
+                out.close()
+        return 0
+    write_rows(result[args.table], analytics.TABLES[args.table], args.format, args.output)
+    return 0
+
+# ---------- argument parsing ----------
+def iso_date(text):
+    """argparse type for YYYY-MM-DD options; the value stays a string."""
+    try:
+        date.fromisoformat(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a date (YYYY-MM-DD): {text!r}")
+    return text
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="cli.py", description="Library Management System, batch mode")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def output_options(p):
+        p.add_argument("--format", choices=["csv", "json", "jsonl"], default="csv")
+        p.add_argument("-o", "--output", help="file to write (default: stdout)")
+
+    p = sub.add_parser("export", help="dump a table")
+    p.add_argument("table", choices=["books", "students", "borrows"])
+    p.add_argument("--status", choices=["open", "returned"], help="borrows: only open / returned loans")
+    p.add_argument("--start", type=iso_date, help="borrows: borrowed on or after YYYY-MM-DD")
+    p.add_argument("--end", type=iso_date, help="borrows: borrowed on or before YYYY-MM-DD")
+    p.add_argument("--details", action="store_true", help="borrows: add student names and book titles")
+    output_options(p)
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("import", help="bulk-add rows from a .csv or .jsonl file")
+    p.add_argument("table", choices=["books", "students", "borrows"])
+    p.add_argument("file")
+    p.set_defaults(func=cmd_import)
+
+    p = sub.add_parser("search", help="search books or students")
+    p.add_argument("table", choices=["books", "students"])
+    p.add_argument("query")
+    p.add_argument("--limit", type=int, default=0)
+    output_options(p)
+    p.set_defaults(func=cmd_search)
+
+    p = sub.add_parser("borrow", help="record a borrow")
+    p.add_argument("student_id")
+    p.add_argument("book_id")
+    p.set_defaults(func=cmd_borrow)
+
+    p = sub.add_parser("return", help="record a return")
+    p.add_argument("student_id", nargs="?")
+    p.add_argument("book_id", nargs="?")
+    p.add_argument("--borrow-id")
+    p.set_defaults(func=cmd_return)
+
+    p = sub.add_parser("report", help="run a report")
+    p.add_argument("name", choices=["borrowed", "available", "students", "top", "open-loans", "summary",
+                                    "overdue", "due-soon", "fines"])
+    p.add_argument("-n", type=int, default=10, help="top: how many books")
+    p.add_argument("--as-of", type=iso_date, help="overdue/fines: as of YYYY-MM-DD; due-soon: from (default today)")
+    p.add_argument("--days", type=int, default=7, help="due-soon: how many days ahead")
+    p.add_argument("--details", action="store_true", help="fines: one row per loan instead of per student")
+    output_options(p)
+    p.set_defaults(func=cmd_report)
+
+    p = sub.add_parser("analytics", help="circulation statistics over the borrow history")
+    p.add_argument("table", choices=["summary", "by-month", "by-year", "by-author", "by-semester",
+                                     "never-borrowed", "all"])
+    p.add_argument("--year", type=int, help="only loans borrowed in this year")
+    p.add_argument("--start", type=iso_date, help="only loans borrowed on or after YYYY-MM-DD")
+    p.add_argument("--end", type=iso_date, help="only loans borrowed on or before YYYY-MM-DD")
+    output_options(p)
+    p.set_defaults(func=cmd_analytics)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except BrokenPipeError:
+        # e.g. piped into head; nothing left to write to
+        return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,44 @@
+# config.py
+import os
+
+# ----- data folder -----
+# Where books.csv, students.csv and borrow.csv live; empty means the data/
+# folder next to the program. Point it elsewhere to run against another
+# library (a copy, or a generated dataset - see datagen.py).
+DATA_DIR = os.environ.get("LIBRARY_DATA_DIR", "").strip()
+
+# ----- storage backend -----
+# "csv"    - the CSV files under data/ (default)
+# "sqlite" - data/library.db; run `python sqlite_store.py` once to import
+#            the existing CSVs
+BACKEND = os.environ.get("LIBRARY_BACKEND", "csv").strip().lower()
+
+# ----- durability -----
+# How writes reach the disk:
+# "full"  - every change is fsynced before the call returns; changes made
+#           at the same time by several threads share one fsync (default)
+# "group" - changes are fsynced together at most every GROUP_COMMIT_MS;
+#           a crash can lose the last few ms of changes but never
+#           corrupts a file. For high write rates (bulk loads, a server).
+# "off"   - leave it to the OS
+SYNC = os.environ.get("LIBRARY_SYNC", "full").strip().lower()
+GROUP_COMMIT_MS = int(os.environ.get("LIBRARY_GROUP_COMMIT_MS", "20"))
+
+# ----- metrics -----
+# Timing and counters for every storage, query and GUI operation (see
+# metrics.py). They cost a microsecond or two per call; "off" removes them.
+# With METRICS_FILE set, the numbers are written there every
+# METRICS_INTERVAL seconds: Prometheus text, or JSON for a *.json name.
+METRICS = os.environ.get("LIBRARY_METRICS", "on").strip().lower() not in ("off", "0", "false", "no")
+METRICS_FILE = os.environ.get("LIBRARY_METRICS_FILE", "").strip()
+METRICS_INTERVAL = float(os.environ.get("LIBRARY_METRICS_INTERVAL", "15"))
+
+# ----- query cache -----
+# How many query results (searches, reports) to keep until a table they
+# read changes (see cache.py); 0 turns the cache off.
+QUERY_CACHE = int(os.environ.get("LIBRARY_QUERY_CACHE", "256"))
+
+# ----- analytics -----
+# Worker processes reading a large borrow history (see analytics.py);
+# 0 means one per CPU.
+ANALYTICS_WORKERS = int(os.environ.get("LIBRARY_ANALYTICS_WORKERS", "0"))
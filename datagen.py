@@ -0,0 +1,235 @@
+# datagen.py
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+from datetime import date
+
+# ---------- Synthetic library data ----------
+# Writes books.csv, students.csv and borrow.csv in the app's own format, so
+# any size of library can be loaded with LIBRARY_DATA_DIR=<folder>:
+#
+#   python datagen.py /tmp/lib100k --size 100k
+#   python datagen.py /tmp/lib --books 50000 --students 8000 --loans 400000 --years 6
+#
+# The same seed always gives the same files. The skew is what a real
+# library sees:
+#   * a few titles and a few prolific authors account for most loans
+#     (Zipf-like popularity), and some students borrow far more than others;
+#   * loans cluster in term time (Feb-May, Sep-Dec) and thin out in summer;
+#   * loan lengths are long-tailed: most come back within two weeks, a few
+#     are kept for months;
+#   * a copy is never lent twice at once, and loans running past the end
+#     date are still open (empty return_date).
+
+# Last day of the history unless --end says otherwise. Fixed, not today,
+# so a seed gives the same files whenever it runs (benchmarks stay comparable).
+END = date(2024, 1, 1)
+
+BOOK_FIELDS = ["book_id", "title", "author", "year", "isbn"]
+STUDENT_FIELDS = ["student_id", "name", "semester", "phone"]
+BORROW_FIELDS = ["borrow_id", "student_id", "book_id", "borrow_date", "return_date"]
+
+FIRST_NAMES = [
+    "Aisha", "Ali", "Amir", "Ana", "Anna", "Ayesha", "Ben", "Carlos", "Chen", "Daniel",
+    "Elena", "Emma", "Farah", "Fatima", "Hamza", "Hana", "Ibrahim", "Isabel", "James", "Jin",
+    "Kenji", "Layla", "Leo", "Lucas", "Maria", "Mei", "Mohammed", "Nadia", "Noah", "Olga",
+    "Omar", "Priya", "Ravi", "Sara", "Sofia", "Tariq", "Usman", "Wei", "Yusuf", "Zara",
+]
+LAST_NAMES = [
+    "Ahmed", "Ali", "Bauer", "Chen", "Costa", "Dubois", "Garcia", "Gupta", "Hassan", "Ivanova",
+    "Jensen", "Khan", "Kim", "Kowalski", "Lee", "Malik", "Martin", "Müller", "Nakamura", "Nguyen",
+    "Novak", "Okafor", "Patel", "Rossi", "Santos", "Schmidt", "Shah", "Silva", "Singh", "Smith",
+    "Tanaka", "Wang", "Williams", "Yilmaz", "Zhang",
+]
+TITLE_WORDS = [
+    "Advanced", "Algorithms", "Analysis", "Applied", "Art", "Atlas", "Basics", "Biology",
+    "Calculus", "Chemistry", "Circuits", "Companion", "Computing", "Data", "Design", "Economics",
+    "Elements", "Engineering", "Essentials", "Ethics", "Foundations", "Geometry", "Guide",
+    "Handbook", "History", "Introduction", "Language", "Law", "Learning", "Logic", "Machines",
+    "Management", "Mathematics", "Mechanics", "Methods", "Modern", "Networks", "Physics",
+    "Practice", "Principles", "Programming", "Psychology", "Statistics", "Structures", "Systems",
+    "Theory", "Thermodynamics", "Understanding", "World", "Émile",
+]
+# relative loan volume per month, Jan..Dec
+MONTH_WEIGHTS = [0.8, 1.2, 1.3, 1.3, 1.1, 0.5, 0.3, 0.4, 1.2, 1.4, 1.4, 0.9]
+
+SIZES = {"k": 1000, "m": 1000000}
+
+def parse_size(text):
+    """"1k" -> 1000, "1M" -> 1000000, "250" -> 250."""
+    text = str(text).strip().lower()
+    if text and text[-1] in SIZES:
+        return int(float(text[:-1]) * SIZES[text[-1]])
+    return int(text)
+
+def zipf_cum_weights(n, s):
+    """Cumulative 1/rank**s weights for ranks 1..n, for rng.choices."""
+    total, out = 0.0, []
+    for rank in range(1, n + 1):
+        total += rank ** -s
+        out.append(total)
+    return out
+
+class Popularity:
+    """Draws IDs 1..n with Zipf skew; which IDs are popular is shuffled."""
+    def __init__(self, rng, n, s, batch=4096):
+        self.rng = rng
+        self.ids = list(range(1, n + 1))
+        rng.shuffle(self.ids)
+        self.cum = zipf_cum_weights(n, s)
+        self.batch = batch
+        self.drawn = []
+
+    def draw(self):
+        if not self.drawn:
+            self.drawn = self.rng.choices(self.ids, cum_weights=self.cum, k=self.batch)
+        return self.drawn.pop()
+
+# ---------- generators (stream rows; nothing is held in memory) ----------
+def gen_books(rng, n, end):
+    authors = Popularity(rng, max(1, n // 8), 0.9)
+    author_names = {}
+    this_year = end.year
+    for i in range(1, n + 1):
+        a = authors.draw()
+        name = author_names.get(a)
+        if name is None:
+            name = author_names[a] = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+        year = max(1900, this_year - int(rng.expovariate(1 / 15)))
+        yield [i, " ".join(rng.sample(TITLE_WORDS, rng.randint(2, 4))), name, year,
+               f"978{rng.randrange(10 ** 10):010d}"]
+
+def gen_students(rng, n):
+    for i in range(1, n + 1):
+        yield [i, f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}", rng.randint(1, 8),
+               f"03{rng.randrange(10 ** 9):09d}"]
+
+def loan_days(rng, first, last, count):
+    """count borrow dates (ordinals) between first and last, term time weighted, sorted."""
+    span = last - first + 1
+    top = max(MONTH_WEIGHTS)
+    weight = [MONTH_WEIGHTS[date.fromordinal(first + i).month - 1] / top for i in range(span)]
+    out = []
+    while len(out) < count:
+        i = rng.randrange(span)
+        if rng.random() < weight[i]:
+            out.append(first + i)
+    out.sort()
+    return out
+
+def gen_loans(rng, n, books, students, years, end):
+    """
+    Up to n loans over the years before end. A loan whose book is still out
+    tries another title; after a few misses it is dropped, so very small
+    libraries can come out with fewer than n loans.
+    """
+    if not books or not students:
+        return
+    end = end.toordinal()
+    book_pick = Popularity(rng, books, 1.1)
+    student_pick = Popularity(rng, students, 0.8)
+    free_from = [0] * (books + 1)
+    first = end - 365 * years + 1
+    iso = [date.fromordinal(d).isoformat() for d in range(first, end + 1)]
+    borrow_id = 0
+    for day in loan_days(rng, first, end, n):
+        for _ in range(8):
+            book = book_pick.draw()
+            if free_from[book] <= day:
+                break
+        else:
+            continue
+        length = 1 + int(rng.lognormvariate(2.1, 0.7))
+        if rng.random() < 0.02:
+            length *= 6  # kept for a term
+        back = day + length
+        borrow_id += 1
+        if back > end:
+            free_from[book] = sys.maxsize
+            returned = ""
+        else:
+            free_from[book] = back + 1
+            returned = iso[back - first]
+        yield [borrow_id, student_pick.draw(), book, iso[day - first], returned]
+
+# ---------- writing ----------
+SIDECARS = (".journal", ".seq", ".lock", ".new", ".new.done", ".snap", ".idx")
+
+def write_table(path, fields, rows):
+    n = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(fields)
+        for n, r in enumerate(rows, 1):
+            writer.writerow(r)
+    return n
+
+def generate(data_dir, books=1000, students=None, loans=None, years=3, seed=42, end=END, force=False):
+    """
+    Write a synthetic library into data_dir; returns the manifest (counts
+    and parameters), also saved as datagen.json next to the CSVs.
+    students defaults to books // 10 and loans to books.
+    """
+    students = max(10, books // 10) if students is None else students
+    loans = books if loans is None else loans
+    end = end if isinstance(end, date) else date.fromisoformat(end)
+    os.makedirs(data_dir, exist_ok=True)
+    names = ["books.csv", "students.csv", "borrow.csv"]
+    existing = [n for n in names if os.path.exists(os.path.join(data_dir, n))]
+    if existing and not force:
+        raise FileExistsError(f"{data_dir} already has {', '.join(existing)} (use force to overwrite)")
+    # a stale journal or database would be read on top of the new files
+    for n in names:
+        for suffix in SIDECARS:
+            path = os.path.join(data_dir, n + suffix)
+            if os.path.exists(path):
+                os.remove(path)
+    for n in os.listdir(data_dir):
+        if n == "library.db" or n.startswith("library.db-"):
+            os.remove(os.path.join(data_dir, n))
+
+    rng = random.Random(seed)
+    counts = {
+        "books": write_table(os.path.join(data_dir, "books.csv"), BOOK_FIELDS, gen_books(rng, books, end)),
+        "students": write_table(os.path.join(data_dir, "students.csv"), STUDENT_FIELDS, gen_students(rng, students)),
+        "loans": write_table(os.path.join(data_dir, "borrow.csv"), BORROW_FIELDS,
+                             gen_loans(rng, loans, books, students, years, end)),
+    }
+    manifest = {"counts": counts, "params": {"books": books, "students": students, "loans": loans,
+                                             "years": years, "seed": seed, "end": end.isoformat()}}
+    with open(os.path.join(data_dir, "datagen.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="datagen.py", description="Generate a synthetic library")
+    parser.add_argument("data_dir")
+    parser.add_argument("--size", default="1k", help="books (and loans), e.g. 1k, 100k, 1M (default 1k)")
+    parser.add_argument("--books", help="override the number of books")
+    parser.add_argument("--students", help="number of students (default size / 10)")
+    parser.add_argument("--loans", help="number of loans (default size)")
+    parser.add_argument("--years", type=int, default=3, help="years of loan history (default 3)")
+    parser.add_argument("--end", default=END.isoformat(),
+                        help=f"last day of the history, YYYY-MM-DD (default {END.isoformat()})")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--force", action="store_true", help="overwrite existing CSVs")
+    args = parser.parse_args(argv)
+    size = parse_size(args.size)
+    books = parse_size(args.books) if args.books else size
+    try:
+        manifest = generate(args.data_dir, books=books,
+                            students=parse_size(args.students) if args.students else None,
+                            loans=parse_size(args.loans) if args.loans else size,
+                            years=args.years, seed=args.seed, end=args.end, force=args.force)
+    except FileExistsError as e:
+        print(e, file=sys.stderr)
+        return 1
+    c = manifest["counts"]
+    print(f'{c["books"]} books, {c["students"]} students, {c["loans"]} loans -> {args.data_dir}', file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
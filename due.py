@@ -0,0 +1,238 @@
+# due.py
+import json
+import os
+import threading
+from bisect import bisect_left, insort
+from datetime import date
+from records import encode_date
+
+# ----- loan policy -----
+# How long a loan may run and what lateness costs. Defaults can be
+# overridden by data/loan_policy.json, e.g.
+#   {"default_days": 14, "by_semester": {"1": 7}, "by_book": {"12": 3},
+#    "fine_per_day": 0.5, "max_fine": 20, "grace_days": 1}
+# A per-book period wins over the student's category (semester), which
+# wins over the default. Due dates are derived from borrow_date with the
+# policy in force, so borrow.csv needs no extra column and a policy change
+# applies to loans already out.
+
+DEFAULT_DAYS = 14
+
+class LoanPolicy:
+    def __init__(self, default_days=DEFAULT_DAYS, by_semester=None, by_book=None,
+                 fine_per_day=0.0, max_fine=None, grace_days=0):
+        self.default_days = int(default_days)
+        self.by_semester = {str(k): int(v) for k, v in (by_semester or {}).items()}
+        self.by_book = {str(k): int(v) for k, v in (by_book or {}).items()}
+        self.fine_per_day = float(fine_per_day)
+        self.max_fine = None if max_fine is None else float(max_fine)
+        self.grace_days = int(grace_days)
+
+    @classmethod
+    def load(cls, path):
+        """Policy from a JSON file; defaults if there is none."""
+        if not os.path.exists(path):
+            return cls()
+        with open(path, encoding="utf-8") as f:
+            return cls(**json.load(f))
+
+    def days_for(self, student, book_id):
+        """Loan period for a student row (or None) borrowing book_id."""
+        days = self.by_book.get(str(book_id))
+        if days is None and student is not None:
+            days = self.by_semester.get(student.get("semester", ""))
+        return self.default_days if days is None else days
+
+    def fine(self, days_late):
+        if days_late <= self.grace_days:
+            return 0.0
+        amount = days_late * self.fine_per_day
+        return amount if self.max_fine is None else min(amount, self.max_fine)
+
+def to_ordinal(value):
+    """date / "YYYY-MM-DD" -> day ordinal (None if it isn't a date)."""
+    if isinstance(value, date):
+        return value.toordinal()
+    v = encode_date(value)
+    return v if v.__class__ is int else None
+
+def day_of(value):
+    """Like to_ordinal(), but a value that isn't a date raises ValueError."""
+    v = to_ordinal(value)
+    if v is None:
+        raise ValueError(f"not a date (YYYY-MM-DD): {value!r}")
+    return v
+
+def iso(ordinal):
+    return date.fromordinal(ordinal).isoformat()
+
+# ----- due-date index -----
+# Open loans kept sorted by (due day, borrow_id), so "overdue as of X" is
+# a bisect plus the k loans before it, and "due in the next N days" a
+# bisect on each end: O(log n + k) instead of a scan of borrow.csv.
+#
+# Attached to the borrow table like any other index. change() only notes
+# the loan; placing it needs the student's category from another table, so
+# that happens on the next query, outside the borrow table's lock. A
+# student whose semester changes (or who is added or deleted) is noted the
+# same way, and the next query re-places just that student's open loans.
+# A reload of borrow.csv or students.csv, or a new policy, marks the index
+# stale, and the next query rebuilds it from all the open loans.
+
+class DueIndex:
+    def __init__(self, policy, open_loans, students, loans_of):
+        # open_loans() -> current open loan rows; students() -> student_id -> row
+        # mapping; loans_of(student_id) -> that student's open loan rows
+        self.policy = policy
+        self.open_loans = open_loans
+        self.students = students
+        self.loans_of = loans_of
+        self.lock = threading.RLock()
+        self.entries = []     # sorted [(due ordinal, borrow_id)]
+        self.placed = {}      # borrow_id -> (due ordinal, row)
+        self.unplaced = {}    # borrow_id -> row, waiting for a due date
+        self.moved = set()    # student_ids whose loans need placing again
+        self.stale = True
+        self.changes = 0
+
+    # ----- attach_index protocol (borrow table) -----
+    def reset(self, rows):
+        with self.lock:
+            self.stale = True
+            self.changes += 1
+
+    def change(self, key, old, new):
+        with self.lock:
+            self.changes += 1
+            if self.stale:
+                return
+            bid = (new if new is not None else old)["borrow_id"]
+            self.unplace(bid)
+            if new is not None and not new["return_date"]:
+                self.unplaced[bid] = new
+
+    def unplace(self, bid):
+        self.unplaced.pop(bid, None)
+        placed = self.placed.pop(bid, None)
+        if placed is not None:
+            i = bisect_left(self.entries, (placed[0], bid))
+            if i < len(self.entries) and self.entries[i] == (placed[0], bid):
+                del self.entries[i]
+
+    def invalidate(self, *args):
+        """Listener for reloads of the students table, and for policy changes."""
+        with self.lock:
+            self.stale = True
+
+    def student_changed(self, key, old, new):
+        """Listener for student changes: only a semester moves due dates."""
+        if old is not None and new is not None and old.get("semester", "") == new.get("semester", ""):
+            return
+        with self.lock:
+            if not self.stale:
+                self.moved.add((new if new is not None else old)["student_id"])
+
+    def set_policy(self, policy):
+        with self.lock:
+            self.policy = policy
+            self.stale = True
+
+    # ----- bringing the index up to date -----
+    def due_of(self, row, students):
+        start = to_ordinal(row["borrow_date"])
+        if start is None:
+            return None
+        return start + self.policy.days_for(students.get(row["student_id"]), row["book_id"])
+
+    def current(self):
+        while True:
+            with self.lock:
+                stale, seen, moved = self.stale, self.changes, self.moved
+                self.moved = set()
+            if stale:
+                loans = self.open_loans()
+                with self.lock:
+                    if self.changes != seen:
+                        continue  # a write slipped in while we were reading; read again
+                    self.entries, self.placed, self.stale = [], {}, False
+                    self.unplaced = {r["borrow_id"]: r for r in loans}
+                continue
+            if not moved:
+                break
+            loans = [r for sid in moved for r in self.loans_of(sid)]
+            with self.lock:
+                if self.changes != seen or self.stale:
+                    self.moved |= moved
+                    continue
+                for r in loans:
+                    self.unplace(r["borrow_id"])
+                    self.unplaced[r["borrow_id"]] = r
+        with self.lock:
+            if not self.unplaced:
+                return
+            todo = dict(self.unplaced)
+        students = self.students()
+        dues = {bid: self.due_of(r, students) for bid, r in todo.items()}
+        with self.lock:
+            fresh = []
+            for bid, r in todo.items():
+                if self.unplaced.get(bid) is not r:
+                    continue  # changed again meanwhile; it is still waiting
+                del self.unplaced[bid]
+                if dues[bid] is None:
+                    continue  # no usable borrow_date: can't be overdue
+                self.placed[bid] = (dues[bid], r)
+                fresh.append((dues[bid], bid))
+            if len(fresh) > 64:
+                self.entries = sorted(self.entries + fresh)
+            else:
+                for e in fresh:
+                    insort(self.entries, e)
+
+    # ----- queries -----
+    def between(self, lo, hi):
+        """Open loans due on days lo <= due < hi, as (due ordinal, row), earliest first."""
+        self.current()
+        with self.lock:
+            i = bisect_left(self.entries, (lo,)) if lo is not None else 0
+            j = bisect_left(self.entries, (hi,))
+            return [(due, self.placed[bid][1]) for due, bid in self.entries[i:j]]
+
+    def overdue(self, as_of):
+        """Open loans whose due date is before as_of."""
+        return self.between(None, day_of(as_of))
+
+    def due_within(self, days, today):
+        """Open loans due from today through today + days."""
+        t = day_of(today)
+        return self.between(t, t + days + 1)
+
+    def count_overdue(self, as_of):
+        t = day_of(as_of)
+        self.current()
+        with self.lock:
+            return bisect_left(self.entries, (t,))
+
+# ----- fines -----
+def compute_fines(loans, students, policy, as_of):
+    """
+    Fine for every loan in loans (any iterable, e.g. the whole streamed
+    history): returned loans are charged up to their return date, open
+    ones up to as_of. Yields dicts for the loans that owe something.
+    """
+    end_default = day_of(as_of)
+    for r in loans:
+        start = to_ordinal(r["borrow_date"])
+        if start is None:
+            continue
+        due = start + policy.days_for(students.get(r["student_id"]), r["book_id"])
+        end = to_ordinal(r["return_date"]) if r["return_date"] else end_default
+        if end is None or end <= due:
+            continue
+        fine = policy.fine(end - due)
+        if fine:
+            yield {
+                "borrow_id": r["borrow_id"], "student_id": r["student_id"], "book_id": r["book_id"],
+                "borrow_date": r["borrow_date"], "due_date": iso(due), "return_date": r["return_date"],
+                "days_late": end - due, "fine": round(fine, 2),
+            }
@@ -1,16 +1,25 @@
 # gui.py
 import tkinter as tk
-from tkinter import ttk, messagebox, simpledialog
+from functools import wraps
+from tkinter import ttk, messagebox, simpledialog, filedialog
+import cache
+import metrics
+from widgets import PagedTree
+from tasks import TaskRunner
 from books import (
-    load_books, add_book, update_book, delete_book, find_book, search_books
+    books_table, load_books, add_book, update_book, delete_book, find_book, search_books
 )
 from students import (
-    load_students, add_student, update_student, delete_student, find_student, search_students
+    students_table, load_students, add_student, update_student, delete_student, find_student, search_students
 )
 from borrow import (
-    borrow_book, return_book, list_currently_borrowed, list_all_borrowed,
-    books_borrowed_by_student, who_borrowed_book
+    borrow_table, borrow_book, return_book, list_currently_borrowed, list_all_borrowed,
+    books_borrowed_by_student, who_borrowed_book, list_borrowed_details,
+    students_with_borrows, is_book_currently_borrowed, iter_borrowed_details,
+    iter_borrowed, currently_borrowed_ids, available_books, items_out,
+    top_borrowed_books, students_with_open_loans, overdue_loans, loans_due_within
 )
+from store import id_number
 
 # ---------- Utility UI helpers ----------
 def center_window(win, w=800, h=600):
@@ -21,6 +30,161 @@ def center_window(win, w=800, h=600):
     y = (sh - h) // 2
     win.geometry(f"{w}x{h}+{x}+{y}")
 
+def human_bytes(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+
+# ---------- Data fetches (run on the task pool, never on the Tk thread) ----------
+# within is (version, rows) from an earlier search that query extends; the
+# rows are only narrowed down if the table hasn't changed since
+def fetch_books(query="", within=None):
+    version = books_table.version()
+    rows = within[1] if within is not None and within[0] == version else None
+    books = search_books(query, rows) if query else load_books()
+    return books, currently_borrowed_ids(), version
+
+def fetch_students(query="", within=None):
+    version = students_table.version()
+    rows = within[1] if within is not None and within[0] == version else None
+    return (search_students(query, rows) if query else load_students()), version
+
+def preload_tables():
+    # read every table while the user looks at the first tab, so the
+    # others open without waiting on a load
+    for table in (books_table, students_table, borrow_table):
+        table.refresh()
+
+def student_has_active_borrow(student_id):
+    return any(not r.get("return_date") for r in books_borrowed_by_student(student_id))
+
+def with_progress(task, rows, step=2000):
+    # total is 0 for streamed rows; the progress bar then just shows activity
+    total = len(rows) if hasattr(rows, "__len__") else 0
+    i = 0
+    for i, r in enumerate(rows):
+        if i % step == 0:
+            if task.cancelled:
+                return
+            task.progress(i, total)
+        yield r
+    task.progress(total or i, total)
+
+def cached_report(*deps):
+    # keep a report's finished text until a table it reads changes, so
+    # showing it again is instant; a report cut short is not kept
+    def wrap(fn):
+        if not cache.queries.size:
+            return fn
+
+        @wraps(fn)
+        def report(task):
+            return cache.remember("gui." + fn.__name__, (), deps, lambda: fn(task),
+                                  keep=lambda text: not task.cancelled)
+        return report
+    return wrap
+
+@cached_report(borrow_table, students_table, books_table)
+def report_currently_borrowed(task):
+    lines = []
+    for r in with_progress(task, iter_borrowed_details(iter_borrowed(status="open"))):
+        lines.append(f'{r["student_name"] or "Unknown"} (ID {r["student_id"]}) -> {r["book_title"] or "Unknown"} (ID {r["book_id"]}) on {r.get("borrow_date","")}')
+    return "\n".join(lines) if lines else "No currently borrowed books.\n"
+
+@cached_report(books_table, borrow_table)
+def report_available_books(task):
+    lines = []
+    books = sorted(available_books(), key=lambda b: id_number(b["book_id"]))
+    for b in with_progress(task, books):
+        lines.append(f'{b["book_id"]} - {b.get("title","")} by {b.get("author","")}')
+    return "\n".join(lines) if lines else "No available books.\n"
+
+@cached_report(books_table, borrow_table)
+def report_top_borrowed(task, n=20):
+    lines = [f"Items out now: {items_out()}", ""]
+    for b, bid, count in with_progress(task, top_borrowed_books(n)):
+        title = b.get("title", "") if b else "Unknown"
+        lines.append(f'{count:>5}x  {bid} - {title}')
+    return "\n".join(lines) if len(lines) > 2 else "No borrow records.\n"
+
+@cached_report(students_table, borrow_table)
+def report_open_loans(task):
+    lines = []
+    for s, sid, count in with_progress(task, students_with_open_loans()):
+        name = s.get("name", "") if s else "Unknown"
+        lines.append(f'{sid} - {name}: {count} open loan{"s" if count != 1 else ""}')
+    return "\n".join(lines) if lines else "No open loans.\n"
+
+@cached_report(borrow_table, students_table, cache.calendar)
+def report_overdue(task):
+    students = {s["student_id"]: s for s in load_students()}
+    lines = []
+    for r in with_progress(task, overdue_loans()):
+        s = students.get(r["student_id"])
+        lines.append(f'{r["days_overdue"]:>4} days  {s["name"] if s else "Unknown"} (ID {r["student_id"]}) - book {r["book_id"]}, due {r["due_date"]}')
+    soon = loans_due_within(3)
+    if soon:
+        lines += ["", f"Due in the next 3 days: {len(soon)}"]
+        for r in soon:
+            lines.append(f'   {r["due_date"]}  student {r["student_id"]} - book {r["book_id"]}')
+    return "\n".join(lines) if lines else "No overdue loans.\n"
+
+@cached_report(students_table, books_table, borrow_table)
+def report_students_borrows(task):
+    lines = []
+    for s, borrows in with_progress(task, students_with_borrows()):
+        lines.append(f'{s["student_id"]} - {s["name"]}:')
+        for br in borrows:
+            status = "Returned" if br.get("return_date") else "Not returned"
+            lines.append(f'   {br["book_id"]} - {br["book_title"] or "Unknown"} (Borrowed: {br.get("borrow_date","")}) - {status}')
+    return "\n".join(lines) if lines else "No borrow records.\n"
+
+# ---------- Search-as-you-type ----------
+class LiveSearch:
+    """
+    Searches as the user types into var: DELAY_MS after the last keystroke
+    fetch(query, within) runs on the task pool and show(result) gets the
+    result. Each search goes on channel, so one still queued or running is
+    cancelled by the next. A query that extends the last one is matched
+    against the last results when there are at most REFINE_MAX of them;
+    past that the word index is the faster way (at 100k books, refining
+    6,000 rows takes ~60 ms, a fresh index search ~18 ms).
+    """
+    DELAY_MS = 200
+    REFINE_MAX = 500
+
+    def __init__(self, app, var, fetch, show, channel):
+        self.app = app
+        self.var = var
+        self.fetch = fetch
+        self.show = show
+        self.channel = channel
+        self.pending = None
+        self.last = None  # (query, version, rows) of the last search shown
+        var.trace_add("write", self.changed)
+
+    def changed(self, *args):
+        if self.pending is not None:
+            self.app.root.after_cancel(self.pending)
+        self.pending = self.app.root.after(self.DELAY_MS, self.run)
+
+    def run(self):
+        if self.pending is not None:
+            self.app.root.after_cancel(self.pending)
+            self.pending = None
+        q = self.var.get().strip()
+        within = None
+        if self.last is not None:
+            last_q, version, rows = self.last
+            if last_q and q.startswith(last_q) and len(rows) <= self.REFINE_MAX:
+                within = (version, rows)
+
+        def done(result):
+            self.last = (q, result[-1], result[0])
+            self.show(result)
+        self.app.tasks.run(self.fetch, q, within, on_done=done, channel=self.channel)
+
 # ---------- Main App ----------
 class LibraryApp:
     def __init__(self, root):
@@ -28,20 +192,46 @@ class LibraryApp:
         root.title("Library Management System")
         center_window(root, 1000, 650)
 
-        # Create tabs
+        # All data I/O goes through this so the mainloop never blocks on it
+        self.tasks = TaskRunner(root, on_error=lambda e: messagebox.showerror("Error", str(e)))
+        root.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        # Create tabs. Each starts as an empty frame and is built (and loads
+        # its data) the first time it is shown, so the window comes up at once
         self.nb = ttk.Notebook(root)
         self.nb.pack(fill="both", expand=True, padx=8, pady=8)
 
-        self.create_books_tab()
-        self.create_students_tab()
-        self.create_borrow_tab()
-        self.create_reports_tab()
+        self.tab_builders = {}
+        for attr, text, build in (
+            ("books_tab", "Books", self.create_books_tab),
+            ("students_tab", "Students", self.create_students_tab),
+            ("borrow_tab", "Borrow / Return", self.create_borrow_tab),
+            ("reports_tab", "Reports", self.create_reports_tab),
+            ("analytics_tab", "Analytics", self.create_analytics_tab),
+            ("diag_tab", "Diagnostics", self.create_diagnostics_tab),
+        ):
+            frame = ttk.Frame(self.nb)
+            setattr(self, attr, frame)
+            self.nb.add(frame, text=text)
+            self.tab_builders[str(frame)] = build
+        self.nb.bind("<<NotebookTabChanged>>", self.on_tab_changed)
+        root.after_idle(self.on_tab_changed)
+        root.after_idle(lambda: self.tasks.run(preload_tables))
+
+    def on_close(self):
+        self.tasks.shutdown()
+        self.root.destroy()
+
+    def on_tab_changed(self, event=None):
+        build = self.tab_builders.pop(self.nb.select(), None)
+        if build is not None:
+            build()
+
+    def built(self, tab):
+        return str(tab) not in self.tab_builders
 
     # ---------------- Books Tab ----------------
     def create_books_tab(self):
-        self.books_tab = ttk.Frame(self.nb)
-        self.nb.add(self.books_tab, text="Books")
-
         # Top controls
         ctrl = ttk.Frame(self.books_tab)
         ctrl.pack(fill="x", pady=6)
@@ -54,27 +244,31 @@ class LibraryApp:
         ttk.Label(ctrl, text="Search:").pack(side="left", padx=(12,4))
         self.book_search_var = tk.StringVar()
         ttk.Entry(ctrl, textvariable=self.book_search_var, width=30).pack(side="left")
+        self.book_search = LiveSearch(self, self.book_search_var, fetch_books, self.show_books, "books")
         ttk.Button(ctrl, text="Go", command=self.search_books_action).pack(side="left", padx=4)
-        ttk.Button(ctrl, text="Show All", command=self.refresh_books).pack(side="left", padx=4)
+        ttk.Button(ctrl, text="Show All", command=lambda: self.book_search_var.set("")).pack(side="left", padx=4)
 
-        # Treeview
+        # Treeview (paged: rows are materialized as the user scrolls)
         cols = ("ID", "Title", "Author", "Year", "ISBN", "Status")
-        self.book_tree = ttk.Treeview(self.books_tab, columns=cols, show="headings")
         widths = [60, 320, 180, 80, 140, 90]
-        for c, w in zip(cols, widths):
-            self.book_tree.heading(c, text=c)
-            self.book_tree.column(c, width=w, anchor="w")
-        self.book_tree.pack(fill="both", expand=True, padx=8, pady=8)
+        self.book_view = PagedTree(self.books_tab, cols, widths, runner=self.tasks)
+        self.book_view.pack(fill="both", expand=True, padx=8, pady=8)
+        self.book_tree = self.book_view.tree
         self.refresh_books()
 
-    def refresh_books(self):
-        # Build status by checking borrowed records
-        borrowed_now = {r["book_id"] for r in list_currently_borrowed()}
-        for r in self.book_tree.get_children():
-            self.book_tree.delete(r)
-        for b in load_books():
+    def show_books(self, result):
+        # status comes from the borrowed set fetched alongside the books
+        books, borrowed_now, _ = result
+        def values(b):
             status = "Borrowed" if b["book_id"] in borrowed_now else "Available"
-            self.book_tree.insert("", "end", values=(b["book_id"], b["title"], b["author"], b["year"], b["isbn"], status))
+            return (b["book_id"], b["title"], b["author"], b["year"], b["isbn"], status)
+        self.book_view.set_rows(books, values, key=lambda b: b["book_id"])
+
+    def refresh_books(self):
+        # re-runs whatever is in the search box
+        if not self.built(self.books_tab):
+            return  # loads when first shown
+        self.book_search.run()
 
     def open_add_book(self):
         win = tk.Toplevel(self.root)
@@ -97,10 +291,11 @@ class LibraryApp:
             author = entries["author"].get().strip()
             year = entries["year"].get().strip()
             isbn = entries["isbn"].get().strip()
-            bid = add_book(title, author, year, isbn)
-            messagebox.showinfo("Added", f"Book added with ID {bid}")
-            win.destroy()
-            self.refresh_books()
+            def added(bid):
+                messagebox.showinfo("Added", f"Book added with ID {bid}")
+                win.destroy()
+                self.refresh_books()
+            self.tasks.run(add_book, title, author, year, isbn, on_done=added)
 
         ttk.Button(win, text="Add Book", command=on_add).grid(row=len(labels), column=0, columnspan=2, pady=12)
 
@@ -111,7 +306,9 @@ class LibraryApp:
             return
         vals = self.book_tree.item(sel[0])["values"]
         bid = vals[0]
-        book = find_book(bid)
+        self.tasks.run(find_book, bid, on_done=lambda book: self.edit_book_dialog(bid, book))
+
+    def edit_book_dialog(self, bid, book):
         if not book:
             messagebox.showerror("Error", "Book not found")
             return
@@ -134,10 +331,11 @@ class LibraryApp:
             author = entries["author"].get().strip()
             year = entries["year"].get().strip()
             isbn = entries["isbn"].get().strip()
-            update_book(bid, title=title, author=author, year=year, isbn=isbn)
-            messagebox.showinfo("Saved", "Book updated")
-            win.destroy()
-            self.refresh_books()
+            def saved(_):
+                messagebox.showinfo("Saved", "Book updated")
+                win.destroy()
+                self.refresh_books()
+            self.tasks.run(lambda: update_book(bid, title=title, author=author, year=year, isbn=isbn), on_done=saved)
 
         ttk.Button(win, text="Save Changes", command=on_save).grid(row=len(labels), column=0, columnspan=2, pady=12)
 
@@ -149,29 +347,19 @@ class LibraryApp:
         vals = self.book_tree.item(sel[0])["values"]
         bid = vals[0]
         # prevent delete if currently borrowed
-        active = list_currently_borrowed()
-        if any(r["book_id"] == str(bid) for r in active):
-            messagebox.showerror("Error", "Book is currently borrowed. Can't delete.")
-            return
-        if messagebox.askyesno("Confirm", "Delete selected book?"):
-            delete_book(bid)
-            self.refresh_books()
+        def checked(borrowed):
+            if borrowed:
+                messagebox.showerror("Error", "Book is currently borrowed. Can't delete.")
+                return
+            if messagebox.askyesno("Confirm", "Delete selected book?"):
+                self.tasks.run(delete_book, bid, on_done=lambda _: self.refresh_books())
+        self.tasks.run(is_book_currently_borrowed, bid, on_done=checked)
 
     def search_books_action(self):
-        q = self.book_search_var.get().strip()
-        res = search_books(q)
-        borrowed_now = {r["book_id"] for r in list_currently_borrowed()}
-        for r in self.book_tree.get_children():
-            self.book_tree.delete(r)
-        for b in res:
-            status = "Borrowed" if b["book_id"] in borrowed_now else "Available"
-            self.book_tree.insert("", "end", values=(b["book_id"], b["title"], b["author"], b["year"], b["isbn"], status))
+        self.book_search.run()
 
     # ---------------- Students Tab ----------------
     def create_students_tab(self):
-        self.students_tab = ttk.Frame(self.nb)
-        self.nb.add(self.students_tab, text="Students")
-
         ctrl = ttk.Frame(self.students_tab)
         ctrl.pack(fill="x", pady=6)
 
@@ -183,23 +371,27 @@ class LibraryApp:
         ttk.Label(ctrl, text="Search:").pack(side="left", padx=(12,4))
         self.student_search_var = tk.StringVar()
         ttk.Entry(ctrl, textvariable=self.student_search_var, width=30).pack(side="left")
+        self.student_search = LiveSearch(self, self.student_search_var, fetch_students,
+                                         self.show_students, "students")
         ttk.Button(ctrl, text="Go", command=self.search_students_action).pack(side="left", padx=4)
-        ttk.Button(ctrl, text="Show All", command=self.refresh_students).pack(side="left", padx=4)
+        ttk.Button(ctrl, text="Show All", command=lambda: self.student_search_var.set("")).pack(side="left", padx=4)
 
         cols = ("ID", "Name", "Semester", "Phone")
-        self.student_tree = ttk.Treeview(self.students_tab, columns=cols, show="headings")
         widths = [80, 360, 120, 140]
-        for c,w in zip(cols,widths):
-            self.student_tree.heading(c, text=c)
-            self.student_tree.column(c, width=w, anchor="w")
-        self.student_tree.pack(fill="both", expand=True, padx=8, pady=8)
+        self.student_view = PagedTree(self.students_tab, cols, widths, runner=self.tasks)
+        self.student_view.pack(fill="both", expand=True, padx=8, pady=8)
+        self.student_tree = self.student_view.tree
         self.refresh_students()
 
+    def show_students(self, result):
+        students, _ = result
+        self.student_view.set_rows(students, lambda s: (s["student_id"], s["name"], s.get("semester",""), s.get("phone","")),
+                                   key=lambda s: s["student_id"])
+
     def refresh_students(self):
-        for r in self.student_tree.get_children():
-            self.student_tree.delete(r)
-        for s in load_students():
-            self.student_tree.insert("", "end", values=(s["student_id"], s["name"], s.get("semester",""), s.get("phone","")))
+        if not self.built(self.students_tab):
+            return
+        self.student_search.run()
 
     def open_add_student(self):
         win = tk.Toplevel(self.root)
@@ -221,10 +413,11 @@ class LibraryApp:
                 return
             cls = entries["semester"].get().strip()
             phone = entries["phone"].get().strip()
-            sid = add_student(name, cls, phone)
-            messagebox.showinfo("Added", f"Student added with ID {sid}")
-            win.destroy()
-            self.refresh_students()
+            def added(sid):
+                messagebox.showinfo("Added", f"Student added with ID {sid}")
+                win.destroy()
+                self.refresh_students()
+            self.tasks.run(add_student, name, cls, phone, on_done=added)
 
         ttk.Button(win, text="Add Student", command=on_add).grid(row=len(labels), column=0, columnspan=2, pady=10)
 
@@ -235,7 +428,9 @@ class LibraryApp:
             return
         vals = self.student_tree.item(sel[0])["values"]
         sid = vals[0]
-        s = find_student(sid)
+        self.tasks.run(find_student, sid, on_done=lambda s: self.edit_student_dialog(sid, s))
+
+    def edit_student_dialog(self, sid, s):
         if not s:
             messagebox.showerror("Error", "Student not found")
             return
@@ -257,10 +452,11 @@ class LibraryApp:
             name = entries["name"].get().strip()
             cls = entries["semester"].get().strip()
             phone = entries["phone"].get().strip()
-            update_student(sid, name=name, cls=cls, phone=phone)
-            messagebox.showinfo("Saved", "Student updated")
-            win.destroy()
-            self.refresh_students()
+            def saved(_):
+                messagebox.showinfo("Saved", "Student updated")
+                win.destroy()
+                self.refresh_students()
+            self.tasks.run(lambda: update_student(sid, name=name, cls=cls, phone=phone), on_done=saved)
 
         ttk.Button(win, text="Save Changes", command=on_save).grid(row=len(labels), column=0, columnspan=2, pady=10)
 
@@ -272,27 +468,19 @@ class LibraryApp:
         vals = self.student_tree.item(sel[0])["values"]
         sid = vals[0]
         # prevent delete if student has active borrow
-        active = list_currently_borrowed()
-        if any(r["student_id"] == str(sid) for r in active):
-            messagebox.showerror("Error", "Student has currently borrowed books. Can't delete.")
-            return
-        if messagebox.askyesno("Confirm", "Delete selected student?"):
-            delete_student(sid)
-            self.refresh_students()
+        def checked(active):
+            if active:
+                messagebox.showerror("Error", "Student has currently borrowed books. Can't delete.")
+                return
+            if messagebox.askyesno("Confirm", "Delete selected student?"):
+                self.tasks.run(delete_student, sid, on_done=lambda _: self.refresh_students())
+        self.tasks.run(student_has_active_borrow, sid, on_done=checked)
 
     def search_students_action(self):
-        q = self.student_search_var.get().strip()
-        res = search_students(q)
-        for r in self.student_tree.get_children():
-            self.student_tree.delete(r)
-        for s in res:
-            self.student_tree.insert("", "end", values=(s["student_id"], s["name"], s.get("semester",""), s.get("phone","")))
+        self.student_search.run()
 
     # ---------------- Borrow Tab ----------------
     def create_borrow_tab(self):
-        self.borrow_tab = ttk.Frame(self.nb)
-        self.nb.add(self.borrow_tab, text="Borrow / Return")
-
         ctrl = ttk.Frame(self.borrow_tab)
         ctrl.pack(fill="x", pady=6)
 
@@ -310,12 +498,10 @@ class LibraryApp:
 
         # Borrow listing
         cols = ("BorrowID", "StudentID", "StudentName", "BookID", "BookTitle", "BorrowDate", "ReturnDate")
-        self.borrow_tree = ttk.Treeview(self.borrow_tab, columns=cols, show="headings")
         widths = [80, 90, 220, 90, 220, 100, 100]
-        for c,w in zip(cols,widths):
-            self.borrow_tree.heading(c, text=c)
-            self.borrow_tree.column(c, width=w, anchor="w")
-        self.borrow_tree.pack(fill="both", expand=True, padx=8, pady=8)
+        self.borrow_view = PagedTree(self.borrow_tab, cols, widths, runner=self.tasks)
+        self.borrow_view.pack(fill="both", expand=True, padx=8, pady=8)
+        self.borrow_tree = self.borrow_view.tree
         self.refresh_borrow_tree()
 
     def borrow_action(self):
@@ -324,14 +510,16 @@ class LibraryApp:
         if not sid or not bid:
             messagebox.showerror("Error", "Student ID and Book ID required")
             return
-        ok, msg = borrow_book(sid, bid)
-        if ok:
-            messagebox.showinfo("Success", msg)
-            self.refresh_borrow_tree()
-            self.refresh_books()
-            self.refresh_students()
-        else:
-            messagebox.showerror("Error", msg)
+        def done(result):
+            ok, msg = result
+            if ok:
+                messagebox.showinfo("Success", msg)
+                self.refresh_borrow_tree()
+                self.refresh_books()
+                self.refresh_students()
+            else:
+                messagebox.showerror("Error", msg)
+        self.tasks.run(borrow_book, sid, bid, on_done=done)
 
     def return_action(self):
         sid = self.borrow_student_var.get().strip()
@@ -339,83 +527,243 @@ class LibraryApp:
         if not sid or not bid:
             messagebox.showerror("Error", "Student ID and Book ID required")
             return
-        ok, msg = return_book(student_id=sid, book_id=bid)
-        if ok:
-            messagebox.showinfo("Success", msg)
-            self.refresh_borrow_tree()
-            self.refresh_books()
-        else:
-            messagebox.showerror("Error", msg)
+        def done(result):
+            ok, msg = result
+            if ok:
+                messagebox.showinfo("Success", msg)
+                self.refresh_borrow_tree()
+                self.refresh_books()
+            else:
+                messagebox.showerror("Error", msg)
+        self.tasks.run(lambda: return_book(student_id=sid, book_id=bid), on_done=done)
 
     def refresh_borrow_tree(self):
-        for r in self.borrow_tree.get_children():
-            self.borrow_tree.delete(r)
-        for br in list_all_borrowed():
-            s = find_student(br["student_id"]) or {}
-            b = find_book(br["book_id"]) or {}
-            self.borrow_tree.insert("", "end", values=(
-                br.get("borrow_id",""),
-                br.get("student_id",""),
-                s.get("name",""),
-                br.get("book_id",""),
-                b.get("title",""),
-                br.get("borrow_date",""),
-                br.get("return_date","")
-            ))
+        if not self.built(self.borrow_tab):
+            return
+        self.tasks.run(list_borrowed_details, on_done=self.show_borrows, channel="borrows")
+
+    def show_borrows(self, rows):
+        self.borrow_view.set_rows(rows, lambda br: (
+            br.get("borrow_id",""),
+            br.get("student_id",""),
+            br["student_name"],
+            br.get("book_id",""),
+            br["book_title"],
+            br.get("borrow_date",""),
+            br.get("return_date","")
+        ))
 
     # ---------------- Reports Tab ----------------
     def create_reports_tab(self):
-        self.reports_tab = ttk.Frame(self.nb)
-        self.nb.add(self.reports_tab, text="Reports")
-
         ctrl = ttk.Frame(self.reports_tab)
         ctrl.pack(fill="x", pady=6)
 
         ttk.Button(ctrl, text="Show Currently Borrowed", command=self.show_currently_borrowed).pack(side="left", padx=6)
         ttk.Button(ctrl, text="Show Available Books", command=self.show_available_books).pack(side="left", padx=6)
         ttk.Button(ctrl, text="Show Students and Their Borrowed Books", command=self.show_students_borrows).pack(side="left", padx=6)
+        ttk.Button(ctrl, text="Top Borrowed", command=self.show_top_borrowed).pack(side="left", padx=6)
+        ttk.Button(ctrl, text="Open Loans by Student", command=self.show_open_loans).pack(side="left", padx=6)
+        ttk.Button(ctrl, text="Overdue", command=self.show_overdue).pack(side="left", padx=6)
+
+        self.report_progress = ttk.Progressbar(ctrl, length=200, mode="determinate")
+        self.report_progress.pack(side="right", padx=6)
 
         # Output box
         self.report_box = tk.Text(self.reports_tab, wrap="none")
         self.report_box.pack(fill="both", expand=True, padx=8, pady=8)
 
-    def show_currently_borrowed(self):
+    def run_report(self, fn):
+        # a new report supersedes one still being built
         self.report_box.delete("1.0", "end")
-        lines = []
-        for r in list_currently_borrowed():
-            s = find_student(r["student_id"]) or {}
-            b = find_book(r["book_id"]) or {}
-            lines.append(f'{s.get("name","Unknown")} (ID {r["student_id"]}) -> {b.get("title","Unknown")} (ID {r["book_id"]}) on {r.get("borrow_date","")}')
-        if not lines:
-            self.report_box.insert("1.0", "No currently borrowed books.\n")
+        self.report_progress.configure(value=0)
+        self.tasks.run(fn, on_done=self.show_report, on_progress=self.report_progressed,
+                       channel="report", with_task=True)
+
+    def report_progressed(self, done, total):
+        if total:
+            self.report_progress.configure(mode="determinate", maximum=total, value=done)
         else:
-            self.report_box.insert("1.0", "\n".join(lines))
+            self.report_progress.configure(mode="indeterminate")
+            self.report_progress.step()
 
-    def show_available_books(self):
+    def show_report(self, text):
+        self.report_progress.configure(mode="determinate", maximum=1, value=1)
         self.report_box.delete("1.0", "end")
-        borrowed_ids = {r["book_id"] for r in list_currently_borrowed()}
-        lines = []
-        for b in load_books():
-            if b["book_id"] not in borrowed_ids:
-                lines.append(f'{b["book_id"]} - {b.get("title","")} by {b.get("author","")}')
-        if not lines:
-            self.report_box.insert("1.0", "No available books.\n")
-        else:
-            self.report_box.insert("1.0", "\n".join(lines))
+        self.report_box.insert("1.0", text)
+
+    def show_currently_borrowed(self):
+        self.run_report(report_currently_borrowed)
+
+    def show_available_books(self):
+        self.run_report(report_available_books)
 
     def show_students_borrows(self):
-        self.report_box.delete("1.0", "end")
-        students = load_students()
-        lines = []
-        for s in students:
-            borrows = books_borrowed_by_student(s["student_id"])
-            if borrows:
-                lines.append(f'{s["student_id"]} - {s["name"]}:')
-                for br in borrows:
-                    b = find_book(br["book_id"]) or {}
-                    status = "Returned" if br.get("return_date") else "Not returned"
-                    lines.append(f'   {br["book_id"]} - {b.get("title","Unknown")} (Borrowed: {br.get("borrow_date","")}) - {status}')
-        if not lines:
-            self.report_box.insert("1.0", "No borrow records.\n")
+        self.run_report(report_students_borrows)
+
+    def show_top_borrowed(self):
+        self.run_report(report_top_borrowed)
+
+    def show_open_loans(self):
+        self.run_report(report_open_loans)
+
+    def show_overdue(self):
+        self.run_report(report_overdue)
+
+    # ---------------- Analytics Tab ----------------
+    # analytics (and NumPy, when installed) is imported when the tab is first
+    # shown, not at start-up; a run reads the whole borrow history.
+    def create_analytics_tab(self):
+        import analytics
+        ctrl = ttk.Frame(self.analytics_tab)
+        ctrl.pack(fill="x", pady=6)
+
+        ttk.Label(ctrl, text="Year:").pack(side="left", padx=(6, 4))
+        self.analytics_year = tk.StringVar()
+        ttk.Entry(ctrl, textvariable=self.analytics_year, width=8).pack(side="left")
+        ttk.Button(ctrl, text="Run", command=self.run_analytics).pack(side="left", padx=6)
+        ttk.Label(ctrl, text="Table:").pack(side="left", padx=(12, 4))
+        self.analytics_table = tk.StringVar(value="summary")
+        box = ttk.Combobox(ctrl, textvariable=self.analytics_table, values=list(analytics.TABLES),
+                           state="readonly", width=16)
+        box.pack(side="left")
+        box.bind("<<ComboboxSelected>>", lambda e: self.show_analytics_table())
+        ttk.Button(ctrl, text="Export CSV...", command=lambda: self.export_analytics(".csv")).pack(side="left", padx=(12, 4))
+        ttk.Button(ctrl, text="Export JSON...", command=lambda: self.export_analytics(".json")).pack(side="left", padx=4)
+
+        self.analytics_progress = ttk.Progressbar(ctrl, length=200, mode="determinate")
+        self.analytics_progress.pack(side="right", padx=6)
+
+        self.analytics_result = None
+        self.analytics_view = None
+        self.run_analytics()
+
+    def run_analytics(self):
+        import analytics
+        text = self.analytics_year.get().strip()
+        if text and not text.isdigit():
+            messagebox.showwarning("Validation", "Year must be a number (or empty for all years).")
+            return
+        year = int(text) if text else None
+        self.analytics_progress.configure(value=0)
+        self.tasks.run(lambda task: analytics.analyze(year, progress=task.progress),
+                       on_done=self.show_analytics, on_progress=self.analytics_progressed,
+                       channel="analytics", with_task=True)
+
+    def analytics_progressed(self, done, total):
+        self.analytics_progress.configure(maximum=total or 1, value=done)
+
+    def show_analytics(self, result):
+        self.analytics_progress.configure(maximum=1, value=1)
+        self.analytics_result = result
+        self.show_analytics_table()
+
+    def show_analytics_table(self):
+        import analytics
+        if self.analytics_result is None:
+            return
+        table = self.analytics_table.get()
+        cols = analytics.TABLES[table]
+        # the columns differ from table to table, so each gets a fresh view
+        if self.analytics_view is not None:
+            self.analytics_view.destroy()
+        self.analytics_view = PagedTree(self.analytics_tab, cols, [160] + [110] * (len(cols) - 1),
+                                        runner=self.tasks)
+        self.analytics_view.pack(fill="both", expand=True, padx=8, pady=8)
+        self.analytics_view.set_rows(self.analytics_result[table],
+                                     values=lambda r: tuple("" if r[c] is None else r[c] for c in cols))
+
+    def export_analytics(self, ext):
+        import analytics
+        if self.analytics_result is None:
+            messagebox.showinfo("Export", "Run the analytics first.")
+            return
+        table = self.analytics_table.get()
+        path = filedialog.asksaveasfilename(defaultextension=ext, initialfile=f"library-{table}{ext}",
+                                            filetypes=[("CSV", "*.csv")] if ext == ".csv" else [("JSON", "*.json")])
+        if path:
+            # CSV holds the table shown; JSON every table
+            result = self.analytics_result
+            self.tasks.run(analytics.export, result, path, table if ext == ".csv" else None,
+                           on_done=lambda _: messagebox.showinfo("Exported", f"Analytics written to {path}"))
+
+    # ---------------- Diagnostics Tab ----------------
+    DIAG_COLUMNS = ("Operation", "Table", "Calls", "Errors", "Mean ms", "p50 ms", "p95 ms", "Max ms",
+                    "Total s", "Rows", "Read", "Written")
+    DIAG_MS = 1000
+
+    def create_diagnostics_tab(self):
+        ctrl = ttk.Frame(self.diag_tab)
+        ctrl.pack(fill="x", padx=8, pady=6)
+        ttk.Button(ctrl, text="Reset Counters", command=self.reset_metrics).pack(side="left", padx=4)
+        ttk.Button(ctrl, text="Export JSON...", command=lambda: self.export_metrics(".json")).pack(side="left", padx=4)
+        ttk.Button(ctrl, text="Export Prometheus...", command=lambda: self.export_metrics(".prom")).pack(side="left", padx=4)
+        self.profile_button = ttk.Button(ctrl, text="Start Profiling", command=self.toggle_profile)
+        self.profile_button.pack(side="left", padx=4)
+        self.diag_status = ttk.Label(ctrl)
+        self.diag_status.pack(side="right", padx=4)
+
+        widths = (170, 70, 60, 50, 70, 60, 60, 70, 60, 80, 70, 70)
+        self.diag_tree = ttk.Treeview(self.diag_tab, columns=self.DIAG_COLUMNS, show="headings")
+        for c, w in zip(self.DIAG_COLUMNS, widths):
+            self.diag_tree.heading(c, text=c)
+            self.diag_tree.column(c, width=w, anchor="w" if c in ("Operation", "Table") else "e")
+        self.diag_tree.pack(fill="both", expand=True, padx=8)
+
+        self.profile_box = tk.Text(self.diag_tab, wrap="none", height=10)
+        self.profile_box.pack(fill="x", padx=8, pady=8)
+        if not metrics.ENABLED:
+            self.diag_status.configure(text="Metrics are off (LIBRARY_METRICS=off)")
+        self.root.after(self.DIAG_MS, self.tick_diagnostics)
+
+    def tick_diagnostics(self):
+        # only redrawn while the tab is showing; a snapshot is a few dict copies
+        if self.nb.select() == str(self.diag_tab):
+            self.show_metrics()
+        self.root.after(self.DIAG_MS, self.tick_diagnostics)
+
+    def show_metrics(self):
+        snap = metrics.snapshot()
+        self.diag_tree.delete(*self.diag_tree.get_children())
+        for d in sorted(snap["operations"], key=lambda d: -d["seconds"]):
+            self.diag_tree.insert("", "end", values=(
+                d["op"], d["table"], d["calls"], d["errors"],
+                f'{d["mean_seconds"] * 1000:.3f}', f'{d["p50_seconds"] * 1000:.2f}',
+                f'{d["p95_seconds"] * 1000:.2f}', f'{d["max_seconds"] * 1000:.2f}',
+                f'{d["seconds"]:.2f}', d["rows"], human_bytes(d["bytes_read"]), human_bytes(d["bytes_written"]),
+            ))
+        c = cache.stats()
+        looked = c["hits"] + c["misses"]
+        hit_rate = f' ({c["hits"] / looked:.0%} hits)' if looked else ""
+        cached = f'query cache: {c["entries"]}/{c["size"]} results, {c["hits"]} hits, {c["misses"]} misses{hit_rate}'
+        if metrics.ENABLED:
+            state = "profiling" if snap["profiling"] else "live"
+            self.diag_status.configure(text=f'{state} - counting for {snap["uptime_seconds"]:.0f}s - {cached}')
         else:
-            self.report_box.insert("1.0", "\n".join(lines))
+            self.diag_status.configure(text=f"Metrics are off (LIBRARY_METRICS=off) - {cached}")
+
+    def reset_metrics(self):
+        metrics.reset()
+        cache.queries.reset()
+        self.show_metrics()
+
+    def export_metrics(self, ext):
+        path = filedialog.asksaveasfilename(defaultextension=ext, initialfile="library-metrics" + ext,
+                                            filetypes=[("JSON", "*.json")] if ext == ".json" else [("Prometheus text", "*.prom")])
+        if path:
+            self.tasks.run(metrics.export, path, on_done=lambda _: messagebox.showinfo("Exported", f"Metrics written to {path}"))
+
+    def toggle_profile(self):
+        if not metrics.profiling():
+            metrics.start_profile()
+            self.profile_button.configure(text="Stop Profiling")
+            self.profile_box.delete("1.0", "end")
+            self.profile_box.insert("1.0", "Profiling... use the app, then press Stop Profiling.\n")
+            return
+        self.profile_button.configure(text="Start Profiling")
+        path = filedialog.asksaveasfilename(defaultextension=".prof", initialfile="library.prof",
+                                            title="Save raw profile (Cancel to just show it)")
+        self.tasks.run(metrics.stop_profile, path or None, on_done=self.show_profile)
+
+    def show_profile(self, text):
+        self.profile_box.delete("1.0", "end")
+        self.profile_box.insert("1.0", text)
@@ -0,0 +1,93 @@
+# locks.py
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# ----- cross-process file locks -----
+# An exclusive lock on a small "<name>.lock" file next to a data file, so
+# desks sharing one data/ folder (network drive, several windows) take
+# turns on read-modify-write sequences. flock() on POSIX, a one-byte
+# msvcrt region lock on Windows; either way the OS drops the lock if the
+# process dies, so a crashed desk never leaves the folder locked.
+#
+# The lock file also holds two counters: the version, bumped on every
+# change, and the epoch, bumped whenever the data files are rewritten
+# rather than appended to. Readers compare them without taking the lock
+# to notice that their in-memory copy is stale, and whether it can be
+# caught up from where they left off.
+
+VERSION_WIDTH = 20
+VERSION_BYTES = 2 * VERSION_WIDTH + 1
+LOCK_BYTE = 1 << 20  # region locked on Windows, clear of the version digits
+
+class FileLock:
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def acquire(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            else:
+                os.lseek(fd, LOCK_BYTE, os.SEEK_SET)
+                while True:
+                    try:
+                        msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        # LK_LOCK gives up after ~10 s of retries; keep waiting
+                        continue
+        except BaseException:
+            os.close(fd)
+            raise
+        self.fd = fd
+
+    def release(self):
+        fd, self.fd = self.fd, None
+        try:
+            if fcntl is None:
+                os.lseek(fd, LOCK_BYTE, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(fd)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    # ----- version / epoch -----
+    def read_version(self):
+        os.lseek(self.fd, 0, os.SEEK_SET)
+        return parse_version(os.read(self.fd, VERSION_BYTES)) or (0, 0)
+
+    def write_version(self, version, epoch):
+        # fixed width, so an unlocked reader never sees a half-shortened number
+        os.lseek(self.fd, 0, os.SEEK_SET)
+        os.write(self.fd, b"%0*d %0*d" % (VERSION_WIDTH, version, VERSION_WIDTH, epoch))
+
+def parse_version(data):
+    """(version, epoch) from lock file contents; None if unreadable."""
+    if not data:
+        return (0, 0)
+    try:
+        version, epoch = data.split()
+        return (int(version), int(epoch))
+    except ValueError:
+        return None
+
+def read_version(path):
+    """(version, epoch) stored in a lock file, read without taking the lock."""
+    try:
+        with open(path, "rb") as f:
+            return parse_version(f.read(VERSION_BYTES))
+    except OSError:
+        return (0, 0)
@@ -1,11 +1,19 @@
 # main.py
+import multiprocessing
 import tkinter as tk
-from gui import LibraryApp
+import metrics
 
 def main():
+    metrics.start_exporter()  # only if LIBRARY_METRICS_FILE is set
     root = tk.Tk()
+    root.title("Library Management System")
+    root.update()  # on screen before the rest of the app is imported
+    from gui import LibraryApp
     app = LibraryApp(root)
     root.mainloop()
 
 if __name__ == "__main__":
+    # analytics reads big histories in spawned worker processes; in a frozen
+    # build they start this script again, and must not open a window
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,319 @@
+# metrics.py
+import io
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from time import perf_counter
+import config
+
+# ----- operation metrics -----
+# Call counts, latency histograms, rows and bytes per operation, for
+# telling where a slow desk spends its time: parsing CSVs (store.load),
+# replaying journals, index lookups (books.find_book), report joins or
+# filling Treeviews (gui.tree_insert).
+#
+# Operations are named "layer.what"; storage ones carry the table too
+# ("store.load", table="borrow"). Timing a block:
+#
+#     with metrics.timed("store.write_csv", "books") as span:
+#         ...
+#         span.rows, span.bytes_written = n, f.tell()
+#
+# or a whole function with @metrics.instrument("books.find_book").
+# With LIBRARY_METRICS=off both become no-ops at import time.
+#
+# snapshot() / to_json() / to_prometheus() export the numbers; export()
+# writes either to a file (LIBRARY_METRICS_FILE is refreshed every
+# METRICS_INTERVAL seconds when set), and the server has GET /metrics.
+
+# histogram bucket upper bounds, seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Stat:
+    __slots__ = ("calls", "errors", "seconds", "max", "buckets", "rows", "bytes_read", "bytes_written")
+
+    def __init__(self):
+        self.calls = self.errors = self.rows = self.bytes_read = self.bytes_written = 0
+        self.seconds = self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)  # the last one is +Inf
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th call (the max past the last bound)."""
+        if not self.calls:
+            return 0.0
+        want, seen = q * self.calls, 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= want:
+                return BUCKETS[i] if i < len(BUCKETS) else self.max
+        return self.max
+
+    def as_dict(self):
+        return {
+            "calls": self.calls, "errors": self.errors,
+            "seconds": round(self.seconds, 6), "max_seconds": round(self.max, 6),
+            "mean_seconds": round(self.seconds / self.calls, 6) if self.calls else 0.0,
+            "p50_seconds": self.quantile(0.5), "p95_seconds": self.quantile(0.95),
+            "rows": self.rows, "bytes_read": self.bytes_read, "bytes_written": self.bytes_written,
+            "buckets": list(self.buckets),
+        }
+
+stats = {}  # (op, table) -> Stat
+lock = threading.Lock()
+started = time.time()
+
+def _record(op, table, seconds, rows=0, bytes_read=0, bytes_written=0, error=False):
+    i = bisect_left(BUCKETS, seconds)
+    with lock:
+        s = stats.get((op, table))
+        if s is None:
+            s = stats[(op, table)] = Stat()
+        s.calls += 1
+        s.errors += error
+        s.seconds += seconds
+        if seconds > s.max:
+            s.max = seconds
+        s.buckets[i] += 1
+        s.rows += rows
+        s.bytes_read += bytes_read
+        s.bytes_written += bytes_written
+
+def reset():
+    global started
+    with lock:
+        stats.clear()
+        started = time.time()
+
+class Span:
+    """What a timed block adds to its operation; fill in rows/bytes as known."""
+    __slots__ = ("rows", "bytes_read", "bytes_written")
+
+    def __init__(self):
+        self.rows = self.bytes_read = self.bytes_written = 0
+
+class NoSpan:
+    """Accepts the same attributes as Span and keeps none of them."""
+    rows = bytes_read = bytes_written = 0
+
+    def __setattr__(self, name, value):
+        pass
+
+NO_SPAN = NoSpan()
+
+@contextmanager
+def _timed(op, table=""):
+    span = Span()
+    profiled = profile_on and profile_enter()
+    t = perf_counter()
+    error = False
+    try:
+        yield span
+    except GeneratorExit:
+        raise  # a generator the caller stopped reading early
+    except BaseException:
+        error = True
+        raise
+    finally:
+        _record(op, table, perf_counter() - t, span.rows, span.bytes_read, span.bytes_written, error)
+        if profiled:
+            profile_exit()
+
+@contextmanager
+def _untimed(op, table=""):
+    yield NO_SPAN
+
+def _instrument(op, rows=False):
+    """Decorator timing every call; rows=True also counts len(result)."""
+    def wrap(fn):
+        @wraps(fn)
+        def timed_call(*args, **kwargs):
+            profiled = profile_on and profile_enter()
+            t = perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException:
+                _record(op, "", perf_counter() - t, error=True)
+                raise
+            finally:
+                if profiled:
+                    profile_exit()
+            _record(op, "", perf_counter() - t, len(result) if rows and hasattr(result, "__len__") else 0)
+            return result
+        return timed_call
+    return wrap
+
+def _uninstrumented(op, rows=False):
+    return lambda fn: fn
+
+def _unrecorded(op, table, seconds, rows=0, bytes_read=0, bytes_written=0, error=False):
+    pass
+
+ENABLED = config.METRICS
+record = _record if ENABLED else _unrecorded
+timed = _timed if ENABLED else _untimed
+instrument = _instrument if ENABLED else _uninstrumented
+
+# ----- export -----
+def snapshot():
+    """{"uptime_seconds", "profiling", "operations": [{op, table, calls, ...}]}, sorted by op."""
+    with lock:
+        ops = [dict(op=op, table=table, **s.as_dict()) for (op, table), s in stats.items()]
+        uptime = time.time() - started
+    ops.sort(key=lambda d: (d["op"], d["table"]))
+    return {"uptime_seconds": round(uptime, 3), "profiling": profiling(),
+            "buckets": list(BUCKETS), "operations": ops}
+
+def to_json(indent=None):
+    return json.dumps(snapshot(), indent=indent)
+
+def label(text):
+    return str(text).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def to_prometheus():
+    """The snapshot in the Prometheus text exposition format."""
+    snap = snapshot()
+    out = []
+
+    def family(name, kind, help_text):
+        out.append(f"# HELP library_{name} {help_text}")
+        out.append(f"# TYPE library_{name} {kind}")
+
+    def labels(d, extra=""):
+        text = f'op="{label(d["op"])}"'
+        if d["table"]:
+            text += f',table="{label(d["table"])}"'
+        return "{" + text + extra + "}"
+
+    family("operation_seconds", "histogram", "Time spent per operation.")
+    for d in snap["operations"]:
+        cumulative = 0
+        for bound, n in zip(BUCKETS + ("+Inf",), d["buckets"]):
+            cumulative += n
+            le = ',le="%s"' % bound
+            out.append(f"library_operation_seconds_bucket{labels(d, le)} {cumulative}")
+        out.append(f'library_operation_seconds_sum{labels(d)} {d["seconds"]}')
+        out.append(f'library_operation_seconds_count{labels(d)} {d["calls"]}')
+    for name, field, help_text in (
+        ("operation_errors_total", "errors", "Operations that raised."),
+        ("operation_rows_total", "rows", "Rows read, scanned or written."),
+        ("operation_read_bytes_total", "bytes_read", "Bytes read from disk."),
+        ("operation_written_bytes_total", "bytes_written", "Bytes written to disk."),
+    ):
+        family(name, "counter", help_text)
+        for d in snap["operations"]:
+            out.append(f"library_{name}{labels(d)} {d[field]}")
+    family("uptime_seconds", "gauge", "Seconds since the counters were last reset.")
+    out.append(f'library_uptime_seconds {snap["uptime_seconds"]}')
+    return "\n".join(out) + "\n"
+
+def export(path):
+    """Write the metrics to path: JSON for *.json, Prometheus text otherwise."""
+    text = to_json(indent=2) if path.endswith(".json") else to_prometheus()
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8", newline="\n") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+def start_exporter(path=None, interval=None):
+    """Rewrite path every interval seconds from a background thread (LIBRARY_METRICS_FILE)."""
+    path = path or config.METRICS_FILE
+    interval = interval or config.METRICS_INTERVAL
+    if not path or not ENABLED:
+        return None
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                export(path)
+            except OSError:
+                pass  # e.g. the folder went away; try again next time
+
+    # a daemon is fine here: export() only ever replaces the file whole
+    thread = threading.Thread(target=loop, name="library-metrics", daemon=True)
+    thread.start()
+    return thread
+
+# ----- profiling -----
+# start_profile() turns on cProfile for every instrumented operation, in
+# whichever thread it runs (cProfile only sees the thread that enabled it,
+# so each thread gets its own profiler, entered at its outermost operation).
+# stop_profile() merges them and returns the top functions as text.
+# cProfile and pstats are only imported once profiling is used; they are
+# a noticeable part of the app's start-up otherwise.
+
+profilers = []        # every Profile created since start_profile()
+busy = set()          # those enabled right now, inside some thread's operation
+profile_on = False
+generation = 0        # bumped by start_profile(), so threads start fresh profilers
+local = threading.local()
+
+def profiling():
+    return profile_on
+
+def start_profile():
+    global profile_on, generation
+    with lock:
+        profilers.clear()
+        generation += 1
+        profile_on = True
+
+def profile_enter():
+    """Profile this thread from here on if profiling is on; True if profile_exit() is owed."""
+    if not profile_on:
+        return False
+    depth = getattr(local, "depth", 0)
+    if depth:
+        local.depth = depth + 1
+        return True
+    with lock:
+        # checked again under the lock, so stop_profile() never takes a
+        # profiler that is about to be switched on
+        if not profile_on:
+            return False
+        prof = getattr(local, "profiler", None)
+        if prof is None or local.generation != generation:
+            import cProfile
+            prof = local.profiler = cProfile.Profile()
+            local.generation = generation
+            profilers.append(prof)
+        try:
+            prof.enable()
+        except ValueError:
+            return False  # another profiler owns the interpreter (Python 3.12+ allows one)
+        busy.add(prof)
+    local.depth = 1
+    return True
+
+def profile_exit():
+    local.depth -= 1
+    if not local.depth:
+        local.profiler.disable()
+        with lock:
+            busy.discard(local.profiler)
+
+def stop_profile(path=None, limit=40, sort="cumulative"):
+    """Stop profiling; save the raw stats to path (for snakeviz etc.) and return a text summary."""
+    global profile_on
+    with lock:
+        profile_on = False
+        # a profiler can only be switched off by its own thread, so one still
+        # inside an operation (this call's own, for one) is left out
+        taken = [p for p in profilers if p not in busy]
+        profilers.clear()
+    if not taken:
+        return "No profile data (nothing ran while profiling was on).\n"
+    import pstats
+    out = io.StringIO()
+    ps = pstats.Stats(taken[0], stream=out)
+    for prof in taken[1:]:
+        ps.add(prof)
+    if path:
+        ps.dump_stats(path)
+    ps.sort_stats(sort).print_stats(limit)
+    return out.getvalue()
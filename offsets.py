@@ -0,0 +1,249 @@
+# offsets.py
+import array
+import csv
+import json
+import mmap
+import os
+import sys
+import threading
+import zlib
+from bisect import bisect_left
+from heapq import merge
+from struct import unpack_from
+import metrics
+
+# ----- offset index -----
+# Where each line of a CSV starts, by the value of a few ID columns, so a
+# single row can be read without parsing the whole file: "borrow.csv.idx"
+# maps borrow_id, student_id and book_id to byte offsets in borrow.csv. A
+# lookup is a binary search in the memory-mapped index plus one line read
+# from the memory-mapped CSV, the same few pages at any file size.
+#
+# The index remembers the CSV's (size, mtime) and a CRC of every BLOCK
+# bytes of it. When the CSV has changed, the blocks are compared to find
+# the first one that differs; lines starting before it keep their offsets
+# and only the rest of the file is parsed. Rows appended at the end (or a
+# compaction that only touched recent loans) cost a crc32 pass over the
+# file, not a CSV parse of it.
+#
+# Keys are the IDs as integers (anything else goes by its CRC, as a
+# negative number), and every line found is parsed and checked against
+# the value asked for, so a stale or colliding entry only costs a wasted
+# read. Meant for files whose fields never hold line breaks (IDs and
+# dates, as in borrow.csv). The CSV is only mapped for the length of a
+# lookup, so compaction can still replace it on Windows.
+
+FORMAT = 1
+BLOCK = 1 << 20
+PAIR = 16  # (key, offset), two native int64
+
+def index_key(value):
+    """The int an ID is filed under: the number itself, or -1 - its CRC."""
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    value = value.strip()
+    if value.isdigit() and len(value) < 19:
+        return int(value)
+    return -1 - zlib.crc32(value)
+
+def split_line(line):
+    """Fields of one CSV line (bytes) as strings."""
+    text = line.decode("utf-8").rstrip("\r\n")
+    if '"' in text:
+        return next(csv.reader([text]), [])
+    return text.split(",")
+
+class Keys:
+    """The keys of a sorted run of pairs in a mapped index, as a sequence for bisect."""
+    def __init__(self, buf, start, n):
+        self.buf = buf
+        self.start = start
+        self.n = n
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        return unpack_from("=q", self.buf, self.start + i * PAIR)[0]
+
+class OffsetIndex:
+    def __init__(self, path, fieldnames, fields):
+        # fields: the columns to index; rows come back in fieldnames order
+        self.path = path
+        self.idx_path = path + ".idx"
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self.fieldnames = list(fieldnames)
+        self.fields = list(fields)
+        self.lock = threading.Lock()
+        self.cached = (None, None)  # (index file stat, its header)
+
+    # ----- reading -----
+    def header(self, fd, buf):
+        st = os.fstat(fd)
+        stamp = (st.st_mtime_ns, st.st_size)
+        if self.cached[0] != stamp:
+            end = buf.find(b"\n")
+            meta = json.loads(buf[:end])
+            meta["base"] = end + 1
+            self.cached = (stamp, meta)
+        return self.cached[1]
+
+    def usable(self, meta, csv_stat):
+        return (meta.get("format") == FORMAT and meta.get("byteorder") == sys.byteorder
+                and meta.get("fields") == self.fields
+                and (meta.get("size"), meta.get("mtime_ns")) == (csv_stat.st_size, csv_stat.st_mtime_ns))
+
+    def rows(self, field, value):
+        """Rows (lists of strings in fieldnames order) whose field is value."""
+        key = index_key(str(value))
+        for _ in range(5):
+            found = self.find(field, key)
+            if found is not None:
+                return found
+            # the CSV changed under us (or there is no index yet)
+            self.update()
+        raise RuntimeError(f"{self.path} keeps changing; can't index it")
+
+    def find(self, field, key):
+        if not os.path.exists(self.idx_path):
+            return None
+        with metrics.timed("offsets.lookup", self.name) as span, \
+                open(self.idx_path, "rb") as fi, open(self.path, "rb") as fc:
+            csv_stat = os.fstat(fc.fileno())
+            with mmap.mmap(fi.fileno(), 0, access=mmap.ACCESS_READ) as mi:
+                meta = self.header(fi.fileno(), mi)
+                if not self.usable(meta, csv_stat):
+                    return None
+                if not meta["count"]:
+                    return []
+                start, n = meta["arrays"][field]
+                start += meta["base"]
+                pos = meta["positions"]
+                want = pos[self.fieldnames.index(field)]
+                out = []
+                with mmap.mmap(fc.fileno(), 0, access=mmap.ACCESS_READ) as mc:
+                    i = bisect_left(Keys(mi, start, n), key)
+                    while i < n:
+                        k, offset = unpack_from("=qq", mi, start + i * PAIR)
+                        if k != key:
+                            break
+                        end = mc.find(b"\n", offset)
+                        values = split_line(mc[offset:end if end >= 0 else len(mc)])
+                        if want is not None and want < len(values) and index_key(values[want]) == key:
+                            out.append([values[p] if p is not None and p < len(values) else "" for p in pos])
+                        i += 1
+                span.rows = len(out)
+                return out
+
+    # ----- building -----
+    def update(self):
+        """Bring the index file up to date with the CSV, re-parsing as little as possible."""
+        with self.lock, open(self.path, "rb") as fc:
+            csv_stat = os.fstat(fc.fileno())
+            old, old_pairs = self.read_old()
+            if old is not None and self.usable(old, csv_stat):
+                return  # another thread or desk got there first
+            if csv_stat.st_size == 0:
+                self.write(csv_stat, [], [], {f: array.array("q") for f in self.fields}, 0)
+                return
+            with metrics.timed("offsets.build", self.name) as span, \
+                    mmap.mmap(fc.fileno(), 0, access=mmap.ACCESS_READ) as mc:
+                size = len(mc)
+                end = mc.find(b"\n")
+                first = size if end < 0 else end + 1
+                header = split_line(mc[:first])
+                pos = [header.index(f) if f in header else None for f in self.fieldnames]
+
+                # how much of the file is as it was when the index was written
+                crcs, cut = [], 0
+                if (old is not None and old.get("format") == FORMAT and old.get("fields") == self.fields
+                        and old.get("byteorder") == sys.byteorder and old.get("positions") == pos):
+                    for i, crc in enumerate(old["crcs"]):
+                        lo, hi = i * BLOCK, min((i + 1) * BLOCK, old["size"])
+                        if hi > size or zlib.crc32(mc[lo:hi]) != crc:
+                            break
+                        cut = hi
+                        if hi - lo == BLOCK:
+                            crcs.append(crc)
+                keep = max(mc.rfind(b"\n", 0, cut) + 1, first)
+                for lo in range(len(crcs) * BLOCK, size, BLOCK):
+                    crcs.append(zlib.crc32(mc[lo:lo + BLOCK]))
+
+                # entries for the lines from keep on
+                wanted = [(f, pos[self.fieldnames.index(f)]) for f in self.fields]
+                fresh = {f: [] for f in self.fields}
+                offset, parsed = keep, 0
+                while offset < size:
+                    end = mc.find(b"\n", offset)
+                    end = size if end < 0 else end + 1
+                    line = mc[offset:end]
+                    if line.strip():
+                        parts = line.split(b",") if b'"' not in line else [
+                            v.encode("utf-8") for v in split_line(line)]
+                        for f, p in wanted:
+                            if p is not None and p < len(parts):
+                                fresh[f].append((index_key(parts[p]), offset))
+                        parsed += 1
+                    offset = end
+                span.rows, span.bytes_read = parsed, size - keep
+
+            pairs = {}
+            for f in self.fields:
+                kept = old_pairs.get(f) if keep > first else None
+                pairs[f] = self.combine(kept, sorted(fresh[f]), keep, old["size"] if kept else 0)
+            count = len(pairs[self.fields[0]]) // 2
+            self.write(csv_stat, crcs, pos, pairs, count)
+
+    def combine(self, kept, fresh, keep, old_size):
+        """Old pairs for lines before keep, merged with the new sorted ones, as a flat array."""
+        if kept is None:
+            kept = array.array("q")
+        elif keep < old_size:
+            # lines from keep on were parsed again; drop their old entries
+            kept = array.array("q", [v for i in range(0, len(kept), 2) if kept[i + 1] < keep
+                                     for v in (kept[i], kept[i + 1])])
+        out = array.array("q")
+        if not kept or not fresh or (kept[-2], kept[-1]) <= fresh[0]:
+            # the usual case for appends: new IDs sort after the old ones
+            out.extend(kept)
+            for k, offset in fresh:
+                out.append(k)
+                out.append(offset)
+            return out
+        old = ((kept[i], kept[i + 1]) for i in range(0, len(kept), 2))
+        for k, offset in merge(old, fresh):
+            out.append(k)
+            out.append(offset)
+        return out
+
+    def read_old(self):
+        """The current index file's header and pair arrays, or (None, {})."""
+        try:
+            with open(self.idx_path, "rb") as f:
+                data = f.read()
+            end = data.find(b"\n")
+            meta = json.loads(data[:end])
+            pairs = {}
+            for field, (start, n) in meta["arrays"].items():
+                a = array.array("q")
+                a.frombytes(data[end + 1 + start:end + 1 + start + n * PAIR])
+                pairs[field] = a
+            return meta, pairs
+        except (OSError, ValueError, KeyError, TypeError):
+            return None, {}
+
+    def write(self, csv_stat, crcs, pos, pairs, count):
+        arrays, start = {}, 0
+        for f in self.fields:
+            arrays[f] = [start, len(pairs[f]) // 2]
+            start += len(pairs[f]) * 8
+        meta = {"format": FORMAT, "byteorder": sys.byteorder, "fields": self.fields,
+                "size": csv_stat.st_size, "mtime_ns": csv_stat.st_mtime_ns,
+                "positions": pos, "count": count, "arrays": arrays, "crcs": crcs}
+        tmp = f"{self.idx_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(json.dumps(meta).encode("ascii") + b"\n")
+            for field in self.fields:
+                pairs[field].tofile(f)
+        # only derived data: no fsync, a lost or torn index is rebuilt
+        os.replace(tmp, self.idx_path)
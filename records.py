@@ -0,0 +1,149 @@
+# records.py
+import sys
+from collections.abc import Mapping
+from datetime import date
+
+# ----- compact row records -----
+# Rows are kept as __slots__ objects instead of one dict per CSV line. Each
+# field is stored in a compact typed form:
+#   "int"    - canonical integers ("12", not "012" or "") become ints
+#   "ref"    - same, but equal values share one int object (foreign keys)
+#   "date"   - YYYY-MM-DD becomes a shared date ordinal (an int)
+#   "intern" - repeated strings (authors, semesters) are interned
+#   "str"    - kept as is
+# Anything that does not round-trip exactly stays a string, so nothing in
+# the CSV is ever rewritten.
+#
+# Records are read-only Mappings that hand back the original strings, so
+# code written for csv.DictReader rows (r["book_id"], r.get("title", ""),
+# dict(r)) keeps working. The typed values are the attributes
+# (loan.book_id is an int, loan.borrow_date a date ordinal).
+
+def encode_int(s):
+    s = "" if s is None else str(s)
+    if s.isdigit() and len(s) < 19 and (s[0] != "0" or s == "0"):
+        return int(s)
+    return s
+
+_refs = {}
+def encode_ref(s):
+    v = _refs.get(s)
+    if v is None:
+        v = encode_int(s)
+        if v.__class__ is int:
+            v = _refs.setdefault(str(s), v)
+    return v
+
+_dates = {}
+def encode_date(s):
+    v = _dates.get(s)
+    if v is None:
+        v = s = "" if s is None else str(s)
+        if len(s) == 10 and s[4] == "-" and s[7] == "-":
+            try:
+                v = date.fromisoformat(s).toordinal()
+            except ValueError:
+                return s
+            v = _dates.setdefault(s, v)
+    return v
+
+def encode_intern(s):
+    return sys.intern("" if s is None else str(s))
+
+def encode_str(s):
+    return "" if s is None else str(s)
+
+ENCODERS = {
+    "int": encode_int, "ref": encode_ref, "date": encode_date,
+    "intern": encode_intern, "str": encode_str,
+}
+
+def decode(kind, v):
+    if v.__class__ is str:
+        return v
+    if kind == "date":
+        return date.fromordinal(v).isoformat()
+    return str(v)
+
+class Record(Mapping):
+    __slots__ = ()
+    kinds = {}  # field -> kind; fields not listed are "str"
+
+    def __init_subclass__(cls):
+        super().__init_subclass__()
+        cls.encoders = [ENCODERS[cls.kinds.get(f, "str")] for f in cls.__slots__]
+        # the slots' own setters: much cheaper per field than object.__setattr__
+        cls.setters = tuple(cls.__dict__[f].__set__ for f in cls.__slots__)
+
+    def __init__(self, *values):
+        for put, v in zip(self.setters, values):
+            put(self, v)
+
+    @classmethod
+    def from_encoded(cls, values):
+        """Build from values already in stored form (e.g. a snapshot), in field order."""
+        rec = object.__new__(cls)
+        for put, v in zip(cls.setters, values):
+            put(rec, v)
+        return rec
+
+    @classmethod
+    def from_row(cls, row):
+        """Build from a dict-like row of strings (missing fields become "")."""
+        if isinstance(row, cls):
+            return row
+        return cls(*[enc(row.get(f, "")) for enc, f in zip(cls.encoders, cls.__slots__)])
+
+    @classmethod
+    def from_values(cls, values):
+        """Build from a sequence of strings in field order."""
+        return cls.from_encoded([enc(v) for enc, v in zip(cls.encoders, values)])
+
+    @classmethod
+    def encode_field(cls, field, s):
+        return ENCODERS[cls.kinds.get(field, "str")](s)
+
+    def replace(self, changes):
+        """Copy with some fields changed (given as strings, like a dict update)."""
+        return self.__class__(*[
+            enc(changes[f]) if f in changes else getattr(self, f)
+            for enc, f in zip(self.encoders, self.__slots__)
+        ])
+
+    def to_dict(self):
+        return {f: self[f] for f in self.__slots__}
+
+    def __setattr__(self, name, value):
+        raise AttributeError("records are read-only; use replace()")
+
+    # ----- Mapping protocol (string values, like csv.DictReader rows) -----
+    def __getitem__(self, field):
+        if field not in self.__slots__:
+            raise KeyError(field)
+        return decode(self.kinds.get(field, "str"), getattr(self, field))
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.to_dict()!r})"
+
+    def __reduce__(self):
+        return (self.__class__, tuple(getattr(self, f) for f in self.__slots__))
+
+
+class Book(Record):
+    __slots__ = ("book_id", "title", "author", "year", "isbn")
+    kinds = {"book_id": "int", "author": "intern", "year": "ref"}
+
+class Student(Record):
+    __slots__ = ("student_id", "name", "semester", "phone")
+    kinds = {"student_id": "int", "semester": "intern"}
+
+class Loan(Record):
+    __slots__ = ("borrow_id", "student_id", "book_id", "borrow_date", "return_date")
+    kinds = {"borrow_id": "int", "student_id": "ref", "book_id": "ref",
+             "borrow_date": "date", "return_date": "date"}
@@ -0,0 +1,220 @@
+# search.py
+import re
+import unicodedata
+from bisect import bisect_left, insort
+
+# ----- text folding -----
+TOKEN_RE = re.compile(r"\w+")
+
+def fold(text):
+    """Lowercase and strip accents so 'Émile' matches 'emile'."""
+    text = text or ""
+    if text.isascii():
+        return text.lower()
+    text = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in text if not unicodedata.combining(c)).casefold()
+
+# ----- full-text index -----
+# Attached to a Table like any other index (see Table.add_index), so it
+# is rebuilt on reload and patched on every add/edit/delete.
+#
+# Two structures are kept:
+#   * an inverted index token -> {row key: field weight}, plus a sorted
+#     vocabulary so every query term can be matched as a prefix;
+#   * a trigram index over each field, used to answer plain substring
+#     queries exactly like the old "q in field.lower()" scans did.
+# The index is built lazily on the first search, so startup does not pay
+# for it.
+#
+# Search-as-you-type asks again on every keystroke, mostly with a query
+# that extends the last one. Whatever matches the longer query matched
+# the shorter one too (each word is a prefix, the whole a substring), so
+# search(query, within=last results) only re-checks those rows.
+
+class TextIndex:
+    def __init__(self, weights):
+        # weights: {field name: weight}, in display order
+        self.fields = list(weights)
+        self.weights = weights
+        self.pending = None
+        self.clear()
+
+    def clear(self):
+        self.docs = {}
+        self.postings = {}
+        self.vocab = []
+        self.grams = {}
+        self.short = set()  # keys with a 1-2 character field (no trigrams)
+        self.seq = {}  # key -> position, so results come back in table order
+        self.next_seq = 0
+
+    # ----- index maintenance -----
+    def reset(self, rows):
+        self.clear()
+        self.pending = rows
+
+    def build(self):
+        rows, self.pending = self.pending, None
+        for key, row in rows.items():
+            self.add(key, row, keep_sorted=False)
+        self.vocab = sorted(self.postings)
+
+    def change(self, key, old, new):
+        if self.pending is not None:
+            return
+        pos = self.seq.get(key)
+        if old is not None:
+            self.remove(key)
+        if new is not None:
+            self.add(key, new)
+            if pos is not None:
+                self.seq[key] = pos
+
+    def add(self, key, row, keep_sorted=True):
+        folded = tuple(fold(row.get(f, "")) for f in self.fields)
+        self.docs[key] = folded
+        self.seq[key] = self.next_seq
+        self.next_seq += 1
+        for field, text in zip(self.fields, folded):
+            w = self.weights[field]
+            for tok in TOKEN_RE.findall(text):
+                posting = self.postings.get(tok)
+                if posting is None:
+                    posting = self.postings[tok] = {}
+                    if keep_sorted:
+                        insort(self.vocab, tok)
+                if posting.get(key, 0) < w:
+                    posting[key] = w
+            for g in trigrams(text):
+                self.grams.setdefault(g, set()).add(key)
+            if 0 < len(text) < 3:
+                self.short.add(key)
+
+    def remove(self, key):
+        folded = self.docs.pop(key, None)
+        if folded is None:
+            return
+        del self.seq[key]
+        self.short.discard(key)
+        for text in folded:
+            for tok in TOKEN_RE.findall(text):
+                posting = self.postings.get(tok)
+                if posting is None or posting.pop(key, None) is None or posting:
+                    continue
+                del self.postings[tok]
+                i = bisect_left(self.vocab, tok)
+                if i < len(self.vocab) and self.vocab[i] == tok:
+                    del self.vocab[i]
+            for g in trigrams(text):
+                keys = self.grams.get(g)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.grams[g]
+
+    # ----- queries -----
+    def prefixed(self, term):
+        i = bisect_left(self.vocab, term)
+        while i < len(self.vocab) and self.vocab[i].startswith(term):
+            yield self.vocab[i]
+            i += 1
+
+    def ranked(self, terms):
+        """AND of all terms, each matched as a token prefix; best first."""
+        if not terms:
+            return []  # e.g. "-": only the substring match applies
+        scores = None
+        for term in terms:
+            term_scores = {}
+            for tok in self.prefixed(term):
+                bonus = 2 if tok == term else 1
+                for key, w in self.postings[tok].items():
+                    if term_scores.get(key, 0) < w * bonus:
+                        term_scores[key] = w * bonus
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {k: scores[k] + s for k, s in term_scores.items() if k in scores}
+            if not scores:
+                return []
+        out = sorted(scores, key=self.seq.__getitem__)
+        out.sort(key=scores.__getitem__, reverse=True)
+        return out
+
+    def substring(self, q):
+        """Keys whose folded fields contain q, in table order."""
+        if len(q) < 3:
+            candidates = set(self.short)
+            for g, keys in self.grams.items():
+                if q in g:
+                    candidates |= keys
+        else:
+            sets = []
+            for g in trigrams(q):
+                keys = self.grams.get(g)
+                if not keys:
+                    return []
+                sets.append(keys)
+            sets.sort(key=len)
+            candidates = set.intersection(*sets)
+        docs = self.docs
+        return [k for k in sorted(candidates, key=self.seq.__getitem__)
+                if any(q in text for text in docs[k])]
+
+    def score(self, folded, terms):
+        """What ranked() gives a document for terms (0: not every term matches)."""
+        for term in terms:
+            if not any(term in text for text in folded):
+                return 0  # quick reject: a token prefix is a substring too
+        tokens = [(self.weights[f], TOKEN_RE.findall(text)) for f, text in zip(self.fields, folded)]
+        total = 0
+        for term in terms:
+            best = 0
+            for w, toks in tokens:
+                for tok in toks:
+                    if tok.startswith(term):
+                        s = w * 2 if tok == term else w
+                        if s > best:
+                            best = s
+            if not best:
+                return 0
+            total += best
+        return total
+
+    def refine(self, keys, q):
+        """search() of folded query q, looking only at keys."""
+        terms = TOKEN_RE.findall(q)
+        scores, rest = {}, []
+        for key in keys:
+            folded = self.docs.get(key)
+            if folded is None:
+                continue  # deleted since
+            s = self.score(folded, terms) if terms else 0
+            if s:
+                scores[key] = s
+            elif any(q in text for text in folded):
+                rest.append(key)
+        out = sorted(scores, key=self.seq.__getitem__)
+        out.sort(key=scores.__getitem__, reverse=True)
+        rest.sort(key=self.seq.__getitem__)
+        return out + rest
+
+    def search(self, query, within=None):
+        """Keys matching query, best first; within: keys to restrict it to (results
+        of a query this one extends)."""
+        if self.pending is not None:
+            self.build()
+        q = fold(query).strip()
+        if not q:
+            return list(self.docs) if within is None else [k for k in within if k in self.docs]
+        if within is not None:
+            return self.refine(within, q)
+        out = self.ranked(TOKEN_RE.findall(q))
+        seen = set(out)
+        for key in self.substring(q):
+            if key not in seen:
+                out.append(key)
+        return out
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
@@ -0,0 +1,446 @@
+# server.py
+import argparse
+import asyncio
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import MAXYEAR
+from itertools import islice
+from urllib.parse import urlsplit, parse_qsl
+import cache
+import metrics
+
+from books import (
+    books_table, load_books, add_book, update_book, delete_book, find_book, search_books
+)
+from students import (
+    students_table, load_students, add_student, update_student, delete_student, find_student,
+    search_students
+)
+from borrow import (
+    borrow_table, borrow_book, return_book, iter_borrowed, list_borrowed_details,
+    is_book_currently_borrowed, books_borrowed_by_student, currently_borrowed_ids,
+    available_books, items_out, top_borrowed_books, students_with_open_loans,
+    overdue_loans, loans_due_within, fines_by_student
+)
+from due import to_ordinal
+
+# ---------- HTTP/JSON API ----------
+# A headless front end for kiosks and for desks that would rather not
+# load the CSVs themselves: one process holds the tables in memory and
+# every client shares them.
+#
+#   GET    /books?q=&offset=&limit=        GET/PATCH/DELETE /books/<id>
+#   POST   /books
+#   GET    /students?q=&offset=&limit=     GET/PATCH/DELETE /students/<id>
+#   POST   /students
+#   GET    /borrows?status=open|returned&student_id=&book_id=&start=&end=
+#   POST   /borrows   {"student_id", "book_id"}
+#   POST   /returns   {"borrow_id"} or {"student_id", "book_id"}
+#   GET    /search?q=
+#   GET    /reports/summary | available | borrowed | top?n= | open-loans
+#   GET    /reports/overdue?as_of= | due-soon?days=&start= | fines?as_of=
+#   GET    /analytics/<table>?year=&start=&end=   (summary, by-month, by-year,
+#          by-author, by-semester, never-borrowed; see analytics.py)
+#   GET    /metrics[?format=json]       (Prometheus text by default; never cached)
+#
+# Lists are paged ({"total", "offset", "limit", "items"}). Every GET
+# carries an ETag built from the versions of the tables it reads, so a
+# client that sends If-None-Match gets a 304 without the server doing any
+# work, and recent responses are served from memory until a table
+# changes. Reads run on a small thread pool; all writes go through a
+# single writer thread, one at a time (the tables' own transactions still
+# guard against other processes).
+#
+#   python server.py --port 8080
+
+HOST = "127.0.0.1"
+PORT = 8080
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 1000
+MAX_BODY = 1024 * 1024
+CACHE_SIZE = 512
+JSON_TYPE = "application/json; charset=utf-8"
+PROMETHEUS_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+STATUS_TEXT = {
+    200: "OK", 201: "Created", 304: "Not Modified", 400: "Bad Request",
+    404: "Not Found", 405: "Method Not Allowed", 409: "Conflict",
+    413: "Payload Too Large", 500: "Internal Server Error",
+}
+
+# "date" stands in for a table in ETags of reports that default to today
+TABLES = {"books": books_table, "students": students_table, "borrow": borrow_table,
+          "date": cache.calendar}
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+# ---------- helpers ----------
+def int_param(params, name, default, high=None):
+    try:
+        value = max(0, int(params.get(name, default)))
+    except ValueError:
+        raise HttpError(400, f"{name} must be an integer")
+    if high is not None and value > high:
+        raise HttpError(400, f"{name} must be at most {high}")
+    return value
+
+def date_param(params, name):
+    value = params.get(name) or None
+    if value is not None and to_ordinal(value) is None:
+        raise HttpError(400, f"{name} must be a date (YYYY-MM-DD)")
+    return value
+
+def page(rows, params):
+    offset = int_param(params, "offset", 0)
+    limit = min(MAX_LIMIT, int_param(params, "limit", DEFAULT_LIMIT))
+    return {"total": len(rows), "offset": offset, "limit": limit,
+            "items": [dict(r) for r in rows[offset:offset + limit]]}
+
+def page_stream(rows, params, join=list):
+    """page() for a row stream: every row is counted, but only the page is
+    kept and passed through join (e.g. list_borrowed_details)."""
+    offset = int_param(params, "offset", 0)
+    limit = min(MAX_LIMIT, int_param(params, "limit", DEFAULT_LIMIT))
+    rows = iter(rows)
+    skipped = sum(1 for _ in islice(rows, offset))
+    items = list(islice(rows, limit))
+    total = skipped + len(items) + sum(1 for _ in rows)
+    return {"total": total, "offset": offset, "limit": limit, "items": [dict(r) for r in join(items)]}
+
+def require(body, *fields):
+    missing = [f for f in fields if not str(body.get(f) or "").strip()]
+    if missing:
+        raise HttpError(400, "missing " + ", ".join(missing))
+
+def text(body, field):
+    return str(body[field]).strip() if body.get(field) is not None else None
+
+# ---------- read handlers (params, id) -> JSON-able ----------
+def get_books(params, _):
+    q = params.get("q", "").strip()
+    rows = search_books(q) if q else load_books()
+    out = currently_borrowed_ids()
+    result = page(rows, params)
+    for b in result["items"]:
+        b["status"] = "Borrowed" if b["book_id"] in out else "Available"
+    return result
+
+def get_book(params, bid):
+    b = find_book(bid)
+    if not b:
+        raise HttpError(404, "Book not found.")
+    b = dict(b)
+    b["status"] = "Borrowed" if is_book_currently_borrowed(bid) else "Available"
+    return b
+
+def get_students(params, _):
+    q = params.get("q", "").strip()
+    return page(search_students(q) if q else load_students(), params)
+
+def get_student(params, sid):
+    s = find_student(sid)
+    if not s:
+        raise HttpError(404, "Student not found.")
+    return dict(s)
+
+def get_borrows(params, _):
+    status = params.get("status")
+    if status not in (None, "open", "returned"):
+        raise HttpError(400, "status must be open or returned")
+    rows = iter_borrowed(status=status, start=date_param(params, "start"), end=date_param(params, "end"),
+                         student_id=params.get("student_id"), book_id=params.get("book_id"))
+    return page_stream(rows, params, list_borrowed_details)
+
+def get_search(params, _):
+    q = params.get("q", "").strip()
+    if not q:
+        raise HttpError(400, "q is required")
+    limit = min(MAX_LIMIT, int_param(params, "limit", DEFAULT_LIMIT))
+    return {"books": [dict(b) for b in search_books(q)[:limit]],
+            "students": [dict(s) for s in search_students(q)[:limit]]}
+
+def report_summary(params, _):
+    return {"books": len(books_table.all()), "students": len(students_table.all()),
+            "items_out": items_out()}
+
+def report_available(params, _):
+    return page(available_books(), params)
+
+def report_borrowed(params, _):
+    return page_stream(iter_borrowed(status="open"), params, list_borrowed_details)
+
+def report_top(params, _):
+    n = min(MAX_LIMIT, int_param(params, "n", 10))
+    return [{"book_id": bid, "title": b.get("title", "") if b else "", "loans": count}
+            for b, bid, count in top_borrowed_books(n)]
+
+def report_open_loans(params, _):
+    return [{"student_id": sid, "name": s.get("name", "") if s else "", "open_loans": count}
+            for s, sid, count in students_with_open_loans()]
+
+def report_overdue(params, _):
+    return page(overdue_loans(date_param(params, "as_of")), params)
+
+def report_due_soon(params, _):
+    days = min(3660, int_param(params, "days", 7))
+    return page(loans_due_within(days, date_param(params, "start")), params)
+
+def report_fines(params, _):
+    return page([{"student_id": sid, "name": s.get("name", "") if s else "", "fine": total, "loans": n}
+                 for s, sid, total, n in fines_by_student(date_param(params, "as_of"))], params)
+
+def get_analytics(params, table):
+    import analytics  # NumPy, when installed, is only loaded for this
+    if table not in analytics.TABLES:
+        raise HttpError(404, "Unknown analytics table")
+    year = int_param(params, "year", 0, high=MAXYEAR) or None
+    result = analytics.analyze(year, date_param(params, "start"), date_param(params, "end"))
+    return page(result[table], params)
+
+# ---------- write handlers (body, id) -> (status, JSON-able) ----------
+def post_book(body, _):
+    require(body, "title")
+    bid = add_book(text(body, "title"), text(body, "author") or "", text(body, "year") or "",
+                   text(body, "isbn") or "")
+    return 201, {"book_id": bid}
+
+def patch_book(body, bid):
+    if not update_book(bid, text(body, "title"), text(body, "author"), text(body, "year"),
+                       text(body, "isbn")):
+        raise HttpError(404, "Book not found.")
+    return 200, dict(find_book(bid))
+
+def remove_book(body, bid):
+    if is_book_currently_borrowed(bid):
+        raise HttpError(409, "Book is currently borrowed.")
+    if not delete_book(bid):
+        raise HttpError(404, "Book not found.")
+    return 200, {"deleted": bid}
+
+def post_student(body, _):
+    require(body, "name")
+    sid = add_student(text(body, "name"), text(body, "semester") or "", text(body, "phone") or "")
+    return 201, {"student_id": sid}
+
+def patch_student(body, sid):
+    if not update_student(sid, text(body, "name"), text(body, "semester"), text(body, "phone")):
+        raise HttpError(404, "Student not found.")
+    return 200, dict(find_student(sid))
+
+def remove_student(body, sid):
+    if any(not r.get("return_date") for r in books_borrowed_by_student(sid)):
+        raise HttpError(409, "Student has active borrows.")
+    if not delete_student(sid):
+        raise HttpError(404, "Student not found.")
+    return 200, {"deleted": sid}
+
+def post_borrow(body, _):
+    require(body, "student_id", "book_id")
+    ok, msg = borrow_book(text(body, "student_id"), text(body, "book_id"))
+    if not ok:
+        raise HttpError(409, msg)
+    return 201, {"message": msg}
+
+def post_return(body, _):
+    if not body.get("borrow_id"):
+        require(body, "student_id", "book_id")
+    ok, msg = return_book(text(body, "borrow_id"), text(body, "student_id"), text(body, "book_id"))
+    if not ok:
+        raise HttpError(409, msg)
+    return 200, {"message": msg}
+
+# (method, path pattern, handler, tables the response depends on)
+ROUTES = [
+    ("GET", r"/books", get_books, ("books", "borrow")),
+    ("POST", r"/books", post_book, ()),
+    ("GET", r"/books/([^/]+)", get_book, ("books", "borrow")),
+    ("PATCH", r"/books/([^/]+)", patch_book, ()),
+    ("DELETE", r"/books/([^/]+)", remove_book, ()),
+    ("GET", r"/students", get_students, ("students",)),
+    ("POST", r"/students", post_student, ()),
+    ("GET", r"/students/([^/]+)", get_student, ("students",)),
+    ("PATCH", r"/students/([^/]+)", patch_student, ()),
+    ("DELETE", r"/students/([^/]+)", remove_student, ()),
+    ("GET", r"/borrows", get_borrows, ("borrow", "books", "students")),
+    ("POST", r"/borrows", post_borrow, ()),
+    ("POST", r"/returns", post_return, ()),
+    ("GET", r"/search", get_search, ("books", "students")),
+    ("GET", r"/reports/summary", report_summary, ("books", "students", "borrow")),
+    ("GET", r"/reports/available", report_available, ("books", "borrow")),
+    ("GET", r"/reports/borrowed", report_borrowed, ("borrow", "books", "students")),
+    ("GET", r"/reports/top", report_top, ("borrow", "books")),
+    ("GET", r"/reports/open-loans", report_open_loans, ("borrow", "students")),
+    ("GET", r"/reports/overdue", report_overdue, ("borrow", "students", "date")),
+    ("GET", r"/reports/due-soon", report_due_soon, ("borrow", "students", "date")),
+    ("GET", r"/reports/fines", report_fines, ("borrow", "students", "date")),
+    ("GET", r"/analytics/([^/]+)", get_analytics, ("borrow", "books", "students")),
+]
+ROUTES = [(m, re.compile(p + r"/?"), h, t) for m, p, h, t in ROUTES]
+
+def route(method, path):
+    allowed = False
+    for m, pattern, handler, tables in ROUTES:
+        match = pattern.fullmatch(path)
+        if match:
+            if m == method:
+                return handler, tables, (match.group(1) if match.groups() else None)
+            allowed = True
+    raise HttpError(405 if allowed else 404, "Method not allowed" if allowed else "Not found")
+
+# ---------- server ----------
+class LibraryServer:
+    def __init__(self, readers=4):
+        self.readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="library-read")
+        # a single writer thread: writes are applied strictly one after another
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="library-write")
+        self.cache = OrderedDict()  # etag -> encoded body
+        self.cache_lock = threading.Lock()
+
+    def etag(self, path, query, tables):
+        versions = [TABLES[t].version() for t in tables]
+        digest = hashlib.blake2b(repr((path, query, versions)).encode(), digest_size=12)
+        return '"' + digest.hexdigest() + '"'
+
+    def read(self, path, query, handler, tables, ident, if_none_match):
+        """Runs on a reader thread: (status, body bytes, etag)."""
+        tag = self.etag(path, query, tables)
+        if if_none_match and tag in [t.strip() for t in if_none_match.split(",")]:
+            return 304, b"", tag
+        with self.cache_lock:
+            body = self.cache.get(tag)
+            if body is not None:
+                self.cache.move_to_end(tag)
+                return 200, body, tag
+        body = json.dumps(handler(dict(parse_qsl(query)), ident), ensure_ascii=False).encode("utf-8")
+        with self.cache_lock:
+            self.cache[tag] = body
+            while len(self.cache) > CACHE_SIZE:
+                self.cache.popitem(last=False)
+        return 200, body, tag
+
+    def write(self, handler, ident, body):
+        status, result = handler(body, ident)
+        return status, json.dumps(result, ensure_ascii=False).encode("utf-8"), None
+
+    async def dispatch(self, method, target, headers, body):
+        url = urlsplit(target)
+        handler, tables, ident = route(method, url.path)
+        loop = asyncio.get_running_loop()
+        with metrics.timed("http." + handler.__name__):
+            if method == "GET":
+                return await loop.run_in_executor(self.readers, self.read, url.path, url.query,
+                                                  handler, tables, ident, headers.get("if-none-match"))
+            try:
+                data = json.loads(body or b"{}")
+            except ValueError:
+                raise HttpError(400, "body must be JSON")
+            if not isinstance(data, dict):
+                raise HttpError(400, "body must be a JSON object")
+            return await loop.run_in_executor(self.writer, self.write, handler, ident, data)
+
+    def metrics_response(self, target):
+        """(status, body, content type) for GET /metrics."""
+        if dict(parse_qsl(urlsplit(target).query)).get("format") == "json":
+            body = dict(metrics.snapshot(), query_cache=cache.stats())
+            return 200, json.dumps(body).encode("utf-8"), JSON_TYPE
+        return 200, (metrics.to_prometheus() + cache.to_prometheus()).encode("utf-8"), PROMETHEUS_TYPE
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    return
+                lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ", 2)
+                except ValueError:
+                    await self.respond(writer, 400, b'{"error": "bad request line"}', close=True)
+                    return
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        k, v = line.split(":", 1)
+                        headers[k.strip().lower()] = v.strip()
+                conn = headers.get("connection", "").lower()
+                close = conn == "close" or (version == "HTTP/1.0" and conn != "keep-alive")
+                try:
+                    length = int(headers.get("content-length") or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self.respond(writer, 400, b'{"error": "bad content-length"}', close=True)
+                    return
+                if length > MAX_BODY:
+                    await self.respond(writer, 413, b'{"error": "body too large"}', close=True)
+                    return
+                body = await reader.readexactly(length) if length else b""
+                ctype = JSON_TYPE
+                try:
+                    if method == "GET" and urlsplit(target).path.rstrip("/") == "/metrics":
+                        (status, payload, ctype), tag = self.metrics_response(target), None
+                    else:
+                        status, payload, tag = await self.dispatch(method, target, headers, body)
+                except HttpError as e:
+                    status, payload, tag = e.status, json.dumps({"error": str(e)}).encode(), None
+                except Exception as e:
+                    status, payload, tag = 500, json.dumps({"error": str(e)}).encode(), None
+                await self.respond(writer, status, payload, tag, close, ctype)
+                if close:
+                    return
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, tag=None, close=False, ctype=None):
+        head = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}"]
+        if status != 304:
+            head.append(f"Content-Type: {ctype or JSON_TYPE}")
+        head.append(f"Content-Length: {len(payload)}")
+        if tag:
+            head.append(f"ETag: {tag}")
+            head.append("Cache-Control: no-cache")
+        if close:
+            head.append("Connection: close")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + payload)
+        await writer.drain()
+
+    async def serve(self, host=HOST, port=PORT):
+        server = await asyncio.start_server(self.handle, host, port)
+        # load everything up front so the first requests don't pay for it
+        loop = asyncio.get_running_loop()
+        for t in TABLES.values():
+            await loop.run_in_executor(self.readers, t.version)
+        print(f"Library API on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+    def shutdown(self):
+        self.readers.shutdown(wait=False, cancel_futures=True)
+        self.writer.shutdown(wait=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Library HTTP/JSON API")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args(argv)
+    app = LibraryServer()
+    metrics.start_exporter()  # only if LIBRARY_METRICS_FILE is set
+    try:
+        asyncio.run(app.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        app.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+# sqlite_store.py
+import os
+import sqlite3
+import threading
+from collections.abc import Mapping
+from contextlib import contextmanager
+import config
+import metrics
+from store import id_number
+
+# ----- SQLite backend -----
+# Same interface as store.Table, but rows live in data/library.db instead
+# of memory: every read is an indexed query and every write a single
+# statement, so borrow/return cost the same at any history size. The
+# database runs in WAL mode so several desks can read while one writes.
+#
+# Plain secondary indexes (add_index) become real SQLite indexes
+# (partial ones for where=(field, value)). Objects registered with
+# attach_index (the full-text index) are still fed from the table: they
+# get a lazy view of all rows and every change made through this process;
+# commits from other connections are spotted with PRAGMA data_version and
+# make them start over.
+#
+# transaction() maps to BEGIN IMMEDIATE, which takes SQLite's write lock
+# up front, so check-then-write sequences are safe across desks the same
+# way as with the CSV backend.
+#
+# config.SYNC maps onto PRAGMA synchronous: "full" fsyncs the WAL on every
+# commit, "group" (NORMAL) leaves commits to be synced together at the
+# next checkpoint (a crash loses at most the last few commits, and never
+# corrupts the database), "off" never syncs.
+#
+# ID sequences live in a _sequences table. A table's counter is seeded
+# from its highest ID on first use and raised by every write that brings
+# in a higher ID, so allocation is a single-row update from then on.
+
+DB_NAME = "library.db"
+SYNCHRONOUS = {"full": "FULL", "group": "NORMAL", "off": "OFF"}
+
+def db_path(csv_path):
+    return os.path.join(os.path.dirname(csv_path), DB_NAME)
+
+def table_name(csv_path):
+    return os.path.splitext(os.path.basename(csv_path))[0]
+
+def quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+class SqliteTable:
+    def __init__(self, path, fieldnames, key, record=None):
+        self.path = path
+        self.record = record
+        self.db_path = db_path(path)
+        self.name = table_name(path)
+        self.fieldnames = list(fieldnames)
+        self.key = key
+        self.lock = threading.RLock()
+        self.conn = None
+        self.data_version = None
+        self.txn_depth = 0
+        self.commits = 0
+        self.sql_indexes = {}
+        self.indexes = {}
+        self.cols = ", ".join(quote(f) for f in self.fieldnames)
+        self.select = f"SELECT {self.cols} FROM {quote(self.name)}"
+
+    # ----- connection / schema -----
+    def ensure_file(self):
+        with self.lock:
+            if self.conn is not None:
+                return
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            # one connection per table, shared by the GUI worker threads under self.lock
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={SYNCHRONOUS.get(config.SYNC, 'FULL')}")
+            cols = ", ".join(
+                quote(f) + (" TEXT PRIMARY KEY" if f == self.key else " TEXT NOT NULL DEFAULT ''")
+                for f in self.fieldnames
+            )
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {quote(self.name)} ({cols})")
+            conn.execute("CREATE TABLE IF NOT EXISTS _sequences (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            self.conn = conn
+            for name, (field, where) in self.sql_indexes.items():
+                self.create_sql_index(name, field, where)
+
+    def create_sql_index(self, name, field, where):
+        sql = (f"CREATE INDEX IF NOT EXISTS {quote(self.name + '_' + name)} "
+               f"ON {quote(self.name)} ({quote(field)})")
+        if where is not None:
+            # partial index; index definitions can't take bound parameters
+            sql += f" WHERE {quote(where[0])} = '" + where[1].replace("'", "''") + "'"
+        self.conn.execute(sql)
+
+    def refresh(self):
+        """Restart attached indexes if another connection committed changes."""
+        with self.lock:
+            self.ensure_file()
+            version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+            if version != self.data_version:
+                self.data_version = version
+                for index in self.indexes.values():
+                    index.reset(RowsView(self))
+
+    @contextmanager
+    def transaction(self):
+        """One SQLite write transaction (BEGIN IMMEDIATE). Nests."""
+        with self.lock:
+            self.ensure_file()
+            if self.txn_depth:
+                self.txn_depth += 1
+                try:
+                    yield self
+                finally:
+                    self.txn_depth -= 1
+                return
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.txn_depth = 1
+            try:
+                self.refresh()
+                yield self
+            except BaseException:
+                self.txn_depth = 0
+                self.conn.execute("ROLLBACK")
+                # attached indexes may have seen changes that were just undone
+                for index in self.indexes.values():
+                    index.reset(RowsView(self))
+                raise
+            self.txn_depth = 0
+            self.conn.execute("COMMIT")
+            self.commits += 1
+
+    def as_row(self, values):
+        if self.record is not None:
+            return self.record.from_values(values)
+        return dict(zip(self.fieldnames, values))
+
+    def query(self, sql, params=()):
+        with self.lock, metrics.timed("sqlite.query", self.name) as span:
+            self.refresh()
+            rows = [self.as_row(v) for v in self.conn.execute(sql, params)]
+            span.rows = len(rows)
+            return rows
+
+    # ----- reads -----
+    def all(self):
+        return self.query(self.select + " ORDER BY rowid")
+
+    def get(self, key):
+        rows = self.query(self.select + f" WHERE {quote(self.key)} = ?", (str(key),))
+        return rows[0] if rows else None
+
+    # every read is already a point query here: nothing to load first
+    def use_offsets(self, *fields):
+        pass
+
+    def fetch(self, key):
+        return self.get(key)
+
+    def fetch_by(self, field, value):
+        return self.query(self.select + f" WHERE {quote(field)} = ? ORDER BY rowid", (str(value),))
+
+    def scan(self, filters=(), predicate=None):
+        """
+        Yield rows matching every (field, op, value) in filters (evaluated
+        by SQLite) and then predicate(row), streamed from a separate
+        read connection so a long scan doesn't hold up writers.
+        """
+        self.ensure_file()
+        sql, params = self.select, []
+        if filters:
+            sql += " WHERE " + " AND ".join(f"{quote(f)} {op} ?" for f, op, _ in filters)
+            params = [v for _, _, v in filters]
+        conn = sqlite3.connect(self.db_path)
+        try:
+            # timed from the first row to the last, including the caller's work in between
+            with metrics.timed("sqlite.scan", self.name) as span:
+                cur = conn.execute(sql + " ORDER BY rowid", params)
+                while True:
+                    batch = cur.fetchmany(1000)
+                    if not batch:
+                        break
+                    span.rows += len(batch)
+                    for values in batch:
+                        row = self.as_row(values)
+                        if predicate is None or predicate(row):
+                            yield row
+        finally:
+            conn.close()
+
+    def version(self):
+        """Token that changes whenever the table's contents may have (for ETags, caches)."""
+        with self.lock:
+            self.refresh()
+            # data_version only moves for other connections' commits
+            return (self.data_version, self.commits)
+
+    def mapping(self):
+        """Read-only key -> row view, for joins that look up many keys."""
+        self.refresh()
+        return RowsView(self)
+
+    # ----- writes -----
+    def notify(self, key, old, new):
+        for index in self.indexes.values():
+            index.change(key, old, new)
+
+    def write_rows(self, rows):
+        rows = list(rows)
+        placeholders = ", ".join("?" for _ in self.fieldnames)
+        with metrics.timed("sqlite.write", self.name) as span:
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO {quote(self.name)} ({self.cols}) VALUES ({placeholders})",
+                ([str(r.get(f) if r.get(f) is not None else "") for f in self.fieldnames] for r in rows))
+            span.rows = len(rows)
+        top = max((id_number(r.get(self.key)) for r in rows), default=0)
+        self.conn.execute("UPDATE _sequences SET value = MAX(value, ?) WHERE name = ?", (top, self.name))
+
+    def insert(self, row):
+        self.insert_many([row])
+
+    def insert_many(self, rows):
+        """Add many rows in one transaction."""
+        with self.transaction():
+            olds = [self.get(r[self.key]) if self.indexes else None for r in rows]
+            self.write_rows(rows)
+            for r, old in zip(rows, olds):
+                self.notify(str(r[self.key]), old, r)
+
+    def update(self, key, changes):
+        return bool(self.update_many({key: changes}))
+
+    def update_many(self, changes_by_key):
+        """Apply {key: changes} in one transaction."""
+        with self.transaction():
+            done = []
+            for key, changes in changes_by_key.items():
+                old = self.get(key)
+                if old is None:
+                    continue
+                fields = [f for f in changes if f in self.fieldnames]
+                if fields:
+                    sets = ", ".join(f"{quote(f)} = ?" for f in fields)
+                    self.conn.execute(
+                        f"UPDATE {quote(self.name)} SET {sets} WHERE {quote(self.key)} = ?",
+                        [str(changes[f]) for f in fields] + [str(key)])
+                new = dict(old)
+                new.update(changes)
+                done.append((str(key), old, new))
+            for key, old, new in done:
+                self.notify(key, old, new)
+            return [key for key, _, _ in done]
+
+    def patch(self, key, changes, expect=None):
+        """Set fields on one row if its current values include expect; True if changed."""
+        with self.transaction():
+            row = self.get(key)
+            if row is None or any(row.get(f) != v for f, v in (expect or {}).items()):
+                return False
+            return bool(self.update_many({key: changes}))
+
+    def delete(self, key):
+        with self.transaction():
+            old = self.get(key)
+            if old is None:
+                return False
+            self.conn.execute(f"DELETE FROM {quote(self.name)} WHERE {quote(self.key)} = ?", (str(key),))
+            self.notify(str(key), old, None)
+            return True
+
+    def replace(self, rows):
+        """Swap in a whole new set of rows (used by save_* and the importer)."""
+        with self.transaction():
+            self.conn.execute(f"DELETE FROM {quote(self.name)}")
+            self.write_rows(rows)
+            for index in self.indexes.values():
+                index.reset(RowsView(self))
+
+    # ----- ID sequence -----
+    def next_ids(self, count=1):
+        """Reserve count new IDs (as strings) from the _sequences table."""
+        with self.transaction():
+            row = self.conn.execute("SELECT value FROM _sequences WHERE name = ?", (self.name,)).fetchone()
+            if row is None:
+                # first allocation: seed from the data (one scan, ever)
+                row = self.conn.execute(
+                    f"SELECT MAX(CAST({quote(self.key)} AS INTEGER)) FROM {quote(self.name)}").fetchone()
+            start = (row[0] or 0) + 1
+            self.conn.execute("INSERT OR REPLACE INTO _sequences (name, value) VALUES (?, ?)",
+                              (self.name, start + count - 1))
+            return [str(i) for i in range(start, start + count)]
+
+    # ----- secondary indexes -----
+    def add_index(self, name, field, where=None):
+        """SQLite index on field; where=(field, value) makes it partial."""
+        with self.lock:
+            self.sql_indexes[name] = (field, where)
+            if self.conn is not None:
+                self.create_sql_index(name, field, where)
+
+    def attach_index(self, name, index):
+        """Register any object with reset(rows) and change(key, old, new)."""
+        with self.lock:
+            index.reset(RowsView(self))
+            self.indexes[name] = index
+
+    def lookup(self, name, value):
+        field, where = self.sql_indexes[name]
+        sql = self.select + f" WHERE {quote(field)} = ?"
+        params = [str(value)]
+        if where is not None:
+            sql += f" AND {quote(where[0])} = ?"
+            params.append(where[1])
+        return self.query(sql + " ORDER BY rowid", params)
+
+    def search(self, name, query, within=None):
+        """Rows matching query in a TextIndex attached as name, best first;
+        within: only look at these rows (see TextIndex.search)."""
+        keys = None if within is None else [r[self.key] for r in within]
+        with self.lock:
+            self.refresh()
+            view = RowsView(self)
+            return [row for row in (view.get(k) for k in self.indexes[name].search(query, keys)) if row]
+
+
+class RowsView(Mapping):
+    """key -> row over a SqliteTable, read through on demand."""
+    def __init__(self, table):
+        self.table = table
+
+    def __getitem__(self, key):
+        row = self.table.get(key)
+        if row is None:
+            raise KeyError(key)
+        return row
+
+    def __iter__(self):
+        t = self.table
+        with t.lock:
+            keys = [k for (k,) in t.conn.execute(f"SELECT {quote(t.key)} FROM {quote(t.name)} ORDER BY rowid")]
+        return iter(keys)
+
+    def __len__(self):
+        t = self.table
+        with t.lock:
+            return t.conn.execute(f"SELECT COUNT(*) FROM {quote(t.name)}").fetchone()[0]
+
+    def items(self):
+        return [(r[self.table.key], r) for r in self.table.all()]
+
+
+# ----- one-shot import from the CSV files -----
+def import_csv(table):
+    """Load table.path (the old CSV, plus any journal) into the database."""
+    from store import Table
+    source = Table(table.path, table.fieldnames, table.key, table.record)
+    if not os.path.exists(source.path):
+        return 0
+    rows = source.all()
+    table.replace(rows)
+    return len(rows)
+
+if __name__ == "__main__":
+    # python sqlite_store.py -> copy data/books.csv, students.csv and borrow.csv into data/library.db
+    # config has already read the environment by now, so set both
+    os.environ["LIBRARY_BACKEND"] = config.BACKEND = "sqlite"
+    import books, students, borrow
+    for t in (books.books_table, students.students_table, borrow.borrow_table):
+        print(f"{t.name}: {import_csv(t)} rows -> {t.db_path}")
@@ -0,0 +1,950 @@
+# store.py
+import csv
+import gc
+import json
+import marshal
+import operator
+import os
+import sys
+import threading
+from collections.abc import Mapping
+from contextlib import contextmanager
+import config
+import metrics
+from locks import FileLock, read_version
+from offsets import OffsetIndex
+
+# ----- in-memory tables -----
+# Each CSV is parsed once and kept in memory, keyed by its ID column.
+# Changes are not written back by rewriting the CSV: they are appended to
+# a small journal next to it ("books.csv.journal") which is replayed on
+# load. Once the journal grows past JOURNAL_COMPACT_BYTES it is folded
+# back into the CSV on a background thread.
+#
+# Several desks may share one data/ folder. Every write runs in a
+# transaction(): an exclusive lock on "books.csv.lock" (see locks.py), a
+# catch-up with whatever other desks wrote, the change itself, and a bump
+# of the version number kept in the lock file. Check-then-write sequences
+# (is the book free? then lend it) go inside one transaction. The lock is
+# only held for a journal append, never for a full-file rewrite:
+# compaction writes its snapshot outside the lock.
+#
+# The (mtime, size) of both files plus the lock file's version and epoch
+# are remembered after each read/write. When they change, memory is
+# brought up to date by replaying just the new journal lines, or by a
+# full reload if the files were rewritten (compaction, save_*, a
+# spreadsheet edit).
+#
+# Files are never rewritten in place. Snapshots go to a temp file that is
+# fsynced and renamed over the old one, and save_* (replace) stages the
+# new CSV as "books.csv.new" and drops a "books.csv.new.done" marker
+# before swapping it in, so a crash at any point leaves either the old
+# or the new data, never a truncated catalog. Journal appends are fsynced
+# as config.SYNC says; see Syncer.
+#
+# With a record class (see records.py) rows are stored as compact typed
+# records and keyed by their typed ID; without one they are plain dicts
+# keyed by the ID string.
+#
+# New IDs come from a sequence counter persisted next to the CSV
+# ("books.csv.seq", the last ID handed out). The next ID is one past the
+# larger of that counter and the highest ID in the data, so a lost or
+# stale counter file (crash, hand-edited CSV) can never hand out an ID
+# that is already in use, and deleted IDs are not reused.
+#
+# Parsing a big CSV is most of a cold start, so once a record table of
+# SNAPSHOT_MIN_ROWS or more has been parsed its rows are also saved column
+# by column as "books.csv.snap", tagged with the CSV's (mtime, size). The
+# next load reads that instead while the CSV is unchanged, then replays
+# the journal as usual; compaction writes a fresh one alongside the new
+# CSV. marshal rather than pickle: a file in a shared folder can't run
+# code when loaded, and interned strings and shared ints stay shared. A
+# snapshot from another format, field list or Python version, or a torn
+# one, is ignored and replaced.
+#
+# A process that only needs a row or two (cli.py returning one loan) need
+# not load the table at all. With use_offsets(), fetch() / fetch_by()
+# read just the matching lines through an offset index (see offsets.py)
+# plus the journal, and patch() appends its change to the journal under
+# the lock, so both cost the same on a huge history as on a small one.
+# Changes are never written into the CSV itself: setting a return_date
+# makes the line longer, so it goes to the journal like every other write.
+
+JOURNAL_COMPACT_BYTES = 1024 * 1024
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_MIN_ROWS = 10000
+
+def open_table(path, fieldnames, key, record=None):
+    """Table for the CSV at path, stored with the configured backend."""
+    if config.BACKEND == "sqlite":
+        from sqlite_store import SqliteTable
+        return SqliteTable(path, fieldnames, key, record)
+    return Table(path, fieldnames, key, record)
+
+def id_number(key):
+    """Numeric value of an ID (0 if it isn't a plain number)."""
+    if key.__class__ is int:
+        return key
+    try:
+        return int(key)
+    except (TypeError, ValueError):
+        return 0
+
+def as_text(value):
+    """An imported field (JSON may give numbers) as a stripped string."""
+    return str(value).strip() if value is not None else ""
+
+# ----- durable file writes -----
+def sync_file(f):
+    """Flush f all the way to disk (unless config.SYNC is "off")."""
+    f.flush()
+    if config.SYNC != "off":
+        os.fsync(f.fileno())
+
+def sync_dir(path):
+    """Make renames/removals in path's folder durable (POSIX only)."""
+    if config.SYNC == "off" or os.name == "nt":
+        return
+    fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def replace_file(tmp, path):
+    os.replace(tmp, path)
+    sync_dir(path)
+
+class Syncer:
+    """
+    fsyncs one append-only file on behalf of many writers (group commit).
+    With config.SYNC "full", commit() returns once the caller's appends are
+    on disk; writers that commit while an fsync is running are all covered
+    by the next one. With "group", commit() returns at once and a timer
+    fsyncs everything appended in the last GROUP_COMMIT_MS in one go.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.cond = threading.Condition()
+        self.written = 0
+        self.synced = 0
+        self.syncing = False
+        self.timer = None
+
+    def commit(self):
+        with self.cond:
+            self.written += 1
+            ticket = self.written
+            if config.SYNC == "off":
+                self.synced = ticket
+                return
+            if config.SYNC == "group":
+                if self.timer is None:
+                    self.timer = threading.Timer(config.GROUP_COMMIT_MS / 1000, self.flush)
+                    self.timer.start()
+                return
+        while True:
+            with self.cond:
+                while self.syncing and self.synced < ticket:
+                    self.cond.wait()
+                if self.synced >= ticket:
+                    return
+                self.syncing = True
+            self.flush()
+
+    def flush(self):
+        """fsync everything appended so far."""
+        with self.cond:
+            upto = self.written
+            self.timer = None
+            self.syncing = True
+        try:
+            with open(self.path, "ab") as f:
+                os.fsync(f.fileno())
+        except FileNotFoundError:
+            # compacted away; compaction synced its own files
+            pass
+        finally:
+            with self.cond:
+                self.synced = max(self.synced, upto)
+                self.syncing = False
+                self.cond.notify_all()
+
+@contextmanager
+def gc_paused():
+    """
+    No cyclic GC while a big table is built: every new row object would
+    otherwise count toward a collection that walks all the rows made so
+    far, which nearly doubles a 1M-row load. Rows hold no cycles.
+    """
+    was = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was:
+            gc.enable()
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+class Table:
+    def __init__(self, path, fieldnames, key, record=None):
+        self.path = path
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self.journal_path = path + ".journal"
+        self.seq_path = path + ".seq"
+        self.lock_path = path + ".lock"
+        self.staged_path = path + ".new"
+        self.staged_done_path = path + ".new.done"
+        self.snap_path = path + ".snap"
+        self.syncer = Syncer(self.journal_path)
+        self.fieldnames = list(fieldnames)
+        self.key = key
+        self.record = record
+        self.rows = {}
+        self.stamp = None
+        self.journal_offset = 0
+        self.lock = threading.RLock()
+        self.txn_depth = 0
+        self.dirty = False
+        self.rewritten = False
+        self.appended = False
+        self.compacting = None
+        self.indexes = {}
+        self.max_id = 0
+        self.offsets = None
+
+    # ----- file handling -----
+    def ensure_file(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if not os.path.exists(self.path):
+            with open(self.path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(self.fieldnames)
+
+    def file_stamp(self):
+        return (_stat(self.path), _stat(self.journal_path), read_version(self.lock_path))
+
+    # ----- row representation -----
+    def norm(self, key):
+        """The dict key used for an ID given as a string or int."""
+        if self.record is not None:
+            return self.record.encode_field(self.key, key)
+        return str(key)
+
+    def make(self, row):
+        """Stored form of a dict row."""
+        return self.record.from_row(row) if self.record is not None else row
+
+    def changed(self, row, fields):
+        if self.record is not None:
+            return row.replace(fields)
+        new = dict(row)
+        new.update(fields)
+        return new
+
+    def raw(self, row, field):
+        """Field value in the form indexes bucket on."""
+        if self.record is not None:
+            return getattr(row, field)
+        return row.get(field) or ""
+
+    def encode(self, field, value):
+        if self.record is not None:
+            return self.record.encode_field(field, value)
+        return str(value)
+
+    def read_csv(self, f):
+        if self.record is None:
+            for r in csv.DictReader(f):
+                yield r.get(self.key) or "", r
+            return
+        reader = csv.reader(f)
+        header = next(reader, [])
+        pos = [header.index(name) if name in header else None for name in self.fieldnames]
+        make = self.record.from_values
+        key = self.key
+        exact = header == self.fieldnames
+        for r in reader:
+            if not r:
+                continue
+            if not exact or len(r) != len(pos):
+                r = [r[p] if p is not None and p < len(r) else "" for p in pos]
+            rec = make(r)
+            yield getattr(rec, key), rec
+
+    def load(self):
+        with self.lock:
+            if not self.txn_depth and os.path.exists(self.staged_done_path):
+                # a save is being swapped in, or was cut short by a crash:
+                # wait for it (or finish it) under the lock; that reloads us
+                with self.transaction():
+                    return
+            self.ensure_file()
+            stamp = self.file_stamp()
+            with gc_paused():
+                rows = self.read_snapshot(stamp[0])
+            if rows is None:
+                with metrics.timed("store.load", self.name) as span, gc_paused():
+                    rows = {}
+                    with open(self.path, newline="", encoding="utf-8") as f:
+                        for key, r in self.read_csv(f):
+                            rows[key] = r
+                    span.rows, span.bytes_read = len(rows), stamp[0][1]
+                if len(rows) >= SNAPSHOT_MIN_ROWS:
+                    self.write_snapshot(rows.values(), stamp[0], self.snap_path)
+            entries, self.journal_offset = self.read_journal()
+            for entry in entries:
+                self.apply(rows, entry)
+            self.rows = rows
+            self.stamp = stamp
+            self.max_id = max(map(id_number, rows), default=0)
+            for index in self.indexes.values():
+                index.reset(rows)
+
+    # ----- binary snapshots -----
+    def snapshot_header(self, source):
+        return (SNAPSHOT_FORMAT, tuple(sys.version_info[:2]), self.record.__name__,
+                tuple(self.fieldnames), tuple(source))
+
+    def read_snapshot(self, source):
+        """Rows from the .snap file if it was taken from this exact CSV, else None."""
+        if self.record is None or source is None:
+            return None
+        with metrics.timed("store.load_snapshot", self.name) as span:
+            try:
+                with open(self.snap_path, "rb") as f:
+                    if marshal.load(f) != self.snapshot_header(source):
+                        return None
+                    # marshal.load() on a file reads it in small pieces; one read is far quicker
+                    data = f.read()
+                columns = marshal.loads(data)
+                span.bytes_read = len(data)
+            except (OSError, EOFError, ValueError, TypeError):
+                return None
+            make = self.record.from_encoded
+            keys = columns[self.record.__slots__.index(self.key)]
+            rows = dict(zip(keys, map(make, zip(*columns))))
+            span.rows = len(rows)
+        return rows
+
+    def write_snapshot(self, rows, source, path):
+        """Save rows (as parsed from the CSV whose stat is source) to path; best effort."""
+        if self.record is None:
+            return
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with metrics.timed("store.write_snapshot", self.name) as span:
+                fields = self.record.__slots__
+                columns = [list(c) for c in zip(*map(operator.attrgetter(*fields), rows))]
+                columns = columns or [[] for _ in fields]
+                with open(tmp, "wb") as f:
+                    marshal.dump(self.snapshot_header(source), f)
+                    marshal.dump(columns, f)
+                    span.rows, span.bytes_written = len(columns[0]), f.tell()
+            os.replace(tmp, path)
+        except (OSError, ValueError):
+            # only a cache: the CSV is still there to load from
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def read_journal(self, offset=0):
+        """Complete journal entries from byte offset on, and the offset they end at."""
+        try:
+            with open(self.journal_path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], 0
+        entries, pos = [], 0
+        with metrics.timed("store.journal_read", self.name) as span:
+            while True:
+                end = data.find(b"\n", pos)
+                if end < 0:
+                    # a line still being appended by another desk, or torn by a crash
+                    break
+                try:
+                    entries.append(json.loads(data[pos:end]))
+                except ValueError:
+                    break
+                pos = end + 1
+            span.rows, span.bytes_read = len(entries), len(data)
+        return entries, offset + pos
+
+    def journal_entries(self):
+        return self.read_journal()[0]
+
+    def apply(self, rows, entry):
+        """Apply one journal entry to rows; returns (key, old, new)."""
+        op = entry.get("op")
+        if op == "put":
+            row = self.make(entry["row"])
+            key = self.norm(entry["row"][self.key])
+            old = rows.get(key)
+            rows[key] = row
+            return key, old, row
+        key = self.norm(entry["key"])
+        old = rows.get(key)
+        if old is None:
+            return key, None, None
+        if op == "set":
+            new = self.changed(old, entry["fields"])
+            rows[key] = new
+            return key, old, new
+        if op == "del":
+            del rows[key]
+            return key, old, None
+        return key, old, old
+
+    def apply_live(self, entry):
+        """Apply an entry to the loaded rows and keep indexes and max_id in step."""
+        key, old, new = self.apply(self.rows, entry)
+        if new is not None and old is None:
+            self.max_id = max(self.max_id, id_number(key))
+        if old is not new:
+            for index in self.indexes.values():
+                index.change(key, old, new)
+
+    def refresh(self):
+        """Catch up with changes on disk since we last looked."""
+        with self.lock:
+            stamp = self.file_stamp()
+            if stamp[0] is None:
+                self.ensure_file()
+                stamp = self.file_stamp()
+            if stamp == self.stamp:
+                return
+            journal_size = stamp[1][1] if stamp[1] else 0
+            if (self.stamp is not None and stamp[0] == self.stamp[0]
+                    and stamp[2] is not None and self.stamp[2] is not None
+                    and stamp[2][1] == self.stamp[2][1]  # same epoch: our offset is still valid
+                    and journal_size >= self.journal_offset):
+                self.catch_up(stamp)
+            else:
+                self.load()
+
+    def catch_up(self, stamp):
+        """Replay journal lines appended (by other desks) since our last read."""
+        entries, offset = self.read_journal(self.journal_offset)
+        if _stat(self.path) != stamp[0]:
+            # compacted while we were reading; our offset means nothing now
+            self.load()
+            return
+        with metrics.timed("store.catch_up", self.name) as span:
+            for entry in entries:
+                self.apply_live(entry)
+            span.rows = len(entries)
+        self.journal_offset = offset
+        self.stamp = stamp
+
+    @contextmanager
+    def transaction(self):
+        """
+        Exclusive access across threads and processes. Memory is caught up
+        on entry, so checks made inside see every desk's writes, and the
+        version is bumped on exit if anything was written. Nests.
+        """
+        with self.lock:
+            if self.txn_depth:
+                self.txn_depth += 1
+                try:
+                    yield self
+                finally:
+                    self.txn_depth -= 1
+                return
+            self.ensure_file()
+            with FileLock(self.lock_path) as lock:
+                self.txn_depth = 1
+                self.dirty = self.rewritten = self.appended = False
+                try:
+                    if os.path.exists(self.staged_done_path):
+                        self.finish_write()
+                    self.refresh()
+                    yield self
+                finally:
+                    self.txn_depth = 0
+                    if self.dirty:
+                        version, epoch = lock.read_version()
+                        lock.write_version(version + 1, epoch + self.rewritten)
+                        self.stamp = self.file_stamp()
+                    appended = self.appended
+        if appended:
+            # outside the locks, so commits from other threads can share the fsync
+            self.syncer.commit()
+
+    def write_csv(self, path, rows):
+        fields = self.fieldnames
+        with metrics.timed("store.write_csv", self.name) as span, \
+                open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(fields)
+            for r in rows:
+                writer.writerow([r.get(name) or "" for name in fields])
+                span.rows += 1
+            sync_file(f)
+            span.bytes_written = f.tell()
+
+    def temp_path(self):
+        return f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    def write(self):
+        """Rewrite the whole CSV from memory and drop the journal."""
+        with self.transaction():
+            self.write_csv(self.staged_path, self.rows.values())
+            with open(self.staged_done_path, "w") as f:
+                sync_file(f)
+            sync_dir(self.path)
+            self.finish_write()
+
+    def finish_write(self):
+        """Swap a staged save in; also completes one cut short by a crash."""
+        if os.path.exists(self.staged_path):
+            replace_file(self.staged_path, self.path)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        os.remove(self.staged_done_path)
+        sync_dir(self.path)
+        self.journal_offset = 0
+        self.stamp = None
+        self.dirty = self.rewritten = True
+
+    # ----- journal -----
+    def log(self, entries):
+        """Apply entries in memory and append them to the journal."""
+        with self.transaction():
+            current = _stat(self.journal_path)
+            if current and current[1] > self.journal_offset:
+                # we are caught up, so anything past our offset is a line torn by a crash
+                os.truncate(self.journal_path, self.journal_offset)
+            for entry in entries:
+                self.apply_live(entry)
+            data = "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in entries).encode("utf-8")
+            with metrics.timed("store.journal_append", self.name) as span:
+                with open(self.journal_path, "ab") as f:
+                    f.write(data)
+                    self.journal_offset = f.tell()
+                span.rows, span.bytes_written = len(entries), len(data)
+            self.dirty = self.appended = True
+            size = self.journal_offset
+        if size > JOURNAL_COMPACT_BYTES:
+            self.compact_in_background()
+
+    def compact_in_background(self):
+        with self.lock:
+            if self.compacting is not None and self.compacting.is_alive():
+                return
+            # not a daemon: exiting mid-write would strand the temp snapshot
+            self.compacting = threading.Thread(target=self.compact)
+            self.compacting.start()
+
+    def compact(self):
+        """Fold the journal into the CSV.
+
+        The snapshot is written without holding the lock so desk writes are
+        not blocked; whatever was journaled meanwhile is kept as the new
+        journal. If another desk compacted first, our snapshot is dropped.
+        """
+        with self.transaction():
+            rows = list(self.rows.values())
+            offset = self.journal_offset
+            base = _stat(self.path)
+        tmp = self.temp_path()
+        snap = tmp + ".snap"
+        try:
+            self.write_csv(tmp, rows)
+            if len(rows) >= SNAPSHOT_MIN_ROWS:
+                # tagged with the new CSV's stat, which the rename below keeps
+                self.write_snapshot(rows, _stat(tmp), snap)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        with self.transaction():
+            if _stat(self.path) != base:
+                os.remove(tmp)
+                if os.path.exists(snap):
+                    os.remove(snap)
+                return
+            tail = b""
+            if os.path.exists(self.journal_path):
+                with open(self.journal_path, "rb") as f:
+                    f.seek(offset)
+                    tail = f.read(self.journal_offset - offset)
+            # a crash between the two replaces leaves the old journal over the
+            # new CSV; replaying it again is harmless (puts/sets/dels are idempotent)
+            replace_file(tmp, self.path)
+            if os.path.exists(snap):
+                os.replace(snap, self.snap_path)
+            if tail:
+                with open(tmp, "wb") as f:
+                    f.write(tail)
+                    sync_file(f)
+                replace_file(tmp, self.journal_path)
+            elif os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            self.journal_offset = len(tail)
+            self.dirty = self.rewritten = True
+
+    # ----- streaming -----
+    def journal_effects(self):
+        """key -> what the journal does to it: ("row", row), ("set", fields) or ("del", None)."""
+        effects = {}
+        for entry in self.journal_entries():
+            op = entry.get("op")
+            if op == "put":
+                effects[str(entry["row"][self.key])] = ("row", entry["row"])
+            elif op == "del":
+                effects[entry["key"]] = ("del", None)
+            elif op == "set":
+                kind, val = effects.get(entry["key"], ("set", {}))
+                if kind != "del":
+                    effects[entry["key"]] = (kind, dict(val, **entry["fields"]))
+        return effects
+
+    def stream(self):
+        """Rows read from disk one at a time (journal applied), without loading the table."""
+        self.ensure_file()
+        effects = self.journal_effects()
+        with metrics.timed("store.stream", self.name) as span:
+            with open(self.path, newline="", encoding="utf-8") as f:
+                span.bytes_read = os.fstat(f.fileno()).st_size
+                for key, r in self.read_csv(f):
+                    span.rows += 1
+                    kind, val = effects.pop(str(key), (None, None))
+                    if kind is None:
+                        yield r
+                    elif kind == "row":
+                        yield self.make(val)
+                    elif kind == "set":
+                        yield self.changed(r, val)
+            for kind, val in effects.values():
+                if kind == "row":
+                    yield self.make(val)
+
+    def scan(self, filters=(), predicate=None):
+        """
+        Yield rows matching every (field, op, value) in filters and then
+        predicate(row). Served from memory when the table is loaded and
+        current, otherwise streamed from disk in constant memory.
+        """
+        with self.lock:
+            resident = self.stamp is not None and self.file_stamp() == self.stamp
+            source = list(self.rows.values()) if resident else None
+        if source is None:
+            source = self.stream()
+        # timed from the first row to the last, including the caller's work in between
+        with metrics.timed("store.scan", self.name) as span:
+            for r in source:
+                span.rows += 1
+                if filters and not match_filters(r, filters):
+                    continue
+                if predicate is None or predicate(r):
+                    yield r
+
+    # ----- point reads without loading -----
+    def use_offsets(self, *fields):
+        """Serve fetch()/fetch_by() on the key and fields from an offset index while not loaded."""
+        self.offsets = OffsetIndex(self.path, self.fieldnames, [self.key] + list(fields))
+
+    def resident(self):
+        with self.lock:
+            return self.stamp is not None and self.file_stamp() == self.stamp
+
+    def from_values(self, values):
+        if self.record is not None:
+            return self.record.from_values(values)
+        return dict(zip(self.fieldnames, values))
+
+    def fetch(self, key):
+        """Like get(), but without loading the table for it when there is an offset index."""
+        if self.offsets is None or self.resident():
+            return self.get(key)
+        self.ensure_file()
+        kind, val = self.journal_effects().get(str(key), (None, None))
+        if kind == "del":
+            return None
+        if kind == "row":
+            return self.make(val)
+        norm = self.norm(key)
+        for values in self.offsets.rows(self.key, key):
+            row = self.from_values(values)
+            if self.norm(row[self.key]) == norm:
+                return self.changed(row, val) if kind == "set" else row
+        return None
+
+    def fetch_by(self, field, value):
+        """Rows whose field equals value; from memory when loaded, else via the offset index."""
+        want = self.encode(field, value)
+        if self.offsets is None or self.resident():
+            for index in self.indexes.values():
+                if isinstance(index, Index) and index.field == field and index.where is None:
+                    return self.lookup_index(index, value)
+            return [r for r in self.all() if self.raw(r, field) == want]
+        self.ensure_file()
+        effects = self.journal_effects()
+        out = []
+        for values in self.offsets.rows(field, value):
+            row = self.from_values(values)
+            kind, val = effects.pop(str(row[self.key]), (None, None))
+            if kind == "row":
+                row = self.make(val)
+            elif kind == "set":
+                row = self.changed(row, val)
+            if kind != "del" and self.raw(row, field) == want:
+                out.append(row)
+        # rows the journal added, or moved to this value
+        for key, (kind, val) in effects.items():
+            if kind == "row":
+                row = self.make(val)
+            elif kind == "set" and field in val:
+                row = self.fetch(key)
+            else:
+                continue
+            if row is not None and self.raw(row, field) == want:
+                out.append(row)
+        return out
+
+    def lookup_index(self, index, value):
+        with self.lock:
+            self.refresh()
+            return index.get(value)
+
+    def patch(self, key, changes, expect=None):
+        """
+        Set fields on one row, only if its current values include expect
+        (e.g. {"return_date": ""}); True if it was changed. A table that
+        isn't loaded stays unloaded: the row is read with fetch() and the
+        change appended to the journal under the lock.
+        """
+        expect = expect or {}
+        with self.lock:
+            if self.offsets is None or self.stamp is not None or os.path.exists(self.staged_done_path):
+                with self.transaction():
+                    row = self.rows.get(self.norm(key))
+                    if row is None or any(row.get(f) != v for f, v in expect.items()):
+                        return False
+                    self.log([{"op": "set", "key": str(key), "fields": changes}])
+                    return True
+            self.ensure_file()
+            with FileLock(self.lock_path) as lock:
+                row = self.fetch(key)
+                if row is None or any(row.get(f) != v for f, v in expect.items()):
+                    return False
+                # after the last complete line: a torn one (crash) is dropped
+                end = self.read_journal()[1]
+                current = _stat(self.journal_path)
+                if current and current[1] > end:
+                    os.truncate(self.journal_path, end)
+                data = (json.dumps({"op": "set", "key": str(key), "fields": changes},
+                                   ensure_ascii=False) + "\n").encode("utf-8")
+                with metrics.timed("store.journal_append", self.name) as span:
+                    with open(self.journal_path, "ab") as f:
+                        f.write(data)
+                    span.rows, span.bytes_written = 1, len(data)
+                version, epoch = lock.read_version()
+                lock.write_version(version + 1, epoch)
+        self.syncer.commit()
+        return True
+
+    # ----- reads -----
+    # Returned rows are shared with the cache; treat them as read-only and
+    # go through insert/update/delete to change anything.
+    def all(self):
+        self.refresh()
+        return list(self.rows.values())
+
+    def get(self, key):
+        self.refresh()
+        return self.rows.get(self.norm(key))
+
+    def version(self):
+        """Token that changes whenever the table's contents may have (for ETags, caches)."""
+        with self.lock:
+            self.refresh()
+            return self.stamp
+
+    def mapping(self):
+        """Read-only ID -> row mapping, for joins that look up many keys."""
+        self.refresh()
+        if self.record is None:
+            return self.rows
+        return RowsByKey(self.rows, self.norm)
+
+    # ----- writes -----
+    def insert(self, row):
+        with self.transaction():
+            self.log([{"op": "put", "row": row}])
+
+    def insert_many(self, rows):
+        """Add many rows with a single journal append."""
+        with self.transaction():
+            if rows:
+                self.log([{"op": "put", "row": r} for r in rows])
+
+    def update(self, key, changes):
+        with self.transaction():
+            if self.norm(key) not in self.rows:
+                return False
+            self.log([{"op": "set", "key": str(key), "fields": changes}])
+            return True
+
+    def update_many(self, changes_by_key):
+        """Apply {key: changes} in one go with a single journal append."""
+        with self.transaction():
+            entries = [{"op": "set", "key": str(k), "fields": c}
+                       for k, c in changes_by_key.items() if self.norm(k) in self.rows]
+            if entries:
+                self.log(entries)
+            return [e["key"] for e in entries]
+
+    def delete(self, key):
+        with self.transaction():
+            if self.norm(key) not in self.rows:
+                return False
+            self.log([{"op": "del", "key": str(key)}])
+            return True
+
+    def replace(self, rows):
+        """Swap in a whole new set of rows (used by save_*)."""
+        with self.transaction():
+            self.rows = {self.norm(r.get(self.key) or ""): self.make(r) for r in rows}
+            self.max_id = max(map(id_number, self.rows), default=0)
+            self.write()
+            for index in self.indexes.values():
+                index.reset(self.rows)
+
+    # ----- ID sequence -----
+    def read_seq(self):
+        try:
+            with open(self.seq_path, encoding="utf-8") as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def write_seq(self, value):
+        tmp = self.seq_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(str(value))
+        os.replace(tmp, self.seq_path)
+
+    def next_ids(self, count=1):
+        """Reserve count new IDs (as strings), without scanning the rows."""
+        with self.transaction():
+            start = max(self.read_seq(), self.max_id) + 1
+            self.write_seq(start + count - 1)
+            return [str(i) for i in range(start, start + count)]
+
+    # ----- secondary indexes -----
+    def add_index(self, name, field, where=None):
+        """Maintain field value -> rows; where=(field, value) keeps only
+        rows whose field equals value (e.g. open loans)."""
+        self.attach_index(name, Index(field, where, self.raw, self.encode))
+
+    def attach_index(self, name, index):
+        """Register any object with reset(rows) and change(key, old, new)."""
+        with self.lock:
+            index.reset(self.rows)
+            self.indexes[name] = index
+
+    def lookup(self, name, value):
+        with self.lock:
+            self.refresh()
+            return self.indexes[name].get(value)
+
+    def search(self, name, query, within=None):
+        """Rows matching query in a TextIndex attached as name, best first;
+        within: only look at these rows (see TextIndex.search)."""
+        keys = None if within is None else [self.raw(r, self.key) for r in within]
+        with self.lock:
+            self.refresh()
+            return [self.rows[k] for k in self.indexes[name].search(query, keys)]
+
+
+# ----- scan filters -----
+# (field, op, value) triples that both backends can evaluate; values are
+# compared as strings, which works for IDs of equal width and ISO dates.
+FILTER_OPS = {
+    "=": operator.eq, "!=": operator.ne,
+    "<": operator.lt, "<=": operator.le,
+    ">": operator.gt, ">=": operator.ge,
+}
+
+def match_filters(row, filters):
+    for field, op, value in filters:
+        if not FILTER_OPS[op](row.get(field) or "", value):
+            return False
+    return True
+
+# ----- bulk input -----
+def read_records(path):
+    """Stream dicts from a .csv (header row) or .jsonl file."""
+    if path.lower().endswith((".jsonl", ".ndjson")):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(path, newline="", encoding="utf-8") as f:
+            yield from csv.DictReader(f)
+
+
+class RowsByKey(Mapping):
+    """Read-only view of a record table's rows that accepts string IDs."""
+    def __init__(self, rows, norm):
+        self.rows = rows
+        self.norm = norm
+
+    def __getitem__(self, key):
+        return self.rows[self.norm(key)]
+
+    def get(self, key, default=None):
+        return self.rows.get(self.norm(key), default)
+
+    def __contains__(self, key):
+        return self.norm(key) in self.rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+
+class Index:
+    def __init__(self, field, where=None, raw=None, encode=None):
+        self.field = field
+        self.raw = raw or (lambda row, field: row.get(field) or "")
+        self.encode = encode or (lambda field, value: str(value))
+        self.where = (where[0], self.encode(where[0], where[1])) if where else None
+        self.buckets = {}
+
+    def reset(self, rows):
+        self.buckets = {}
+        for key, row in rows.items():
+            self.add(key, row)
+
+    def matches(self, row):
+        return self.where is None or self.raw(row, self.where[0]) == self.where[1]
+
+    def add(self, key, row):
+        if self.matches(row):
+            self.buckets.setdefault(self.raw(row, self.field), {})[key] = row
+
+    def remove(self, key, row):
+        value = self.raw(row, self.field)
+        bucket = self.buckets.get(value)
+        if bucket is not None and bucket.pop(key, None) is not None and not bucket:
+            del self.buckets[value]
+
+    def change(self, key, old, new):
+        if old is not None:
+            self.remove(key, old)
+        if new is not None:
+            self.add(key, new)
+
+    def get(self, value):
+        return list(self.buckets.get(self.encode(self.field, value), {}).values())
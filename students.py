@@ -1,7 +1,12 @@
 # students.py
-import csv
 import os
 import sys
+import cache
+import config
+import metrics
+from store import as_text, open_table
+from records import Student
+from search import TextIndex
 
 # ----- path helpers -----
 def base_dir():
@@ -11,91 +16,91 @@ def base_dir():
         base = os.path.dirname(os.path.abspath(__file__))
     return base
 
-DATA_DIR = os.path.join(base_dir(), "data")
+DATA_DIR = config.DATA_DIR or os.path.join(base_dir(), "data")
 STUDENTS_CSV = os.path.join(DATA_DIR, "students.csv")
 
+FIELDNAMES = ["student_id", "name", "semester", "phone"]
+students_table = open_table(STUDENTS_CSV, FIELDNAMES, "student_id", Student)
+students_table.attach_index("text", TextIndex({"name": 3, "semester": 1, "phone": 1}))
+
 # ----- initialization -----
 def ensure_students_file():
-    os.makedirs(DATA_DIR, exist_ok=True)
-    if not os.path.exists(STUDENTS_CSV):
-        with open(STUDENTS_CSV, "w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow(["student_id", "name", "semester", "phone"])
+    students_table.ensure_file()
 
 # ----- IO -----
+@metrics.instrument("students.load_students", rows=True)
 def load_students():
-    ensure_students_file()
-    rows = []
-    with open(STUDENTS_CSV, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for r in reader:
-            rows.append(r)
-    return rows
+    return students_table.all()
 
 def save_students(rows):
-    ensure_students_file()
-    with open(STUDENTS_CSV, "w", newline="", encoding="utf-8") as f:
-        fieldnames = ["student_id", "name", "semester", "phone"]
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        for r in rows:
-            writer.writerow(r)
+    students_table.replace(rows)
 
 # ----- helpers -----
 def next_student_id():
-    rows = load_students()
-    max_id = 0
-    for r in rows:
-        try:
-            v = int(r.get("student_id", 0))
-            if v > max_id: max_id = v
-        except:
-            continue
-    return str(max_id + 1)
+    return students_table.next_ids()[0]
 
 # ----- CRUD -----
+@metrics.instrument("students.add_student")
 def add_student(name, cls="", phone=""):
     sid = next_student_id()
-    rows = load_students()
-    rows.append({"student_id": sid, "name": name, "semester": cls, "phone": phone})
-    save_students(rows)
+    students_table.insert({"student_id": sid, "name": name, "semester": cls, "phone": phone})
     return sid
 
+@metrics.instrument("students.add_students_bulk")
+def add_students_bulk(items):
+    """
+    Add many students with one write. items is any iterable of dicts with
+    name/semester/phone (or tuples in that order). Returns
+    (new ids, [(item number, error)]).
+    """
+    rows, errors = [], []
+    for n, item in enumerate(items, 1):
+        if not isinstance(item, dict):
+            item = dict(zip(["name", "semester", "phone"], item))
+        name = as_text(item.get("name"))
+        if not name:
+            errors.append((n, "Name required."))
+            continue
+        rows.append({
+            "name": name,
+            "semester": as_text(item.get("semester")),
+            "phone": as_text(item.get("phone"))
+        })
+    ids = students_table.next_ids(len(rows)) if rows else []
+    for sid, row in zip(ids, rows):
+        row["student_id"] = sid
+    students_table.insert_many(rows)
+    return ids, errors
+
+@metrics.instrument("students.update_student")
 def update_student(student_id, name=None, cls=None, phone=None):
-    rows = load_students()
-    updated = False
-    for r in rows:
-        if r["student_id"] == str(student_id):
-            if name is not None: r["name"] = name
-            if cls is not None: r["semester"] = cls
-            if phone is not None: r["phone"] = phone
-            updated = True
-            break
-    if updated:
-        save_students(rows)
-    return updated
+    changes = {}
+    if name is not None: changes["name"] = name
+    if cls is not None: changes["semester"] = cls
+    if phone is not None: changes["phone"] = phone
+    return students_table.update(student_id, changes)
 
+@metrics.instrument("students.delete_student")
 def delete_student(student_id):
-    rows = load_students()
-    new_rows = [r for r in rows if r["student_id"] != str(student_id)]
-    if len(new_rows) != len(rows):
-        save_students(new_rows)
-        return True
-    return False
+    return students_table.delete(student_id)
 
+@metrics.instrument("students.find_student")
 def find_student(student_id):
-    for r in load_students():
-        if r["student_id"] == str(student_id):
-            return r
-    return None
+    return students_table.get(student_id)
+
+def iter_students(predicate=None):
+    """Stream students (optionally only those where predicate(row) is true)."""
+    return students_table.scan(predicate=predicate)
 
-def search_students(query):
-    q = (query or "").strip().lower()
+@metrics.instrument("students.search_students", rows=True)
+@cache.cached("students.search_students", students_table)
+def search_students(query, within=None):
+    """Same matching rules (and within) as search_books, over name/semester/phone."""
+    q = (query or "").strip()
     if not q:
         return load_students()
-    out = []
-    for r in load_students():
-        if q in r.get("name","").lower() or q == r.get("student_id","") or q in r.get("semester","").lower() or q in r.get("phone",""):
-            out.append(r)
+    out = students_table.search("text", q, within)
+    exact = find_student(q)
+    if exact is not None:
+        out = [exact] + [r for r in out if r["student_id"] != exact["student_id"]]
     return out
-
@@ -0,0 +1,128 @@
+# tasks.py
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+# ---------- Background tasks for the Tk app ----------
+# Data work (books/students/borrow calls, reports) runs on a small thread
+# pool; results come back through a queue that the Tk thread drains with
+# root.after, so callbacks always run on the Tk thread and the mainloop is
+# never blocked on file I/O.
+#
+# Tasks submitted on the same channel supersede each other: a queued one is
+# cancelled outright and a running one has its result dropped (and
+# task.cancelled set, for functions that want to stop early). That is what
+# keeps fast typing in a search box from piling up stale queries.
+
+POLL_MS = 15
+
+class Task:
+    def __init__(self, runner, channel):
+        self.runner = runner
+        self.channel = channel
+        self.cancelled = False
+        self.future = None
+        self.queued_at = time.perf_counter()
+
+    def progress(self, done, total):
+        """Report progress from inside the task; delivered to on_progress."""
+        if not self.cancelled:
+            self.runner.results.put((self, "progress", (done, total)))
+
+class TaskRunner:
+    def __init__(self, root, workers=2, on_error=None):
+        self.root = root
+        self.on_error = on_error
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="library-io")
+        self.results = queue.Queue()
+        self.callbacks = {}
+        self.latest = {}
+        self.lock = threading.Lock()
+        self.polling = False
+
+    def run(self, fn, *args, on_done=None, on_error=None, on_progress=None, channel=None, with_task=False):
+        """
+        Run fn(*args) off the Tk thread. on_done(result) / on_error(exc) /
+        on_progress(done, total) are called on the Tk thread. With
+        with_task=True, fn gets the Task as its first argument so it can call
+        task.progress() and check task.cancelled.
+        """
+        task = Task(self, channel)
+        with self.lock:
+            if channel is not None:
+                prev = self.latest.get(channel)
+                if prev is not None:
+                    prev.cancelled = True
+                    if prev.future is not None:
+                        prev.future.cancel()
+                self.latest[channel] = task
+            self.callbacks[task] = (on_done, on_error, on_progress)
+            task.future = self.pool.submit(self.call, task, fn, args, with_task)
+        if not self.polling:
+            self.polling = True
+            self.root.after(POLL_MS, self.poll)
+        return task
+
+    def call(self, task, fn, args, with_task):
+        if task.cancelled:
+            self.results.put((task, "cancelled", None))
+            return
+        # time spent waiting for a free worker, then running
+        metrics.record("gui.task_wait", "", time.perf_counter() - task.queued_at)
+        try:
+            with metrics.timed("gui.task_run"):
+                result = fn(task, *args) if with_task else fn(*args)
+        except Exception as e:
+            self.results.put((task, "error", e))
+        else:
+            self.results.put((task, "done", result))
+
+    def cancel(self, channel):
+        with self.lock:
+            task = self.latest.pop(channel, None)
+        if task is not None:
+            task.cancelled = True
+            task.future.cancel()
+
+    def poll(self):
+        while True:
+            try:
+                task, kind, value = self.results.get_nowait()
+            except queue.Empty:
+                break
+            # callbacks run on the Tk thread: everything here is UI lag
+            with metrics.timed("gui.callback"):
+                self.deliver(task, kind, value)
+        with self.lock:
+            # cancelled futures never reach call(), so drop their callbacks here
+            for t in [t for t in self.callbacks if t.future.cancelled()]:
+                del self.callbacks[t]
+            self.polling = bool(self.callbacks)
+        if self.polling:
+            self.root.after(POLL_MS, self.poll)
+
+    def deliver(self, task, kind, value):
+        if kind == "progress":
+            on_progress = self.callbacks.get(task, (None, None, None))[2]
+            if on_progress is not None and not task.cancelled:
+                on_progress(*value)
+            return
+        with self.lock:
+            on_done, on_error, _ = self.callbacks.pop(task, (None, None, None))
+            if self.latest.get(task.channel) is task:
+                del self.latest[task.channel]
+        if task.cancelled or kind == "cancelled":
+            return
+        if kind == "error":
+            on_error = on_error or self.on_error
+            if on_error is not None:
+                on_error(value)
+            else:
+                self.root.report_callback_exception(type(value), value, value.__traceback__)
+        elif on_done is not None:
+            on_done(value)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
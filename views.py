@@ -0,0 +1,156 @@
+# views.py
+import threading
+from collections import Counter
+
+# ----- materialized circulation views -----
+# Aggregates for the Status column and the Reports tab, kept up to date as
+# rows change instead of being recomputed from borrow.csv on every call:
+#   loans_by_book    book_id -> loans ever made (top borrowed titles)
+#   open_by_book     book_id -> open loans (what is out right now)
+#   open_by_student  student_id -> open loans
+#   available        book_id -> book row, for books with no open loan
+#
+# Circulation is attached to the books and borrow tables like any other
+# index, so it is rebuilt whenever a table is (re)loaded from disk - after
+# a restart, an outside edit or another desk's compaction - and patched on
+# every add/delete/borrow/return in between. Like TextIndex, a rebuild is
+# deferred to the first query.
+#
+# IDs are kept as the strings rows hand out (r["book_id"]), so the view
+# works the same over plain dict rows, records and the SQLite backend.
+
+class Listener:
+    """The reset/change pair Table.attach_index expects, for one side of a view."""
+    def __init__(self, reset, change):
+        self.reset = reset
+        self.change = change
+
+class Circulation:
+    def __init__(self, books_table, borrow_table):
+        self.books_table = books_table
+        self.borrow_table = borrow_table
+        self.lock = threading.RLock()
+        self.books = {}
+        self.available = {}
+        self.loans_by_book = Counter()
+        self.open_by_book = Counter()
+        self.open_by_student = Counter()
+        self.items_out = 0
+        self.pending_books = None
+        self.pending_loans = None
+        books_table.attach_index("circulation", Listener(self.reset_books, self.change_book))
+        borrow_table.attach_index("circulation", Listener(self.reset_loans, self.change_loan))
+
+    # ----- books side -----
+    def reset_books(self, rows):
+        with self.lock:
+            self.pending_books = rows
+
+    def change_book(self, key, old, new):
+        with self.lock:
+            if self.pending_books is not None:
+                return
+            bid = (new if new is not None else old)["book_id"]
+            if new is None:
+                self.books.pop(bid, None)
+                self.available.pop(bid, None)
+                return
+            self.books[bid] = new
+            if not self.open_by_book[bid]:
+                self.available[bid] = new
+
+    # ----- loans side -----
+    def reset_loans(self, rows):
+        with self.lock:
+            self.pending_loans = rows
+
+    def change_loan(self, key, old, new):
+        with self.lock:
+            if self.pending_loans is not None:
+                return
+            if old is not None:
+                self.count_loan(old, -1)
+            if new is not None:
+                self.count_loan(new, 1)
+
+    def count_loan(self, r, n):
+        bid = r["book_id"]
+        self.loans_by_book[bid] += n
+        if not self.loans_by_book[bid]:
+            del self.loans_by_book[bid]
+        if r["return_date"]:
+            return
+        sid = r["student_id"]
+        self.open_by_book[bid] += n
+        self.open_by_student[sid] += n
+        self.items_out += n
+        if not self.open_by_student[sid]:
+            del self.open_by_student[sid]
+        if self.open_by_book[bid]:
+            self.available.pop(bid, None)
+        else:
+            del self.open_by_book[bid]
+            if bid in self.books:
+                self.available[bid] = self.books[bid]
+
+    # ----- deferred rebuilds -----
+    def build(self):
+        # table lock first, then ours: the same order the tables use when
+        # they call change(), and never both tables' locks at once
+        if self.pending_books is not None:
+            with self.books_table.lock, self.lock:
+                if self.pending_books is not None:
+                    rows, self.pending_books = self.pending_books, None
+                    self.books = {r["book_id"]: r for _, r in list(rows.items())}
+                    self.rebuild_available()
+        if self.pending_loans is not None:
+            with self.borrow_table.lock, self.lock:
+                if self.pending_loans is not None:
+                    rows, self.pending_loans = self.pending_loans, None
+                    self.loans_by_book = Counter()
+                    self.open_by_book = Counter()
+                    self.open_by_student = Counter()
+                    self.items_out = 0
+                    for _, r in list(rows.items()):
+                        self.loans_by_book[r["book_id"]] += 1
+                        if not r["return_date"]:
+                            self.open_by_book[r["book_id"]] += 1
+                            self.open_by_student[r["student_id"]] += 1
+                            self.items_out += 1
+                    self.rebuild_available()
+
+    def rebuild_available(self):
+        self.available = {bid: b for bid, b in self.books.items() if not self.open_by_book[bid]}
+
+    def current(self):
+        """Catch both tables up with disk, then the view."""
+        self.books_table.refresh()
+        self.borrow_table.refresh()
+        self.build()
+
+    # ----- queries -----
+    def borrowed_ids(self):
+        self.current()
+        with self.lock:
+            return set(self.open_by_book)
+
+    def available_books(self):
+        self.current()
+        with self.lock:
+            return list(self.available.values())
+
+    def count_items_out(self):
+        self.current()
+        with self.lock:
+            return self.items_out
+
+    def top_borrowed(self, n=10):
+        """[(book_id, loans)] for the n most borrowed books."""
+        self.current()
+        with self.lock:
+            return self.loans_by_book.most_common(n)
+
+    def open_loans_by_student(self):
+        self.current()
+        with self.lock:
+            return dict(self.open_by_student)
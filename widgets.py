@@ -0,0 +1,183 @@
+# widgets.py
+from tkinter import ttk
+import metrics
+
+# ---------- Paged Treeview ----------
+# A Treeview that only materializes the rows the user can actually reach:
+# the first page is inserted up front and the next page is appended when
+# the scrollbar gets near the bottom. Rows are kept as plain Python
+# objects and turned into Treeview values only when inserted, so loading
+# a 200k-row table costs one list, not 200k widget items.
+#
+# Clicking a column heading sorts the in-memory rows (numbers numerically,
+# text case-insensitively) and repeats clicks toggle the direction. New
+# rows for a sorted view are sorted before they are shown. Given a
+# TaskRunner, sorting happens on its workers (100k titles take about half
+# a second) and the old rows stay up until the sorted ones arrive.
+#
+# Given key(row) -> unique ID, a new set of rows is applied as a diff:
+# items that drop out are detached (kept for later), those that stay are
+# left alone or moved, and only new ones are inserted. Search-as-you-type
+# mostly narrows the list, which then costs a few detaches per keystroke.
+
+PAGE_SIZE = 200
+SPARE_PAGES = 5  # detached items kept for reuse, in pages
+
+def sort_key(v):
+    if isinstance(v, (int, float)):
+        return (0, v, "")
+    s = str(v)
+    try:
+        return (0, float(s), "")
+    except ValueError:
+        return (1, 0, s.lower())
+
+class PagedTree(ttk.Frame):
+    def __init__(self, master, columns, widths, page_size=PAGE_SIZE, runner=None):
+        super().__init__(master)
+        self.columns = columns
+        self.page_size = page_size
+        self.runner = runner
+        self.channel = f"sort-{id(self)}"
+        self.pending = None   # rows being sorted, to show when done
+        self.rows = []
+        self.values = lambda r: r
+        self.key = None
+        self.items = {}       # iid -> values, for keyed rows (attached or not)
+        self.detached = set()
+        self.shown = 0
+        self.fill_queued = False
+        self.sort_col = None
+        self.sort_desc = False
+
+        self.tree = ttk.Treeview(self, columns=columns, show="headings")
+        self.vsb = ttk.Scrollbar(self, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self.on_scroll)
+        for c, w in zip(columns, widths):
+            self.tree.heading(c, text=c, command=lambda c=c: self.sort_by(c))
+            self.tree.column(c, width=w, anchor="w")
+        self.status = ttk.Label(self, anchor="w")
+
+        self.status.pack(side="bottom", fill="x")
+        self.vsb.pack(side="right", fill="y")
+        self.tree.pack(side="left", fill="both", expand=True)
+
+    def set_rows(self, rows, values=None, key=None):
+        """Show rows; values(row) -> tuple of column values (default: row itself),
+        key(row) -> unique ID to update the items in place (see above)."""
+        rows = list(rows)
+        if values is not None:
+            self.values = values
+        if key is not None:
+            self.key = key
+        if self.sort_col is not None:
+            self.sort_rows(rows)
+            return
+        if self.runner is not None:
+            self.runner.cancel(self.channel)  # a sort still running is for older rows
+        self.pending = None
+        self.rows = rows
+        self.reset()
+
+    def reset(self):
+        if self.key is None:
+            with metrics.timed("gui.tree_clear"):
+                self.tree.delete(*self.tree.get_children())
+        self.shown = 0
+        self.fill()
+
+    def fill(self):
+        self.fill_queued = False
+        end = min(self.shown + self.page_size, len(self.rows))
+        with metrics.timed("gui.tree_insert") as span:
+            if self.key is None:
+                for r in self.rows[self.shown:end]:
+                    self.tree.insert("", "end", values=self.values(r))
+            else:
+                self.place(self.rows[self.shown:end], self.shown)
+            span.rows = end - self.shown
+        self.shown = end
+        self.status.configure(text=f"{len(self.rows)} rows" if end == len(self.rows)
+                              else f"Showing {end} of {len(self.rows)} rows (scroll for more)")
+
+    def place(self, rows, start):
+        """Make rows the items from position start on, reusing existing ones."""
+        tree, items = self.tree, self.items
+        ids = [str(self.key(r)) for r in rows]
+        kept = []
+        if start == 0:
+            wanted = set(ids)
+            current = tree.get_children()
+            gone = [i for i in current if i not in wanted]
+            if gone:
+                tree.detach(*gone)
+                self.detached.update(gone)
+            kept = [i for i in current if i in wanted]
+        # kept holds the old items still wanted, in their current order; the
+        # first one not yet placed always sits right after the placed ones
+        placed, j, n = set(), 0, start
+        for iid, r in zip(ids, rows):
+            if iid in placed or (start and iid in items and iid not in self.detached):
+                continue  # listed twice; an item can only be shown once
+            while j < len(kept) and kept[j] in placed:
+                j += 1
+            values = self.values(r)
+            placed.add(iid)
+            n += 1
+            if j < len(kept) and kept[j] == iid:
+                j += 1
+            elif iid in items:
+                tree.move(iid, "", n - 1)
+                self.detached.discard(iid)
+            else:
+                tree.insert("", n - 1, iid=iid, values=values)
+                items[iid] = values
+                continue
+            if items[iid] != values:
+                tree.item(iid, values=values)
+                items[iid] = values
+        if len(self.detached) > SPARE_PAGES * self.page_size:
+            tree.delete(*self.detached)
+            for iid in self.detached:
+                del items[iid]
+            self.detached.clear()
+
+    def on_scroll(self, first, last):
+        self.vsb.set(first, last)
+        if self.shown < len(self.rows) and float(last) > 0.9 and not self.fill_queued:
+            self.fill_queued = True
+            self.after_idle(self.fill)
+
+    # ---------- sorting ----------
+    def sort_by(self, col):
+        if self.sort_col == col:
+            self.sort_desc = not self.sort_desc
+        else:
+            self.sort_col, self.sort_desc = col, False
+        for c in self.columns:
+            arrow = (" ▼" if self.sort_desc else " ▲") if c == col else ""
+            self.tree.heading(c, text=c + arrow)
+        self.sort_rows(self.rows if self.pending is None else self.pending)
+
+    def sort_rows(self, rows):
+        """Show rows sorted by the current column (rows itself is left as it is)."""
+        i, desc, values = self.columns.index(self.sort_col), self.sort_desc, self.values
+
+        def sort():
+            with metrics.timed("gui.tree_sort") as span:
+                out = sorted(rows, key=lambda r: sort_key(values(r)[i]), reverse=desc)
+                span.rows = len(out)
+            return out
+        if self.runner is None:
+            self.show_sorted(sort())
+            return
+        self.pending = rows
+        self.status.configure(text=f"Sorting {len(rows)} rows...")
+        self.runner.run(sort, on_done=self.show_sorted, channel=self.channel)
+
+    def show_sorted(self, rows):
+        if not self.winfo_exists():
+            return  # the view was replaced while sorting
+        self.pending = None
+        self.rows = rows
+        self.reset()